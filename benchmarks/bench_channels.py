@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Load test of whole channels against the stub ffmpeg/packager in benchmarks/stubs:
+# commandline build time, channel start latency (start() and until the first encoder progress),
+# thumbnail cycle overhead, child reaping latency and supervisor CPU for 1/10/100 channels.
+# Every encoder dies once halfway through the run, so reaping and restarts are exercised too.
+# Results are printed and written as JSON (one record per metric) to track them over time.
+# A channel whose tick() raises is checked to be stopped and removed without ending the others.
+# usage: python benchmarks/bench_channels.py [channel_counts] [seconds] [results.json]
+#        python benchmarks/bench_channels.py 1,10,100 10 results.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import resource
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'dashsegmenter'))
+os.environ['PATH'] = os.path.join(BENCHMARKS, 'stubs') + os.pathsep + os.environ.get('PATH', '')
+
+import internal_settings
+import streams
+import supervisor
+
+LADDER = (
+    ('1080p', 5000000, 1920, 1080, 30),
+    ('720p', 2500000, 1280, 720, 30),
+    ('480p', 1200000, 854, 480, 30),
+    ('360p', 800000, 640, 360, 30),
+)
+THUMBNAIL_INTERVAL = 1 # seconds
+BUILD_REPEAT = 500
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    return {'p50': at(0.5), 'p95': at(0.95), 'max': values[-1], 'count': len(values)}
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return own.ru_utime + own.ru_stime
+
+def make_controller(index, output_root):
+    output_path = os.path.join(output_root, 'channel%03d' % index)
+    if not os.path.isdir(output_path):
+        os.mkdir(output_path)
+
+    video = [streams.VideoStream(*rung) for rung in LADDER]
+    settings = streams.Settings(internal_settings.STARTING_PORT_NUMBER + index * internal_settings.PORT_INCREMENT, 2,
+        THUMBNAIL_INTERVAL, video[-1], 'udp://127.0.0.1:1', output_path)
+
+    controller = streams.StreamsController(settings)
+    for stream in video + [streams.AudioStream('audio', 128000)]:
+        controller.add_stream(stream)
+
+    return controller
+
+def bench_build(output_root):
+    controller = make_controller(0, output_root)
+
+    start = time.time()
+    for _ in xrange(BUILD_REPEAT):
+        controller._assign_ports()
+        controller._build_commandlines()
+    elapsed = time.time() - start
+
+    return [{'name': 'commandline_build', 'channels': 1, 'unit': 'us', 'value': elapsed / BUILD_REPEAT * 1e6}]
+
+class Probe(object):
+    """Wraps controller methods to timestamp what the benchmark is interested in."""
+    def __init__(self, controller):
+        super(Probe, self).__init__()
+        self.controller = controller
+        self.start_time = None
+        self.start_latency = None
+        self.first_progress = None
+        self.thumbnail_spawn = []
+        self.thumbnail_cycle = []
+        self.exits = {} # pid -> time child_exited() was called
+
+        self._thumbnail_started = None
+        self._wrap('start', self._start)
+        self._wrap('handle_readable', self._handle_readable)
+        self._wrap('_generate_thumbnail', self._generate_thumbnail)
+        self._wrap('_move_thumbnail', self._move_thumbnail)
+        self._wrap('child_exited', self._child_exited)
+
+    def _wrap(self, name, wrapper):
+        original = getattr(self.controller, name)
+        setattr(self.controller, name, lambda *args: wrapper(original, *args))
+
+    def _start(self, original):
+        self.start_time = time.time()
+        original()
+        self.start_latency = time.time() - self.start_time
+
+    def _handle_readable(self, original, fd):
+        original(fd)
+        if self.first_progress == None and any(stats.get('updated') for stats in self.controller.stats().itervalues()):
+            self.first_progress = time.time() - self.start_time
+
+    def _generate_thumbnail(self, original, now):
+        self._thumbnail_started = time.time()
+        original(now)
+        self.thumbnail_spawn.append(time.time() - self._thumbnail_started)
+
+    def _move_thumbnail(self, original):
+        original()
+        if self._thumbnail_started != None:
+            self.thumbnail_cycle.append(time.time() - self._thumbnail_started)
+            self._thumbnail_started = None
+
+    def _child_exited(self, original, pid, status):
+        self.exits[pid] = time.time()
+        original(pid, status)
+
+def bench_channels(count, seconds, output_root):
+    exit_log = os.path.join(output_root, 'exits.log')
+    os.environ['STUB_EXIT_LOG'] = exit_log
+    os.environ['STUB_FFMPEG_LIFE'] = str(seconds / 2.0)
+
+    channels = supervisor.Supervisor()
+    probes = []
+    for index in xrange(count):
+        probes.append(Probe(channels.add_controller(make_controller(index, output_root))))
+
+    # the first channel ends the run: its deadline wakes the supervisor up, its tick stops everything
+    end = time.time() + seconds
+    first = probes[0].controller
+    next_deadline, tick = first.next_deadline, first.tick
+
+    def bounded_next_deadline():
+        deadline = next_deadline()
+        return end if deadline == None else min(deadline, end)
+
+    def stopping_tick(now):
+        if now >= end:
+            channels.stop()
+        tick(now)
+
+    first.next_deadline, first.tick = bounded_next_deadline, stopping_tick
+
+    cpu_before, wall_before = cpu_seconds(), time.time()
+    channels.run()
+    cpu, wall = cpu_seconds() - cpu_before, time.time() - wall_before
+
+    exited = {}
+    if os.path.exists(exit_log):
+        for line in open(exit_log):
+            pid, exit_time = line.split()
+            exited[int(pid)] = float(exit_time)
+        os.unlink(exit_log)
+
+    reaping = [probe.exits[pid] - exit_time for probe in probes for pid, exit_time in exited.iteritems() if pid in probe.exits]
+    restarts = sum(stats.get('restarts', 0) for probe in probes for stats in probe.controller.stats().itervalues())
+
+    def ms(values):
+        return dict((key, value * 1000 if key != 'count' else value) for key, value in percentiles(values).iteritems())
+
+    results = [
+        dict(ms([probe.start_latency for probe in probes if probe.start_latency != None]), name='channel_start'),
+        dict(ms([probe.first_progress for probe in probes if probe.first_progress != None]), name='first_progress'),
+        dict(ms([value for probe in probes for value in probe.thumbnail_spawn]), name='thumbnail_spawn'),
+        dict(ms([value for probe in probes for value in probe.thumbnail_cycle]), name='thumbnail_cycle'),
+        dict(ms(reaping), name='reap_latency'),
+        {'name': 'supervisor_cpu', 'value': cpu / wall / count * 1000, 'unit': 'ms/s per channel'},
+        {'name': 'restarts', 'value': restarts, 'unit': 'count'},
+    ]
+
+    for result in results:
+        result['channels'] = count
+        result.setdefault('unit', 'ms')
+
+    return results
+
+def check_failing_channel(seconds, output_root):
+    exits = {} # controller -> time it was removed
+    channels = supervisor.Supervisor(on_channel_exit=lambda controller: exits.setdefault(controller, time.time()))
+    healthy = channels.add_controller(make_controller(0, output_root))
+    failing = channels.add_controller(make_controller(1, output_root))
+
+    end = time.time() + seconds
+    fail_at = time.time() + seconds / 2.0
+    next_deadline, tick = healthy.next_deadline, healthy.tick
+    still_running = []
+
+    def bounded_next_deadline():
+        deadline = next_deadline()
+        return end if deadline == None else min(deadline, end)
+
+    def stopping_tick(now):
+        if now >= end and not still_running:
+            still_running.append(healthy.running)
+            channels.stop()
+        tick(now)
+
+    def failing_tick(now):
+        if now >= fail_at:
+            raise RuntimeError('tick failure injected by the benchmark')
+
+    healthy.next_deadline, healthy.tick = bounded_next_deadline, stopping_tick
+    failing.next_deadline, failing.tick = lambda: fail_at, failing_tick
+
+    channels.run()
+
+    assert failing in exits and exits[failing] < end, 'failing channel was not removed before the end of the run'
+    assert not failing.running and not failing.pids, 'failing channel was not stopped'
+    assert still_running == [True], 'healthy channel did not survive the failing one'
+    print 'failing tick: channel removed after %.2f s, the other one kept running' % (exits[failing] - fail_at)
+
+def report(result):
+    if 'value' in result:
+        print '%-18s %4d channels  %10.2f %s' % (result['name'], result['channels'], result['value'], result['unit'])
+    elif result.get('count'):
+        print '%-18s %4d channels  p50 %8.2f  p95 %8.2f  max %8.2f %s  (n=%d)' % (result['name'], result['channels'],
+            result['p50'], result['p95'], result['max'], result['unit'], result['count'])
+    else:
+        print '%-18s %4d channels  no samples' % (result['name'], result['channels'])
+
+def main():
+    counts = [int(count) for count in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 10, 100]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    output = sys.argv[3] if len(sys.argv) > 3 else None
+
+    output_root = tempfile.mkdtemp(prefix='dashsegmenter-bench-')
+    results = []
+
+    try:
+        for result in bench_build(output_root):
+            report(result)
+            results.append(result)
+
+        for count in counts:
+            for result in bench_channels(count, seconds, output_root):
+                report(result)
+                results.append(result)
+
+        check_failing_channel(min(seconds, 4), output_root)
+    finally:
+        shutil.rmtree(output_root, ignore_errors=True)
+
+    if output != None:
+        with open(output, 'w') as f:
+            json.dump({
+                'benchmark': 'channels',
+                'timestamp': time.time(),
+                'host': socket.gethostname(),
+                'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+                'python': platform.python_version(),
+                'seconds': seconds,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
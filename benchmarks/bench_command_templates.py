@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compares CommandTemplate.eval() with the compiled evaluation
+# usage: python benchmarks/bench_command_templates.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import command_templates
+
+VALUES_VIDEO_CLONE = {
+    'DIMENSIONS': '1920x1080',
+    'VIDEO_CODEC': 'libx264',
+    'FRAME_RATE': 25,
+    'I_FRAME_RATE': 50,
+    'PRESET': 'fast',
+    'PIXEL_FORMAT': 'yuv420p',
+    'RATE_CONTROL': ['-b:v', 5000000],
+    'ENCODING_THREADS': [],
+    'FORCE_KEY_FRAMES': [],
+    'OUTPUT_STREAMS': {
+        'STREAM_CONTAINER': 'mpegts',
+        'OUTPUT_STREAM_0': 'udp://127.0.0.1:10001',
+        'OUTPUT_STREAM_1': 'udp://127.0.0.1:10002',
+        'TRICKPLAY_OUTPUT': [],
+    }
+}
+
+VALUES_PACKAGER = {
+    'STREAM_DEFINITIONS': ['input=udp://127.0.0.1:%s,stream=video,init_segment=v%s_init_v.mp4,segment_template=v%s_$Number$_v.mp4,bandwidth=1000000' % (port, port, port) for port in range(10001, 10007)],
+    'PROFILE': 'live',
+    'MPD_FILENAME': 'manifest.mpd',
+    'SEGMENT_DURATION_CONFIG': {
+        'SEGMENT_DURATION': 2,
+    },
+    'SINGLE_SEGMENT_CONFIG': {
+        'SINGLE_SEGMENT': 'false',
+    },
+    'TIME_SHIFT_BUFFER': ['--time_shift_buffer_depth=60'],
+    'LOW_LATENCY': [],
+}
+
+VALUES_AUDIO = {
+    'AUDIO_CODEC': 'aac',
+    'AUDIO_CHANNELS': 2,
+    'AUDIO_BITRATE': '128k',
+    'AUDIO_SAMPLERATE': 44100,
+    'STREAM_CONTAINER': 'mpegts',
+    'OUTPUT_STREAM': 'udp://127.0.0.1:10007',
+}
+
+VALUES_PACKAGER_STREAM = {
+    'INPUT_STREAM_ADDRESS': 'udp://127.0.0.1:10001',
+    'STREAM_TYPE': 'video',
+    'INIT_SEGMENT_NAME': 'v1080_init_v.mp4',
+    'SEGMENT_TEMPLATE': 'v1080_$Number$_v.mp4',
+    'BITRATE': 5000000,
+}
+
+VALUES_SCALE_NODE = {
+    'INPUT_LABEL': '0:v:0',
+    'WIDTH': 1280,
+    'HEIGHT': 720,
+    'SCALER': 'bicubic',
+    'SPLIT': ',split=2',
+    'OUTPUT_LABELS': ['[v720]', '[c1]'],
+}
+
+CASES = [
+    ('FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE', command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE, VALUES_VIDEO_CLONE),
+    ('FFMPEG_OUTPUT_DEFINITION_AUDIO', command_templates.FFMPEG_OUTPUT_DEFINITION_AUDIO, VALUES_AUDIO),
+    ('FFMPEG_FILTER_SCALE_NODE', command_templates.FFMPEG_FILTER_SCALE_NODE, VALUES_SCALE_NODE),
+    ('PACKAGER_STREAM_DEFINITION', command_templates.PACKAGER_STREAM_DEFINITION, VALUES_PACKAGER_STREAM),
+    ('PACKAGER_TEMPLATE', command_templates.PACKAGER_TEMPLATE, VALUES_PACKAGER),
+]
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    for name, template, values in CASES:
+        compiled = template.compile()
+        assert compiled.eval(values) == template.eval(values)
+
+        results = [
+            ('eval', timeit.timeit(lambda: template.eval(values), number=iterations)),
+            ('compiled', timeit.timeit(lambda: compiled.eval(values), number=iterations)),
+        ]
+
+        base = results[0][1]
+        for method, elapsed in results:
+            print '%-40s %-10s %8.2f us/call  x%.1f' % (name, method, elapsed / iterations * 1e6, base / elapsed)
+
+if __name__ == '__main__':
+    main()
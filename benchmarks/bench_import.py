@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Import-time budget of dashsegmenter.streams, as paid by API workers which only validate
+# channel configs. Every sample is a fresh interpreter, which also checks that importing and
+# validating a config has no side effects: no SIGCHLD handler, no new fds, no libc/ctypes,
+# no threads. Exits with 1 if the median import time is over budget or a side effect shows up.
+#
+# The budget is relative, so it holds on slow and fast machines alike: importing streams on top
+# of the stdlib modules it needs may take at most budget times as long as importing those. The
+# package is byte-compiled first, as an installed one is (PYTHONDONTWRITEBYTECODE would
+# otherwise make every sample measure the compiler).
+# usage: python benchmarks/bench_import.py [budget_ratio] [runs]
+
+import os
+import sys
+import json
+import compileall
+import subprocess
+
+DASHSEGMENTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter')
+DEFAULT_BUDGET = 1.5 # streams import time / import time of its stdlib dependencies
+DEFAULT_RUNS = 20
+
+SAMPLE = r'''
+import os, sys, json, signal, threading, time
+sys.path.insert(0, %(path)r)
+
+fds = set(os.listdir('/proc/self/fd'))
+start = time.time()
+import subprocess, stat, itertools, errno, fcntl, collections
+reference = time.time() - start
+
+start = time.time()
+import streams
+elapsed = time.time() - start
+
+# what config validation does
+settings = streams.Settings(10000, 2, 5, None, 'udp://127.0.0.1:1234', '/nonexistent')
+controller = streams.StreamsController(settings)
+controller.add_stream(streams.VideoStream('720p', 2500000, 1280, 720, 30))
+controller.add_stream(streams.AudioStream('audio', 128000))
+controller._assign_ports()
+controller._build_commandlines()
+
+side_effects = []
+if signal.getsignal(signal.SIGCHLD) not in (signal.SIG_DFL, None):
+    side_effects.append('SIGCHLD handler installed')
+if set(os.listdir('/proc/self/fd')) - fds:
+    side_effects.append('file descriptors opened')
+for module in ('ctypes', '_ctypes', 'multiprocessing', 'xml.etree.cElementTree', 'tempfile'):
+    if sys.modules.get(module) != None:
+        side_effects.append('%%s imported' %% module)
+if threading.active_count() > 1:
+    side_effects.append('threads started')
+
+print(json.dumps({'import_ms': elapsed * 1000, 'reference_ms': reference * 1000, 'side_effects': side_effects}))
+'''
+
+def sample():
+    output = subprocess.check_output([sys.executable, '-c', SAMPLE % {'path': DASHSEGMENTER}])
+    return json.loads(output)
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RUNS
+
+    compileall.compile_dir(DASHSEGMENTER, quiet=True)
+
+    samples = [sample() for _ in xrange(runs)]
+    times = sorted(result['import_ms'] for result in samples)
+    ratios = sorted(result['import_ms'] / result['reference_ms'] for result in samples)
+    median = ratios[len(ratios) // 2]
+    reference = sorted(result['reference_ms'] for result in samples)[len(samples) // 2]
+    side_effects = sorted(set(effect for result in samples for effect in result['side_effects']))
+
+    print 'import streams: min %.2f ms  median %.2f ms  max %.2f ms  (stdlib dependencies median %.2f ms, %d runs)' % (times[0],
+        times[len(times) // 2], times[-1], reference, runs)
+    print 'relative to stdlib dependencies: median %.2f  (budget %.2f)' % (median, budget)
+    for effect in side_effects:
+        print 'side effect:', effect
+
+    if median > budget or side_effects:
+        print 'FAILED'
+        sys.exit(1)
+
+    print 'OK'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Throughput of inspector.SegmentInspector: how many channels one core can verify.
+# Writes fragmented MP4 segments of a 4 rendition + audio ladder (like the packager's), then
+# parses them the way the inspector does when the packager completes them. The same segments are
+# checked again with a thumbnail-only rendition (disable_packager) in the ladder, which must not
+# hold up rendition alignment. Exits with an AssertionError if the stats are wrong.
+# usage: python benchmarks/bench_inspector.py [segments per stream] [chunk_interval]
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import inspector
+import streams
+
+TIMESCALE = 90000
+LADDER = [
+    streams.VideoStream('1080p', 6000000, 1920, 1080, 30),
+    streams.VideoStream('720p', 3000000, 1280, 720, 30),
+    streams.VideoStream('480p', 1200000, 854, 480, 30),
+    streams.VideoStream('240p', 400000, 426, 240, 30),
+    streams.AudioStream('audio', 128000),
+]
+THUMBNAIL_ONLY = streams.VideoStream('thumbnails', 200000, 320, 180, 1, disable_packager=True)
+FRAGMENTS = 4 # moof/mdat pairs per segment, like low latency chunks
+
+def box(box_type, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def full_box(box_type, version, flags, *payloads):
+    return box(box_type, struct.pack('>I', version << 24 | flags), *payloads)
+
+def init_segment():
+    mdhd = full_box('mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55c4, 0))
+    trex = full_box('trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, inspector.SAMPLE_IS_NON_SYNC))
+    return box('ftyp', 'iso6', struct.pack('>I', 0), 'iso6') + box('moov', box('trak', box('mdia', mdhd)), box('mvex', trex))
+
+def media_segment(number, chunk_interval, frame_rate, bitrate):
+    samples = int(chunk_interval * frame_rate) // FRAGMENTS
+    sample_duration = TIMESCALE // frame_rate
+    sample_size = int(bitrate * chunk_interval / 8 / (samples * FRAGMENTS))
+    decode_time = (number - 1) * samples * FRAGMENTS * sample_duration
+
+    segment = [box('styp', 'msdh', struct.pack('>I', 0), 'msdh')]
+    for fragment in range(FRAGMENTS):
+        # duration, size and flags per sample, first sample of the segment is a sync sample
+        entries = b''.join(struct.pack('>III', sample_duration, sample_size,
+            0x2000000 if fragment == 0 and index == 0 else inspector.SAMPLE_IS_NON_SYNC) for index in range(samples))
+        traf = box('traf',
+            full_box('tfhd', 0, 0x20000, struct.pack('>I', 1)),
+            full_box('tfdt', 1, 0, struct.pack('>Q', decode_time + fragment * samples * sample_duration)),
+            full_box('trun', 0, 0x701, struct.pack('>Ii', samples, 0), entries))
+        segment.append(box('moof', full_box('mfhd', 0, 0, struct.pack('>I', number)), traf))
+        segment.append(box('mdat', b'\0' * (sample_size * samples)))
+
+    return b''.join(segment)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    chunk_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    directory = tempfile.mkdtemp(prefix='bench_inspector_')
+    try:
+        names = []
+        for stream in LADDER:
+            with open(os.path.join(directory, stream.init_segment_name), 'wb') as f:
+                f.write(init_segment())
+
+            frame_rate = stream.frame_rate if stream.stream_type == 'video' else 50 # ~ AAC frames
+            for number in range(1, count + 1):
+                name = stream.segment_template.replace('$Number$', str(number))
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(media_segment(number, chunk_interval, frame_rate, stream.bitrate))
+                names.append((number, name))
+
+        names.sort()
+        segment_inspector = inspector.SegmentInspector(directory, LADDER, chunk_interval)
+
+        started = time.time()
+        for _number, name in names:
+            segment_inspector.segment_completed(name)
+        elapsed = time.time() - started
+
+        stats = segment_inspector.stats
+        for stream in LADDER:
+            stream_stats = stats['segments:%s:%s' % (stream.stream_type, stream.name)]
+            assert abs(stream_stats['segment_duration'] - chunk_interval) < 0.05, stream_stats
+            assert abs(stream_stats['drift']) < 0.001, stream_stats
+            assert stream_stats['invalid_segments'] == 0, stream_stats
+        assert stats['segments']['misaligned_segments'] == 0 and stats['segments']['aligned_segments'] == count, stats['segments']
+
+        segment_inspector = inspector.SegmentInspector(directory, LADDER + [THUMBNAIL_ONLY], chunk_interval)
+        for _number, name in names:
+            segment_inspector.segment_completed(name)
+        stats = segment_inspector.stats
+        assert 'segments:video:%s' % THUMBNAIL_ONLY.name not in stats, sorted(stats)
+        assert stats['segments']['aligned_segments'] == count, stats['segments']
+
+        rate = len(names) / elapsed
+        channels = rate / (len(LADDER) / chunk_interval)
+        print 'inspected %d segments in %.3fs: %.0f segments/s, %.0f us/segment' % (len(names), elapsed, rate, elapsed / len(names) * 1e6)
+        print 'one core keeps up with %.0f channels of %d streams at %gs segments' % (channels, len(LADDER), chunk_interval)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
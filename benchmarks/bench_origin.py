@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Load test of origin.OriginServer: many concurrent keep-alive clients fetching the MPD and segments.
+# First checks that a segment re-requested after a packager restart (stubs/packager, which numbers
+# segments from 1 again) is the new one and was not handed out with a long cache lifetime, and
+# that a low latency segment is streamed while the packager still writes it. Exits with 1 if not.
+# usage: python benchmarks/bench_origin.py [clients] [seconds] [segment_kbytes]
+
+import errno
+import os
+import re
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import internal_settings
+import origin
+
+STUB_PACKAGER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs', 'packager')
+RESTART_SEGMENT_DURATION = 1 # seconds
+
+SEGMENTS = 10
+
+def prepare(directory, segment_size):
+    with open(os.path.join(directory, 'manifest.mpd'), 'w') as f:
+        f.write('<?xml version="1.0"?><MPD>%s</MPD>' % ('x' * 2000))
+
+    for number in range(1, SEGMENTS + 1):
+        with open(os.path.join(directory, 'v_%d_v.mp4' % number), 'w') as f:
+            f.write('s' * segment_size)
+
+class Client(object):
+    def __init__(self, address, requests):
+        self.sock = socket.create_connection(address)
+        self.sock.setblocking(False)
+        self.requests = requests
+        self.index = 0
+        self.buffer = ''
+        self.completed = 0
+        self.received = 0
+        self.latencies = []
+        self.send_next()
+
+    def send_next(self):
+        self.started = time.time()
+        self.sock.send(self.requests[self.index % len(self.requests)])
+        self.index += 1
+
+    def on_readable(self):
+        data = self.sock.recv(1 << 20)
+        if not data:
+            raise RuntimeError('server closed connection')
+
+        self.buffer += data
+        self.received += len(data)
+
+        while True:
+            end = self.buffer.find('\r\n\r\n')
+            if end < 0:
+                return
+
+            headers = self.buffer[:end]
+            length = int(headers.split('Content-Length: ', 1)[1].split('\r\n', 1)[0])
+            if headers.startswith('HTTP/1.1 304'):
+                length = 0
+            if len(self.buffer) < end + 4 + length:
+                return
+
+            self.buffer = self.buffer[end + 4 + length:]
+            self.completed += 1
+            self.latencies.append(time.time() - self.started)
+            self.send_next()
+
+def run_clients(address, clients, seconds, requests):
+    epoll = select.epoll()
+    by_fd = {}
+    for _ in range(clients):
+        client = Client(address, requests)
+        by_fd[client.sock.fileno()] = client
+        epoll.register(client.sock.fileno(), select.EPOLLIN)
+
+    end = time.time() + seconds
+    while time.time() < end:
+        for fd, _event in epoll.poll(0.1):
+            by_fd[fd].on_readable()
+
+    for client in by_fd.values():
+        client.sock.close()
+    epoll.close()
+
+    return by_fd.values()
+
+def report(name, results, seconds):
+    completed = sum(client.completed for client in results)
+    received = sum(client.received for client in results)
+    latencies = sorted(latency for client in results for latency in client.latencies)
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+
+    print '%-10s %8.0f req/s  %8.1f MB/s  p99 %6.2f ms' % (name, completed / seconds, received / seconds / 1e6, p99 * 1000)
+
+def fetch(server, path):
+    """Runs server until it has answered GET path, returns (status line, headers dict)."""
+    client = socket.create_connection(server.address)
+    client.sendall('GET %s HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n' % path)
+    client.setblocking(False)
+
+    response = ''
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        server.serve_once(0.05)
+        try:
+            data = client.recv(1 << 20)
+        except socket.error as e:
+            if e.errno == errno.EAGAIN:
+                continue
+            raise
+        if not data:
+            break
+        response += data
+    client.close()
+
+    lines = response.split('\r\n\r\n', 1)[0].split('\r\n')
+    return lines[0], dict(line.split(': ', 1) for line in lines[1:])
+
+def fetch_chunked(server, path):
+    """Runs server until the chunked response to GET path has ended, returns (headers, [(time, chunk)])."""
+    client = socket.create_connection(server.address)
+    client.sendall('GET %s HTTP/1.1\r\nHost: x\r\n\r\n' % path)
+    client.setblocking(False)
+
+    response = ''
+    headers = None
+    chunks = []
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        server.serve_once(0.05)
+        try:
+            response += client.recv(1 << 20)
+        except socket.error as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        if headers == None:
+            end = response.find('\r\n\r\n')
+            if end < 0:
+                continue
+            lines = response[:end].split('\r\n')
+            headers = dict(line.split(': ', 1) for line in lines[1:])
+            response = response[end + 4:]
+
+        while True:
+            line_end = response.find('\r\n')
+            if line_end < 0:
+                break
+            size = int(response[:line_end], 16)
+            if len(response) < line_end + 2 + size + 2:
+                break
+            if size == 0:
+                client.close()
+                return headers, chunks
+            chunks.append((time.time(), response[line_end + 2:line_end + 2 + size]))
+            response = response[line_end + 2 + size + 2:]
+
+    client.close()
+    raise AssertionError('chunked response did not end')
+
+def start_packager(directory, *options):
+    stream = 'in=udp://127.0.0.1:1,stream=video,init_segment=v_init_v.mp4,segment_template=v_$Number$_v.mp4,bandwidth=80000'
+    return subprocess.Popen([sys.executable, STUB_PACKAGER, stream, '--segment_duration', str(RESTART_SEGMENT_DURATION),
+        '--mpd_output', 'manifest.mpd'] + list(options), cwd=directory)
+
+def wait_for(path, inode=None):
+    deadline = time.time() + 5 * RESTART_SEGMENT_DURATION
+    while time.time() < deadline:
+        try:
+            if os.stat(path).st_ino != inode:
+                return
+        except OSError:
+            pass
+        time.sleep(0.05)
+
+    raise RuntimeError('%s was not written' % path)
+
+def check_packager_restart():
+    directory = tempfile.mkdtemp(prefix='dashsegmenter-origin-')
+    server = origin.OriginServer(('127.0.0.1', 0))
+    server.add_channel('channel', directory)
+    segment = os.path.join(directory, 'v_1_v.mp4')
+    packager = None
+
+    try:
+        packager = start_packager(directory)
+        wait_for(segment)
+        status, before = fetch(server, '/channel/v_1_v.mp4')
+        assert status == 'HTTP/1.1 200 OK', status
+        inode = os.stat(segment).st_ino
+
+        # like a restart by restarts.ProcessRestarts: killed, started again after the initial backoff
+        packager.kill()
+        packager.wait()
+        time.sleep(internal_settings.RESTART_BACKOFF_INITIAL)
+        packager = start_packager(directory)
+        wait_for(segment, inode)
+
+        status, after = fetch(server, '/channel/v_1_v.mp4')
+        assert status == 'HTTP/1.1 200 OK', status
+        assert after['ETag'] != before['ETag'], 'stale segment served after packager restart'
+
+        for headers in (before, after):
+            max_age = int(re.search('max-age=(\d+)', headers['Cache-Control']).group(1))
+            assert 'immutable' not in headers['Cache-Control'] and \
+                max_age < internal_settings.RESTART_BACKOFF_INITIAL + RESTART_SEGMENT_DURATION, headers['Cache-Control']
+    finally:
+        if packager != None:
+            packager.kill()
+            packager.wait()
+        server.close()
+        shutil.rmtree(directory)
+
+    print 'packager restart: segment revalidated (%s)' % after['Cache-Control']
+
+def check_low_latency():
+    directory = tempfile.mkdtemp(prefix='dashsegmenter-origin-')
+    server = origin.OriginServer(('127.0.0.1', 0))
+    channel = server.add_channel('channel', directory, low_latency=True)
+    name = 'v_2_v.mp4'
+    packager = None
+
+    try:
+        packager = start_packager(directory, '--low_latency_dash_mode', 'true', '--fragment_duration', '0.25')
+
+        deadline = time.time() + 5 * RESTART_SEGMENT_DURATION
+        while name not in channel.in_progress and time.time() < deadline:
+            server.serve_once(0.05)
+        assert name in channel.in_progress, '%s was not created' % name
+
+        headers, chunks = fetch_chunked(server, '/channel/%s' % name)
+        closed = os.stat(os.path.join(directory, name))
+    finally:
+        if packager != None:
+            packager.kill()
+            packager.wait()
+        server.close()
+        shutil.rmtree(directory)
+
+    assert headers.get('Transfer-Encoding') == 'chunked', headers
+    assert sum(len(chunk) for _time, chunk in chunks) == closed.st_size, 'streamed %d of %d bytes' % (
+        sum(len(chunk) for _time, chunk in chunks), closed.st_size)
+    assert chunks[0][0] < closed.st_mtime, 'nothing was streamed before the segment was closed'
+
+    print 'low latency: %d bytes streamed in %d chunks, first %.0f ms before the segment was closed' % (closed.st_size,
+        len(chunks), (closed.st_mtime - chunks[0][0]) * 1000)
+
+def main():
+    try:
+        check_packager_restart()
+        check_low_latency()
+    except AssertionError as e:
+        print 'FAILED:', e
+        sys.exit(1)
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    segment_size = int(sys.argv[3]) * 1024 if len(sys.argv) > 3 else 64 * 1024
+
+    directory = tempfile.mkdtemp(prefix='dashsegmenter-origin-')
+    prepare(directory, segment_size)
+
+    server = origin.OriginServer(('127.0.0.1', 0))
+    server.add_channel('channel', directory)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+
+    address = server.address
+    etag = None
+    probe = socket.create_connection(address)
+    probe.sendall('GET /channel/manifest.mpd HTTP/1.1\r\nHost: x\r\n\r\n')
+    response = probe.recv(65536)
+    probe.close()
+    etag = response.split('ETag: ', 1)[1].split('\r\n', 1)[0]
+
+    mpd = 'GET /channel/manifest.mpd HTTP/1.1\r\nHost: x\r\n\r\n'
+    conditional = 'GET /channel/manifest.mpd HTTP/1.1\r\nHost: x\r\nIf-None-Match: %s\r\n\r\n' % etag
+    segments = ['GET /channel/v_%d_v.mp4 HTTP/1.1\r\nHost: x\r\n\r\n' % number for number in range(1, SEGMENTS + 1)]
+
+    try:
+        for name, requests in (('mpd', [mpd]), ('mpd-304', [conditional]), ('segments', segments)):
+            report(name, run_clients(address, clients, seconds, requests), seconds)
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Bytes written and encode speed of the video rate control modes (abr, capped_crf) on local clips.
+# Needs a real ffmpeg and ffprobe on PATH. Every clip is encoded once per mode and rung with the
+# same output definition the live encoder gets (no -re), to an MPEG-TS file.
+# Without clips a high motion (testsrc2) and a static (smptebars) clip are generated.
+# usage: python benchmarks/bench_rate_control.py [--seconds N] [CLIP ...]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import internal_settings
+import streams
+
+MODES = [internal_settings.RATE_CONTROL_ABR, internal_settings.RATE_CONTROL_CAPPED_CRF]
+LADDER = [
+    ('v1080', 5000000, 1920, 1080),
+    ('v720', 3000000, 1280, 720),
+    ('v360', 800000, 640, 360),
+]
+FRAME_RATE = 25
+GOP_SECONDS = 2
+GENERATED = [('motion', 'testsrc2=size=1920x1080:rate=25'), ('static', 'smptebars=size=1920x1080:rate=25')]
+
+def generate(directory, seconds):
+    clips = []
+    for name, source in GENERATED:
+        path = os.path.join(directory, '%s.mkv' % name)
+        subprocess.check_call(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', source, '-t', str(seconds),
+            '-c:v', 'libx264', '-qp', '0', '-preset', 'ultrafast', path])
+        clips.append(path)
+
+    return clips
+
+def duration(clip):
+    output = subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', clip])
+    return float(output.strip())
+
+def encode(clip, mode, rung, output):
+    name, bitrate, width, height = rung
+    stream = streams.VideoStream(name, bitrate, width, height, FRAME_RATE, rate_control=mode)
+    stream.key_frame_interval = GOP_SECONDS
+    stream.local_path = output
+
+    commandline = ['ffmpeg', '-v', 'error', '-y', '-nostdin', '-i', clip] + [str(arg) for arg in stream.ffmpeg_definition]
+
+    started = time.time()
+    subprocess.check_call(commandline)
+    return time.time() - started, os.path.getsize(output)
+
+def main():
+    args = sys.argv[1:]
+    seconds = 20
+    if args[:1] == ['--seconds']:
+        seconds, args = float(args[1]), args[2:]
+
+    directory = tempfile.mkdtemp(prefix='bench_rate_control_')
+    try:
+        clips = args or generate(directory, seconds)
+
+        print '%-20s %-6s %-10s %12s %10s %8s %10s' % ('clip', 'rung', 'mode', 'bytes', 'kbps', 'speed', 'vs abr')
+        totals = dict((mode, 0) for mode in MODES)
+
+        for clip in clips:
+            clip_duration = duration(clip)
+
+            for rung in LADDER:
+                sizes = {}
+                for mode in MODES:
+                    elapsed, size = encode(clip, mode, rung, os.path.join(directory, 'out.ts'))
+                    sizes[mode] = size
+                    totals[mode] += size
+
+                    print '%-20s %-6s %-10s %12d %10.0f %7.2fx %9.1f%%' % (os.path.basename(clip)[:20], rung[0], mode, size,
+                        size * 8 / clip_duration / 1000, clip_duration / elapsed,
+                        (size - sizes[internal_settings.RATE_CONTROL_ABR]) * 100.0 / sizes[internal_settings.RATE_CONTROL_ABR])
+
+        abr = totals[internal_settings.RATE_CONTROL_ABR]
+        for mode in MODES:
+            print 'total %-10s %14d bytes  %+.1f%% vs abr' % (mode, totals[mode], (totals[mode] - abr) * 100.0 / abr)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Cost of resources.ResourceSampler: /proc sampling of many channel children, as a share of one core
+# at the default interval (cpu time of the sampling process, user + system, spent in sample()).
+# Children are idle processes grouped into channels of 5. A sample runs every interval but reads a
+# process's stat only every RESOURCE_STAT_EVERY intervals (status and io every RESOURCE_DETAILS_EVERY),
+# so this is not the cost of reading every process every interval.
+# Exits with 1 if it costs more than the budget.
+# usage: python benchmarks/bench_resources.py [processes] [rounds] [budget_percent]
+
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import internal_settings
+import resources
+
+DEFAULT_PROCESSES = 500
+DEFAULT_ROUNDS = 150 # whole cycles of RESOURCE_STAT_EVERY and RESOURCE_DETAILS_EVERY
+DEFAULT_BUDGET = 0.5 # percent of a core
+ROLES = ['ffmpeg:audio:audio', 'ffmpeg:video:1080p', 'ffmpeg:video:720p', 'packager', 'thumbnail']
+
+class Channel(object):
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PROCESSES
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ROUNDS
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_BUDGET
+
+    processes = []
+    channels = []
+    try:
+        for index in range(count):
+            if index % len(ROLES) == 0:
+                channels.append(Channel('channel%03d' % len(channels)))
+
+            process = subprocess.Popen(['sleep', '600'])
+            processes.append(process)
+            channels[-1].children[process.pid] = ROLES[index % len(ROLES)]
+
+        sampler = resources.ResourceSampler()
+        sampler.sample(time.time(), channels) # first sample has no rates yet
+
+        # os.times() ticks are too coarse for a single sample
+        walls = []
+        cpu_started = sum(os.times()[:2])
+        for _ in range(rounds):
+            started = time.time()
+            sampler.sample(started, channels)
+            walls.append(time.time() - started)
+        cpu = (sum(os.times()[:2]) - cpu_started) / rounds
+
+        walls.sort()
+        share = cpu / internal_settings.RESOURCE_SAMPLE_INTERVAL * 100
+
+        sampled = sum(len(roles) for roles in sampler.snapshot().values())
+        print 'sampled %d processes (%d channel roles): %.2f ms cpu, median %.2f ms wall per sample' % (count, sampled,
+            cpu * 1000, walls[len(walls) // 2] * 1000)
+        print 'cost at %gs interval, stat of a process read every %d intervals, status and io every %d: %.2f%% of a core (budget %.2f%%)' % (
+            internal_settings.RESOURCE_SAMPLE_INTERVAL, internal_settings.RESOURCE_STAT_EVERY, internal_settings.RESOURCE_DETAILS_EVERY,
+            share, budget)
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+    if share > budget:
+        print 'FAILED'
+        sys.exit(1)
+
+    print 'OK'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Realtime channels per host with and without scheduler.CpuScheduler.
+# Needs a real ffmpeg on PATH; the packager is replaced by a dummy, only encoders are measured.
+# Every channel encodes the same ladder from INPUT_FILE in realtime (-re); the host keeps up with
+# N channels if every encoder reports speed >= REALTIME_SPEED.
+# usage: python benchmarks/bench_scheduler.py INPUT_FILE [max_channels] [seconds]
+
+import os
+import shutil
+import signal
+import stat
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import scheduler
+import streams
+import supervisor
+
+REALTIME_SPEED = 0.98
+
+LADDER = [
+    ('v1080', 5000000, 1920, 1080),
+    ('v720', 3000000, 1280, 720),
+    ('v480', 1500000, 854, 480),
+    ('v360', 800000, 640, 360),
+]
+
+def dummy_packager(directory):
+    path = os.path.join(directory, 'packager')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\nexec sleep 100000\n')
+    os.chmod(path, stat.S_IRWXU)
+
+def run_channels(input_file, channels, seconds, cpu_scheduler, directory):
+    channels_supervisor = supervisor.Supervisor()
+
+    for channel in range(channels):
+        output_path = os.path.join(directory, 'channel%d' % channel)
+        os.mkdir(output_path)
+
+        settings = streams.Settings(20000 + channel * 100, 2, 3600, None, input_file, output_path, scheduler=cpu_scheduler)
+        controller = streams.StreamsController(settings)
+        for name, bitrate, width, height in LADDER:
+            controller.add_stream(streams.VideoStream(name, bitrate, width, height, 25, 50))
+        controller.add_stream(streams.AudioStream('audio', 128000))
+
+        channels_supervisor.add_controller(controller)
+
+    speeds = []
+    def finish(signum, frame):
+        for processes in channels_supervisor.stats().itervalues():
+            speeds.extend(stats.get('speed') or 0 for stats in processes.itervalues())
+        channels_supervisor.stop()
+
+    signal.signal(signal.SIGALRM, finish)
+    signal.alarm(int(seconds))
+    channels_supervisor.run()
+
+    return min(speeds) if speeds else 0
+
+def main():
+    input_file = os.path.abspath(sys.argv[1])
+    max_channels = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    directory = tempfile.mkdtemp(prefix='dashsegmenter-scheduler-')
+    dummy_packager(directory)
+    os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+
+    try:
+        for name, make_scheduler in (('default', lambda: None), ('scheduler', scheduler.CpuScheduler)):
+            realtime = 0
+            for channels in range(1, max_channels + 1):
+                run_directory = tempfile.mkdtemp(dir=directory)
+                speed = run_channels(input_file, channels, seconds, make_scheduler(), run_directory)
+                shutil.rmtree(run_directory)
+
+                print '%-10s %3d channels  slowest encoder %.2fx' % (name, channels, speed)
+                if speed < REALTIME_SPEED:
+                    break
+
+                realtime = channels
+
+            print '%-10s %3d realtime channels per host' % (name, realtime)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
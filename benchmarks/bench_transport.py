@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compares loopback UDP with a named pipe (fifo) as ffmpeg -> packager transport.
+# A writer pushes 7-packet MPEG-TS sized chunks at a given bitrate, a reader that stalls now and
+# then (as a loaded packager does) counts what arrived.
+# usage: python benchmarks/bench_transport.py [bitrate_mbit] [seconds]
+
+import os
+import sys
+import time
+import socket
+import fcntl
+import resource
+import tempfile
+import shutil
+
+CHUNK = 188 * 7
+STALL_EVERY = 0.5 # seconds
+STALL_FOR = 0.05 # seconds
+F_SETPIPE_SZ = 1031
+FIFO_BUFFER_SIZE = 1024 * 1024
+
+def write_paced(write, bitrate, seconds):
+    payload = 'G' * CHUNK
+    chunks_per_second = bitrate / 8.0 / CHUNK
+    start = time.time()
+    sent = 0
+
+    while True:
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            break
+
+        due = int(elapsed * chunks_per_second) + 1
+        while sent < due:
+            write(payload)
+            sent += 1
+
+        time.sleep(0.001)
+
+    return sent
+
+def read_stalling(read, done):
+    received = 0
+    next_stall = time.time() + STALL_EVERY
+
+    while True:
+        data = read()
+        if data is None:
+            if done():
+                break
+            continue
+        if not data:
+            break
+
+        received += len(data)
+
+        if time.time() >= next_stall:
+            time.sleep(STALL_FOR)
+            next_stall = time.time() + STALL_EVERY
+
+    return received / CHUNK
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def bench_udp(bitrate, seconds, status_w):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1)
+    address = receiver.getsockname()
+
+    pid = os.fork()
+    if pid == 0:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sent = write_paced(lambda data: sender.sendto(data, address), bitrate, seconds)
+        os.write(status_w, str(sent))
+        os._exit(0)
+
+    def read():
+        try:
+            return receiver.recv(65536)
+        except socket.timeout:
+            return ''
+
+    received = read_stalling(read, lambda: True)
+    os.waitpid(pid, 0)
+    return received
+
+def bench_fifo(bitrate, seconds, status_w):
+    directory = tempfile.mkdtemp(prefix='dashsegmenter-bench-')
+    path = os.path.join(directory, 'stream.ts')
+    os.mkfifo(path)
+
+    pid = os.fork()
+    if pid == 0:
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, FIFO_BUFFER_SIZE)
+        except IOError:
+            pass
+        sent = write_paced(lambda data: os.write(fd, data), bitrate, seconds)
+        os.write(status_w, str(sent))
+        os._exit(0)
+
+    fd = os.open(path, os.O_RDONLY)
+    received = read_stalling(lambda: os.read(fd, 65536), lambda: True)
+    os.close(fd)
+    os.waitpid(pid, 0)
+    shutil.rmtree(directory)
+    return received
+
+def main():
+    bitrate = float(sys.argv[1]) * 1000000 if len(sys.argv) > 1 else 50 * 1000000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for name, bench in (('udp', bench_udp), ('fifo', bench_fifo)):
+        status_r, status_w = os.pipe()
+        cpu_before, wall_before = cpu_seconds(), time.time()
+
+        received = bench(bitrate, seconds, status_w)
+
+        cpu = cpu_seconds() - cpu_before
+        wall = time.time() - wall_before
+        os.close(status_w)
+        sent = int(os.read(status_r, 64))
+        os.close(status_r)
+
+        print '%-5s %6.1f Mbit/s  sent %8d  received %8d  lost %6.2f%%  cpu %5.2fs (%.1f%% of a core, %.2f us/chunk)' % (
+            name, bitrate / 1e6, sent, received, 100.0 * (sent - received) / sent, cpu, 100.0 * cpu / wall, cpu / sent * 1e6)
+
+if __name__ == '__main__':
+    main()
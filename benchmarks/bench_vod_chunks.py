@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Keyframe placement of vod.ChunkedTranscoder against a single pass encode, no ffmpeg needed.
+# Chunks and commandlines of a file are built as the transcoder builds them, then the
+# -force_key_frames expressions are evaluated the way ffmpeg does for every frame (t, n, n_forced).
+# Every chunked encode must force keyframes on exactly the frames the single pass encode does,
+# at integer and at NTSC (29.97, 59.94) frame rates. Exits with an AssertionError if not.
+# usage: python benchmarks/bench_vod_chunks.py [duration] [chunk_duration] [segment_duration]
+
+import os
+import sys
+import time
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashsegmenter'))
+
+import streams
+import vod
+
+FRAME_RATES = (
+    (25, Fraction(25)),
+    (30, Fraction(30)),
+    (29.97, Fraction(30000, 1001)),
+    (59.94, Fraction(60000, 1001)),
+)
+
+FUNCTIONS = {
+    'gte': lambda a, b: int(a >= b),
+    'eq': lambda a, b: int(a == b),
+    'mod': lambda a, b: a % b,
+}
+
+def argument(commandline, option):
+    return commandline[commandline.index(option) + 1]
+
+def forced_frames(expression, timestamps, start):
+    """Returns timestamps of the frames expression forces, t counted from start."""
+    assert expression.startswith('expr:')
+    code = compile(expression[len('expr:'):], expression, 'eval')
+
+    forced = []
+    n_forced = 0
+    for n, timestamp in enumerate(timestamps):
+        values = dict(FUNCTIONS, t=float(timestamp - start), n=n, n_forced=n_forced)
+        if eval(code, values):
+            forced.append(timestamp)
+            n_forced += 1
+
+    return forced
+
+def check(label, frame_rate, duration, chunk_duration, segment_duration):
+    video = streams.VideoStream('720p', 2500000, 1280, 720, label)
+    transcoder = vod.ChunkedTranscoder([video], 1, chunk_duration, segment_duration)
+
+    timestamps = [index / frame_rate for index in xrange(int(duration * frame_rate))]
+
+    job = transcoder.add_job('input.mp4', 'output')
+    transcoder._build_commandlines(job, 'intermediate')
+    single_pass = forced_frames(argument(job.commandline_ffmpeg, '-force_key_frames'), timestamps, 0)
+
+    starts = vod.chunk_boundaries([], duration, chunk_duration, segment_duration)
+    chunked = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else None
+        commandline = transcoder._chunk_commandline('input.mp4', 'intermediate', index, start, None if end == None else end - start)
+        chunk = [timestamp for timestamp in timestamps if timestamp >= start and (end == None or timestamp < end)]
+        chunked.extend(forced_frames(argument(commandline, '-force_key_frames'), chunk, Fraction(start)))
+
+    assert single_pass, 'no keyframes forced at %s fps' % label
+    assert chunked == single_pass, '%s fps: %d chunks force %d keyframes, %d of them not where the single pass encode does (%d)' % (
+        label, len(starts), len(chunked), len(set(chunked) - set(single_pass)), len(single_pass))
+
+    print '%6s fps: %d keyframes in %d chunks, same as single pass' % (label, len(single_pass), len(starts))
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 600
+    chunk_duration = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    segment_duration = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    started = time.time()
+    for label, frame_rate in FRAME_RATES:
+        check(label, frame_rate, duration, chunk_duration, segment_duration)
+    print 'checked in %.2f s' % (time.time() - started)
+
+if __name__ == '__main__':
+    main()
@@ -59,12 +59,125 @@ class CommandTemplate(object):
 
         return evaluated
 
+    def compile(self):
+        return CompiledCommandTemplate(self)
+
+    @property
+    def compiled(self):
+        # templates are treated as immutable once used, so compiling once is enough
+        if self._compiled == None:
+            self._compiled = self.compile()
+
+        return self._compiled
+
+    _compiled = None
+
 class CommandTemplatePlaceholder(object):
     def __init__(self, name):
         super(CommandTemplatePlaceholder, self).__init__()
         self.name = name
 
-FFMPEG_TEMPLATE = CommandTemplate('ffmpeg', '-re', '-i', CommandTemplatePlaceholder('INPUT_STREAM'), 
+_SLOT_LITERAL, _SLOT_PLACEHOLDER, _SLOT_INLINE = range(3)
+
+class CompiledCommandTemplate(object):
+    """CommandTemplate flattened into a fixed list of slots.
+
+    Non-inline nested templates are merged into the parent slot list, literals are converted to
+    strings (and dropped if empty) at compile time. eval() gives the same result as CommandTemplate.eval().
+    """
+    def __init__(self, template):
+        super(CompiledCommandTemplate, self).__init__()
+        self.inline = template.inline
+        self.name = template.name
+        self._slots = []
+
+        self._flatten(template, ())
+
+    def _flatten(self, template, path):
+        for item in template.command_template:
+            if isinstance(item, CommandTemplatePlaceholder):
+                self._slots.append((_SLOT_PLACEHOLDER, path, item.name))
+            elif isinstance(item, CommandTemplate):
+                if item.inline:
+                    self._slots.append((_SLOT_INLINE, path + (item.name,), item.compile()))
+                else:
+                    self._flatten(item, path + (item.name,))
+            elif isinstance(item, list):
+                for subitem in item:
+                    self._append_literal(subitem)
+            else:
+                self._append_literal(item)
+
+    def _append_literal(self, item):
+        item = str(item)
+        if len(item) > 0:
+            self._slots.append((_SLOT_LITERAL, None, item))
+
+    def eval(self, definitions_dict):
+        evaluated = []
+        append, extend = evaluated.append, evaluated.extend
+
+        for kind, path, value in self._slots:
+            if kind == _SLOT_LITERAL:
+                append(value)
+                continue
+
+            definitions = definitions_dict
+            for key in path:
+                definitions = definitions[key]
+
+            if kind == _SLOT_INLINE:
+                item = value.eval(definitions)
+            else:
+                item = definitions[value]
+
+                if isinstance(item, CommandTemplate):
+                    item = item.compiled.eval(definitions[item.name])
+
+            if isinstance(item, list):
+                extend(item for item in itertools.imap(str, item) if len(item) > 0)
+            else:
+                item = str(item)
+                if len(item) > 0:
+                    append(item)
+
+        if self.inline:
+            return ''.join(evaluated)
+
+        return evaluated
+
+# no realtime pacing, for files
+FFMPEG_TEMPLATE_VOD = CommandTemplate('ffmpeg', '-y', '-nostdin', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    CommandTemplatePlaceholder('OUTPUT_DEFINITIONS'))
+
+# part of a file, timestamps shifted so the encoded chunks can be concatenated
+FFMPEG_TEMPLATE_VOD_CHUNK = CommandTemplate('ffmpeg', '-y', '-nostdin',
+    '-ss', CommandTemplatePlaceholder('START'),
+    CommandTemplatePlaceholder('DURATION'), # [] (until the end) or ['-t', DURATION]
+    '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    '-output_ts_offset', CommandTemplatePlaceholder('START'),
+    CommandTemplatePlaceholder('OUTPUT_DEFINITIONS'))
+
+FFMPEG_TEMPLATE_CONCAT = CommandTemplate('ffmpeg', '-y', '-nostdin',
+    '-f', 'concat', '-safe', '0', '-i', CommandTemplatePlaceholder('INPUT_LIST'),
+    '-c', 'copy',
+    '-f', CommandTemplatePlaceholder('STREAM_CONTAINER'),
+    CommandTemplatePlaceholder('OUTPUT_STREAM'))
+
+FFPROBE_TEMPLATE_SOURCE = CommandTemplate('ffprobe', '-v', 'error',
+    '-rw_timeout', CommandTemplatePlaceholder('TIMEOUT'),
+    '-select_streams', 'v:0',
+    '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,bit_rate:format=bit_rate',
+    '-of', 'json',
+    CommandTemplatePlaceholder('INPUT_STREAM'))
+
+FFPROBE_TEMPLATE_KEYFRAMES = CommandTemplate('ffprobe', '-v', 'error',
+    '-select_streams', 'v:0',
+    '-show_entries', 'packet=pts_time,flags:format=duration',
+    '-of', 'csv=p=0',
+    CommandTemplatePlaceholder('INPUT_STREAM'))
+
+FFMPEG_TEMPLATE = CommandTemplate('ffmpeg', '-y', CommandTemplatePlaceholder('PROGRESS'), '-re', '-i', CommandTemplatePlaceholder('INPUT_STREAM'), 
     CommandTemplatePlaceholder('OUTPUT_DEFINITIONS'))
 
 FFMPEG_OUTPUT_DEFINITION_AUDIO = CommandTemplate(
@@ -85,8 +198,9 @@ FFMPEG_OUTPUT_DEFINITION_VIDEO = CommandTemplate(
     '-g', CommandTemplatePlaceholder('I_FRAME_RATE'),
     '-preset', CommandTemplatePlaceholder('PRESET'),
     '-pix_fmt', CommandTemplatePlaceholder('PIXEL_FORMAT'),
-    '-b:v', CommandTemplatePlaceholder('VIDEO_BITRATE'),
-    # '-threads', CommandTemplatePlaceholder('ENCODING_THREADS'),
+    CommandTemplatePlaceholder('RATE_CONTROL'), # ['-b:v', BITRATE] or ['-crf', CRF, '-maxrate', BITRATE, '-bufsize', SIZE]
+    CommandTemplatePlaceholder('ENCODING_THREADS'), # [] or ['-threads', N]
+    CommandTemplatePlaceholder('FORCE_KEY_FRAMES'), # [] or ['-force_key_frames', EXPR, '-sc_threshold', '0']
     '-f', CommandTemplatePlaceholder('STREAM_CONTAINER'),
     CommandTemplatePlaceholder('OUTPUT_STREAM')
     )
@@ -97,6 +211,7 @@ FFMPEG_OUTPUT_DEFINITION_VIDEO_THUMB_STREAMS = CommandTemplate(
     '|',
     '[f=', CommandTemplatePlaceholder('STREAM_CONTAINER'), ']',
     CommandTemplatePlaceholder('OUTPUT_STREAM_1'),
+    CommandTemplatePlaceholder('TRICKPLAY_OUTPUT'), # [] or ['|[f=mpegts]', address]
     inline=True,
     name='OUTPUT_STREAMS')
 FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE = CommandTemplate(
@@ -107,19 +222,106 @@ FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE = CommandTemplate(
     '-g', CommandTemplatePlaceholder('I_FRAME_RATE'),
     '-preset', CommandTemplatePlaceholder('PRESET'),
     '-pix_fmt', CommandTemplatePlaceholder('PIXEL_FORMAT'),
-    '-b:v', CommandTemplatePlaceholder('VIDEO_BITRATE'),
+    CommandTemplatePlaceholder('RATE_CONTROL'),
+    CommandTemplatePlaceholder('ENCODING_THREADS'),
+    CommandTemplatePlaceholder('FORCE_KEY_FRAMES'),
     '-f', 'tee',
     '-map', '0:v',
     '-map', '0:a',
     FFMPEG_OUTPUT_DEFINITION_VIDEO_THUMB_STREAMS,
     )
 
+# single decode: video is scaled once per rung in a cascade inside -filter_complex,
+# outputs pick their branch with -map
+FFMPEG_TEMPLATE_FILTER_GRAPH = CommandTemplate('ffmpeg', '-y', CommandTemplatePlaceholder('PROGRESS'), '-re', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    '-filter_complex', CommandTemplatePlaceholder('FILTER_GRAPH'),
+    CommandTemplatePlaceholder('OUTPUT_DEFINITIONS'))
+
+# [in]scale=WxH[,split=N][out0][out1]...
+FFMPEG_FILTER_SCALE_NODE = CommandTemplate(
+    '[', CommandTemplatePlaceholder('INPUT_LABEL'), ']',
+    'scale=', CommandTemplatePlaceholder('WIDTH'), ':', CommandTemplatePlaceholder('HEIGHT'),
+    ':flags=', CommandTemplatePlaceholder('SCALER'),
+    CommandTemplatePlaceholder('SPLIT'),
+    CommandTemplatePlaceholder('OUTPUT_LABELS'),
+    inline=True)
+
+FFMPEG_OUTPUT_DEFINITION_AUDIO_MAPPED = CommandTemplate(
+    '-map', CommandTemplatePlaceholder('MAP'),
+    '-c:a', CommandTemplatePlaceholder('AUDIO_CODEC'),
+    '-ac', CommandTemplatePlaceholder('AUDIO_CHANNELS'),
+    '-ab', CommandTemplatePlaceholder('AUDIO_BITRATE'),
+    '-ar', CommandTemplatePlaceholder('AUDIO_SAMPLERATE'),
+    '-f', CommandTemplatePlaceholder('STREAM_CONTAINER'),
+    CommandTemplatePlaceholder('OUTPUT_STREAM')
+    )
+
+FFMPEG_OUTPUT_DEFINITION_VIDEO_MAPPED = CommandTemplate(
+    '-map', CommandTemplatePlaceholder('MAP'),
+    '-c:v', CommandTemplatePlaceholder('VIDEO_CODEC'),
+    '-r', CommandTemplatePlaceholder('FRAME_RATE'),
+    '-g', CommandTemplatePlaceholder('I_FRAME_RATE'),
+    '-preset', CommandTemplatePlaceholder('PRESET'),
+    '-pix_fmt', CommandTemplatePlaceholder('PIXEL_FORMAT'),
+    CommandTemplatePlaceholder('RATE_CONTROL'),
+    CommandTemplatePlaceholder('ENCODING_THREADS'),
+    CommandTemplatePlaceholder('FORCE_KEY_FRAMES'),
+    '-f', CommandTemplatePlaceholder('STREAM_CONTAINER'),
+    CommandTemplatePlaceholder('OUTPUT_STREAM')
+    )
+
+FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE_MAPPED = CommandTemplate(
+    '-map', CommandTemplatePlaceholder('MAP'),
+    '-c:v', CommandTemplatePlaceholder('VIDEO_CODEC'),
+    '-r', CommandTemplatePlaceholder('FRAME_RATE'),
+    '-g', CommandTemplatePlaceholder('I_FRAME_RATE'),
+    '-preset', CommandTemplatePlaceholder('PRESET'),
+    '-pix_fmt', CommandTemplatePlaceholder('PIXEL_FORMAT'),
+    CommandTemplatePlaceholder('RATE_CONTROL'),
+    CommandTemplatePlaceholder('ENCODING_THREADS'),
+    CommandTemplatePlaceholder('FORCE_KEY_FRAMES'),
+    '-f', 'tee',
+    FFMPEG_OUTPUT_DEFINITION_VIDEO_THUMB_STREAMS,
+    )
+
 
 FFMPEG_TEMPLATE_THUMBNAIL = CommandTemplate('ffmpeg', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
     '-ss', '00:00:01.000',
     '-vframes', '1',
     CommandTemplatePlaceholder('OUTPUT_FILE'))
 
+# source remuxed to MPEG-TS: pipe:1 for shared ingest (ingest.IngestHub), input fifo of a warm channel (pool.WarmPool)
+FFMPEG_TEMPLATE_INGEST = CommandTemplate('ffmpeg', '-y', '-nostdin', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    '-map', '0',
+    '-c', 'copy',
+    '-f', 'mpegts',
+    CommandTemplatePlaceholder('OUTPUT_FILE'))
+
+# long-lived thumbnailer: one decoder, PNGs are written back to back to stdout
+FFMPEG_TEMPLATE_THUMBNAIL_PERSISTENT = CommandTemplate('ffmpeg', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    '-an',
+    '-vf', CommandTemplate(
+        'fps=1/', CommandTemplatePlaceholder('THUMBNAIL_INTERVAL'),
+        inline=True,
+        name='FPS_FILTER'
+    ),
+    '-c:v', 'png',
+    '-f', 'image2pipe',
+    'pipe:1')
+
+# raw rgb24 tiles for trickplay.Storyboard
+FFMPEG_TEMPLATE_TRICKPLAY = CommandTemplate('ffmpeg', '-i', CommandTemplatePlaceholder('INPUT_STREAM'),
+    '-an',
+    '-vf', CommandTemplate(
+        'fps=1/', CommandTemplatePlaceholder('TRICKPLAY_INTERVAL'),
+        ',scale=', CommandTemplatePlaceholder('WIDTH'), ':', CommandTemplatePlaceholder('HEIGHT'),
+        inline=True,
+        name='TRICKPLAY_FILTER'
+    ),
+    '-pix_fmt', 'rgb24',
+    '-f', 'rawvideo',
+    'pipe:1')
+
 PACKAGER_TEMPLATE = CommandTemplate('packager', CommandTemplatePlaceholder('STREAM_DEFINITIONS'),
     '--profile', CommandTemplatePlaceholder('PROFILE'),
     '--mpd_output', CommandTemplatePlaceholder('MPD_FILENAME'),
@@ -132,7 +334,9 @@ PACKAGER_TEMPLATE = CommandTemplate('packager', CommandTemplatePlaceholder('STRE
         '--single_segment', '=', CommandTemplatePlaceholder('SINGLE_SEGMENT'),
         inline=True,
         name='SINGLE_SEGMENT_CONFIG'
-    ))
+    ),
+    CommandTemplatePlaceholder('TIME_SHIFT_BUFFER'), # [] or ['--time_shift_buffer_depth=N']
+    CommandTemplatePlaceholder('LOW_LATENCY')) # [] or ['--low_latency_dash_mode=true', '--fragment_duration=N', ...]
 
 PACKAGER_STREAM_DEFINITION = CommandTemplate(
     'input=', CommandTemplatePlaceholder('INPUT_STREAM_ADDRESS'), ',',
@@ -141,3 +345,11 @@ PACKAGER_STREAM_DEFINITION = CommandTemplate(
     'segment_template=', CommandTemplatePlaceholder('SEGMENT_TEMPLATE'), ',',
     'bandwidth=', CommandTemplatePlaceholder('BITRATE'),
     inline=True)
+
+# on-demand profile: one file per stream instead of init segment + segment template
+PACKAGER_STREAM_DEFINITION_VOD = CommandTemplate(
+    'input=', CommandTemplatePlaceholder('INPUT_STREAM_ADDRESS'), ',',
+    'stream=', CommandTemplatePlaceholder('STREAM_TYPE'), ',',
+    'output=', CommandTemplatePlaceholder('OUTPUT_NAME'), ',',
+    'bandwidth=', CommandTemplatePlaceholder('BITRATE'),
+    inline=True)
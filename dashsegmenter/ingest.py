@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# shared ingest: one read of a source fanned out to encoders of many channels
+
+from subprocess import Popen, PIPE
+from time import time
+import collections
+import errno
+import fcntl
+import os
+import shutil
+import signal
+import tempfile
+
+import internal_settings
+import command_templates
+import restarts
+import streams
+
+class ConsumerAlreadyAdded(Exception):
+    pass
+
+class Consumer(object):
+    def __init__(self, name, path, fd, position):
+        super(Consumer, self).__init__()
+        self.name = name
+        self.path = path # fifo to use as input_stream
+        self.fd = fd
+        self.position = position # stream offset of the next byte to write
+
+        self.sent = 0
+        self.drops = 0
+
+        # backoff of writes to a full fifo, it grows while nothing is read from it
+        self.retry_at = None
+        self.retry_interval = None
+
+class IngestHub(object):
+    """Receives a source once (ffmpeg -c copy to MPEG-TS) and fans it out to local encoders.
+
+    Data goes through a ring buffer of INGEST_BUFFER_SIZE bytes, every consumer gets its own
+    fifo and position in it. A consumer which falls a whole buffer behind is dropped: its
+    backlog is discarded and it continues at the live edge (MPEG-TS resyncs on the next
+    packet), so one slow encoder never stalls the others. A fifo without a reader is retried
+    less and less often, up to every INGEST_RETRY_MAX_INTERVAL.
+
+    It is driven by supervisor.Supervisor like a channel; channels use consumer(name) as their
+    input_stream. A fifo can only have one reader, the bytes would be split between readers;
+    StreamsController refuses fifo inputs with probe_source or a scheduler (one encoder per stream).
+    """
+    def __init__(self, source, buffer_size=None, debug=False):
+        super(IngestHub, self).__init__()
+        self.source = source
+        self.debug = debug
+        self.running = False
+
+        self._size = buffer_size if buffer_size != None else internal_settings.INGEST_BUFFER_SIZE
+        self._ring = bytearray(self._size)
+        self._head = 0 # stream offset of the next byte read from the source
+        self._origin = 0 # stream offset at which the current run of the source started, MPEG-TS packets count from it
+
+        self._directory = tempfile.mkdtemp(prefix='dashsegmenter-ingest-')
+        self._consumers = collections.OrderedDict()
+
+        self._process = None
+        self._pipe = None
+        self._restarts = restarts.ProcessRestarts('source')
+        self._rate = collections.deque(maxlen=internal_settings.INGEST_RATE_SAMPLES) # (time, head)
+
+    @property
+    def name(self):
+        return 'ingest:%s' % self.source
+
+    def consumer(self, name):
+        """Returns path of a fifo receiving the source, to be used as input_stream of a channel."""
+        if name in self._consumers:
+            raise ConsumerAlreadyAdded(name)
+
+        path = os.path.join(self._directory, '%s.ts' % name)
+        os.mkfifo(path, 0600)
+
+        # kept open for reading as well, so the encoder can come and go without us seeing EPIPE
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC) # the encoder opens it by path
+        try:
+            fcntl.fcntl(fd, streams.F_SETPIPE_SZ, internal_settings.FIFO_BUFFER_SIZE)
+        except IOError as e:
+            print 'Cannot enlarge fifo buffer of %s: %s' % (name, e)
+
+        self._consumers[name] = Consumer(name, path, fd, self._packet_boundary())
+
+        return path
+
+    @property
+    def pids(self):
+        return [self._process.pid] if self._process != None else []
+
+    @property
+    def children(self):
+        return dict((pid, 'source') for pid in self.pids)
+
+    def _spawn(self):
+        commandline = command_templates.FFMPEG_TEMPLATE_INGEST.compiled.eval({'INPUT_STREAM': self.source, 'OUTPUT_FILE': 'pipe:1'})
+        kwargs = {'stdout': PIPE, 'close_fds': True, 'preexec_fn': streams.set_pdeathsig(signal.SIGKILL)}
+        if self.debug:
+            print 'Ingest commandline:', commandline
+        else:
+            kwargs['stderr'] = streams.devnull()
+
+        self._process = Popen(commandline, **kwargs)
+        self._origin = self._head
+        self._pipe = self._process.stdout
+        fd = self._pipe.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def start(self):
+        self.running = True
+
+        try:
+            self._spawn()
+        except OSError as e:
+            self.stop()
+            raise streams.ProcessStartFailed('Cannot start ingest: %s' % str(e))
+
+    def stop(self):
+        self.running = False
+        self._close_pipe()
+
+        if self._process != None:
+            try:
+                os.kill(self._process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        for consumer in self._consumers.itervalues():
+            os.close(consumer.fd)
+        self._consumers.clear()
+
+        if self._directory != None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def _close_pipe(self):
+        if self._pipe != None:
+            self._pipe.close()
+            self._pipe = None
+
+    def child_exited(self, pid, status):
+        streams.mark_reaped(self._process, status)
+        self._process = None
+        self._close_pipe()
+
+        if not self.running:
+            return
+
+        if not self._restarts.failed(time()):
+            print 'Ingest of %s is crash looping (status %s), giving up' % (self.source, status)
+            self.stop()
+            return
+
+        print 'Ingest of %s has died (status %s), restarting it in %.1fs' % (self.source, status, self._restarts.restart_at - time())
+
+    @property
+    def fds(self):
+        return [self._pipe.fileno()] if self._pipe != None else []
+
+    def handle_readable(self, fd):
+        try:
+            data = os.read(fd, internal_settings.INGEST_READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        if not data:
+            self._close_pipe()
+            return
+
+        self._append(data)
+        self._fan_out(time())
+
+    def _append(self, data):
+        if len(data) > self._size:
+            self._head += len(data) - self._size
+            data = data[-self._size:]
+
+        start = self._head % self._size
+        first = min(len(data), self._size - start)
+        self._ring[start:start + first] = data[:first]
+        self._ring[0:len(data) - first] = data[first:]
+        self._head += len(data)
+
+        now = time()
+        if self._restarts.recovering:
+            self._restarts.recovered(now)
+        if not self._rate or now - self._rate[-1][0] >= internal_settings.INGEST_RATE_INTERVAL:
+            self._rate.append((now, self._head))
+
+    def _packet_boundary(self):
+        # a restarted source may have died in the middle of a packet, its packets start at _origin
+        return self._head - (self._head - self._origin) % internal_settings.INGEST_PACKET_SIZE
+
+    def _fan_out(self, now):
+        for consumer in self._consumers.itervalues():
+            # fell out of the buffer: skip to the live edge at a packet boundary
+            if self._head - consumer.position > self._size:
+                consumer.position = self._packet_boundary()
+                consumer.drops += 1
+
+            if consumer.retry_at != None and now < consumer.retry_at:
+                continue
+
+            sent = consumer.sent
+            while consumer.position < self._head:
+                start = consumer.position % self._size
+                end = min(self._size, start + (self._head - consumer.position))
+
+                try:
+                    written = os.write(consumer.fd, buffer(self._ring, start, end - start))
+                except OSError as e:
+                    if e.errno == errno.EAGAIN: # fifo full, the rest goes with the next data or tick
+                        break
+                    raise
+
+                consumer.position += written
+                consumer.sent += written
+
+            if consumer.position >= self._head:
+                consumer.retry_at = consumer.retry_interval = None
+                continue
+
+            if consumer.sent > sent or consumer.retry_interval == None:
+                consumer.retry_interval = internal_settings.INGEST_RETRY_INTERVAL
+            else:
+                consumer.retry_interval = min(consumer.retry_interval * 2, internal_settings.INGEST_RETRY_MAX_INTERVAL)
+            consumer.retry_at = now + consumer.retry_interval
+
+    def next_deadline(self):
+        if not self.running:
+            return None
+
+        if self._process == None:
+            return self._restarts.restart_at
+
+        # consumers with a backlog are retried even if the source goes quiet
+        retries = [consumer.retry_at for consumer in self._consumers.itervalues() if consumer.retry_at != None]
+
+        return min(retries) if retries else None
+
+    def tick(self, now):
+        if not self.running:
+            return
+
+        if self._process == None and self._restarts.restart_at != None and now >= self._restarts.restart_at:
+            try:
+                self._spawn()
+            except OSError as e:
+                print 'Cannot restart ingest of %s: %s' % (self.source, e)
+                if not self._restarts.failed(now):
+                    self.stop()
+                return
+
+            self._restarts.started(now)
+
+        self._fan_out(now)
+
+    def _byte_rate(self):
+        if len(self._rate) < 2:
+            return None
+
+        (first_time, first_head), (last_time, last_head) = self._rate[0], self._rate[-1]
+        if last_time <= first_time:
+            return None
+
+        return (last_head - first_head) / (last_time - first_time)
+
+    def stats(self):
+        """Returns 'source' -> input stats and 'consumer:<name>' -> lag and drops of every consumer."""
+        byte_rate = self._byte_rate()
+        stats = {'source': dict(self._restarts.stats, bytes=self._head)}
+        if byte_rate != None:
+            stats['source']['bitrate_kbps'] = byte_rate * 8 / 1000
+
+        for name, consumer in self._consumers.iteritems():
+            lag = self._head - consumer.position
+            consumer_stats = {'lag_bytes': lag, 'drops': consumer.drops, 'bytes': consumer.sent}
+            if byte_rate:
+                consumer_stats['lag_seconds'] = lag / byte_rate
+
+            stats['consumer:%s' % name] = consumer_stats
+
+        return stats
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# verification of packaged live segments: boundaries, key frames, timeline drift, bitrate
+
+import collections
+import mmap
+import os
+import re
+import struct
+
+import internal_settings
+import inotify
+
+_BOX_HEADER = struct.Struct('>I4s')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+
+SAMPLE_IS_NON_SYNC = 0x10000
+
+class InvalidSegment(Exception):
+    pass
+
+def _boxes(data, start, end):
+    """Yields (type, payload start, box end) of the boxes in data[start:end], payloads are not read."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = _BOX_HEADER.unpack_from(data, offset)
+        header = 8
+
+        if size == 1:
+            if offset + 16 > end:
+                raise InvalidSegment('truncated %s box' % box_type)
+            size = _UINT64.unpack_from(data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+
+        if size < header or offset + size > end:
+            raise InvalidSegment('%s box of %d bytes does not fit' % (box_type, size))
+
+        yield box_type, offset + header, offset + size
+        offset += size
+
+def _find(data, start, end, path):
+    """Returns (payload start, box end) of the first box on path (e.g. ['moov', 'trak']), None if missing."""
+    for box_type, payload, box_end in _boxes(data, start, end):
+        if box_type != path[0]:
+            continue
+
+        if len(path) == 1:
+            return payload, box_end
+
+        return _find(data, payload, box_end, path[1:])
+
+    return None
+
+class TrackInfo(object):
+    """What media segments need from the init segment: media timescale and trex defaults."""
+    def __init__(self, timescale, default_duration=0, default_flags=0):
+        super(TrackInfo, self).__init__()
+        self.timescale = timescale
+        self.default_duration = default_duration
+        self.default_flags = default_flags
+
+def parse_init(data):
+    mdhd = _find(data, 0, len(data), ['moov', 'trak', 'mdia', 'mdhd'])
+    if mdhd == None:
+        raise InvalidSegment('no mdhd in init segment')
+
+    payload = mdhd[0]
+    version = ord(data[payload])
+    timescale = _UINT32.unpack_from(data, payload + (20 if version == 1 else 12))[0]
+
+    trex = _find(data, 0, len(data), ['moov', 'mvex', 'trex'])
+    if trex == None:
+        return TrackInfo(timescale)
+
+    # version/flags, track_ID, default_sample_description_index, duration, size, flags
+    _, _, _, default_duration, _, default_flags = struct.unpack_from('>IIIIII', data, trex[0])
+    return TrackInfo(timescale, default_duration, default_flags)
+
+class SegmentInfo(object):
+    def __init__(self, start, duration, key_frame, size):
+        super(SegmentInfo, self).__init__()
+        self.start = start # seconds, tfdt of the first fragment
+        self.duration = duration # seconds
+        self.key_frame = key_frame # first sample is a sync sample
+        self.size = size # bytes
+
+def _parse_traf(data, start, end, track):
+    """Returns (base decode time or None, duration in timescale units, flags of the first sample) of a traf."""
+    decode_time = None
+    default_duration = track.default_duration
+    default_flags = track.default_flags
+    duration = 0
+    first_flags = None
+
+    for box_type, payload, _box_end in _boxes(data, start, end):
+        version_flags = _UINT32.unpack_from(data, payload)[0]
+        version, flags = version_flags >> 24, version_flags & 0xffffff
+
+        if box_type == 'tfhd':
+            offset = payload + 8 # version/flags, track_ID
+            if flags & 0x1: # base_data_offset
+                offset += 8
+            if flags & 0x2: # sample_description_index
+                offset += 4
+            if flags & 0x8:
+                default_duration = _UINT32.unpack_from(data, offset)[0]
+                offset += 4
+            if flags & 0x10: # default_sample_size
+                offset += 4
+            if flags & 0x20:
+                default_flags = _UINT32.unpack_from(data, offset)[0]
+
+        elif box_type == 'tfdt':
+            decode_time = (_UINT64 if version == 1 else _UINT32).unpack_from(data, payload + 4)[0]
+
+        elif box_type == 'trun':
+            count = _UINT32.unpack_from(data, payload + 4)[0]
+            offset = payload + 8
+            if flags & 0x1: # data_offset
+                offset += 4
+            if flags & 0x4:
+                first_flags = _UINT32.unpack_from(data, offset)[0]
+                offset += 4
+
+            if not flags & 0x100:
+                duration += count * default_duration
+            else:
+                fields = bin(flags & 0xf00).count('1')
+                durations = struct.unpack_from('>%dI' % (count * fields), data, offset)[::fields]
+                duration += sum(durations)
+
+            if first_flags == None:
+                if flags & 0x400 and count:
+                    # per sample fields are duration, size, flags, composition offset, in this order
+                    first_flags = _UINT32.unpack_from(data, offset + 4 * bin(flags & 0x300).count('1'))[0]
+                else:
+                    first_flags = default_flags
+
+    return decode_time, duration, first_flags
+
+def parse_segment(data, track):
+    """Reads timing of a media segment (styp? sidx? (moof mdat)+) from data, mdat payloads are skipped."""
+    start = None
+    duration = 0
+    key_frame = None
+    sidx = None
+
+    for box_type, payload, box_end in _boxes(data, 0, len(data)):
+        if box_type == 'moof':
+            traf = _find(data, payload, box_end, ['traf'])
+            if traf == None:
+                continue
+
+            decode_time, traf_duration, first_flags = _parse_traf(data, traf[0], traf[1], track)
+            if start == None:
+                start = decode_time
+                key_frame = first_flags != None and not first_flags & SAMPLE_IS_NON_SYNC
+            duration += traf_duration
+
+        elif box_type == 'sidx' and sidx == None:
+            sidx = payload
+
+    if start == None and sidx != None:
+        # no fragment (or no tfdt), fall back to the segment index
+        version = ord(data[sidx])
+        timescale = _UINT32.unpack_from(data, sidx + 8)[0]
+        if version == 0:
+            start, references_offset = _UINT32.unpack_from(data, sidx + 12)[0], sidx + 20
+        else:
+            start, references_offset = _UINT64.unpack_from(data, sidx + 12)[0], sidx + 28
+        count = struct.unpack_from('>H', data, references_offset + 2)[0]
+        references = struct.unpack_from('>%dI' % (count * 3), data, references_offset + 4)
+
+        duration = sum(references[1::3])
+        key_frame = bool(references[2] & 0x80000000) if count else None
+        return SegmentInfo(start / float(timescale), duration / float(timescale), key_frame, len(data))
+
+    if start == None:
+        raise InvalidSegment('no fragment with tfdt')
+
+    return SegmentInfo(start / float(track.timescale), duration / float(track.timescale), key_frame, len(data))
+
+def _read_mapped(path, parser, *args):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise InvalidSegment('empty file')
+
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            return parser(data, *args)
+        finally:
+            data.close()
+
+class StreamReport(object):
+    def __init__(self, stream):
+        super(StreamReport, self).__init__()
+        self.stream = stream
+        self.track = None # TrackInfo, read with the first segment
+
+        self.segments = collections.deque(maxlen=internal_settings.INSPECTOR_SAMPLES) # (number, SegmentInfo)
+        self.anchor = None # (number, start) the timeline is measured from
+        self.drift = None # seconds the latest segment starts off (number - 1) * chunk_interval
+        self.missing_key_frames = 0
+        self.invalid = 0
+
+    @property
+    def stats(self):
+        stats = {'declared_kbps': self.stream.bitrate / 1000.0, 'invalid_segments': self.invalid}
+        if not self.segments:
+            return stats
+
+        durations = sorted(segment.duration for _number, segment in self.segments)
+        stats['segment_duration'] = durations[len(durations) // 2]
+        stats['segment_duration_min'] = durations[0]
+        stats['segment_duration_max'] = durations[-1]
+
+        total = sum(durations)
+        if total > 0:
+            stats['bitrate_kbps'] = sum(segment.size for _number, segment in self.segments) * 8.0 / total / 1000
+            stats['bandwidth_ratio'] = stats['bitrate_kbps'] / stats['declared_kbps']
+
+        stats['drift'] = self.drift
+        if self.stream.stream_type == 'video':
+            stats['missing_key_frames'] = self.missing_key_frames
+
+        return stats
+
+class SegmentInspector(object):
+    """Parses every segment the packager completes in output_path and checks it against the settings.
+
+    For every stream it reports segment durations (expected: chunk_interval), timeline drift
+    (tfdt against (number - 1) * chunk_interval, counted from the first segment seen), actual
+    bitrate against the declared one and segments not starting with a key frame. Video renditions
+    are compared with each other, segments of one number have to start at the same time.
+
+    Files are memory mapped and only box headers and fragment metadata are read, mdat is skipped.
+    """
+    def __init__(self, output_path, streams, chunk_interval):
+        super(SegmentInspector, self).__init__()
+        self.output_path = output_path
+        self.chunk_interval = chunk_interval
+
+        self.aligned_segments = 0
+        self.misaligned_segments = 0
+
+        # streams the packager does not get (a thumbnail-only rendition) never have segments
+        streams = [stream for stream in streams if stream.packaged]
+
+        self._reports = {}
+        self._patterns = []
+        for stream in streams:
+            prefix, _, suffix = stream.segment_template.partition('$Number$')
+            self._patterns.append((re.compile('^%s(\d+)%s$' % (re.escape(prefix), re.escape(suffix))), stream))
+            self._reports[(stream.stream_type, stream.name)] = StreamReport(stream)
+
+        # audio and video streams may share a name, streams are keyed by (stream_type, name)
+        self._video = set((stream.stream_type, stream.name) for stream in streams if stream.stream_type == 'video')
+        self._starts = collections.OrderedDict() # segment number -> {(stream_type, name): start}, until all renditions are in
+        self._inotify = None
+
+    def start(self):
+        try:
+            self._inotify = inotify.Inotify()
+            self._inotify.add_watch(self.output_path, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+        except (inotify.InotifyUnavailable, OSError) as e:
+            print 'Segments are not inspected:', e
+            self.stop()
+
+    def stop(self):
+        if self._inotify != None:
+            self._inotify.close()
+            self._inotify = None
+
+    @property
+    def fds(self):
+        if self._inotify == None:
+            return []
+
+        return [self._inotify.fileno()]
+
+    def handle_readable(self, fd):
+        for _wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                continue
+
+            self.segment_completed(name)
+
+    def next_deadline(self):
+        return None
+
+    def tick(self, now):
+        pass
+
+    def _match(self, name):
+        for pattern, stream in self._patterns:
+            match = pattern.match(name)
+            if match != None:
+                return stream, int(match.group(1))
+
+        return None, None
+
+    def segment_completed(self, name):
+        stream, number = self._match(name)
+        if number == None:
+            return
+
+        report = self._reports[(stream.stream_type, stream.name)]
+
+        try:
+            if report.track == None:
+                report.track = _read_mapped(os.path.join(self.output_path, stream.init_segment_name), parse_init)
+
+            segment = _read_mapped(os.path.join(self.output_path, name), parse_segment, report.track)
+        except InvalidSegment as e:
+            report.invalid += 1
+            print 'Segment %s of channel %s is invalid: %s' % (name, self.output_path, e)
+            return
+        except (IOError, OSError, ValueError): # removed by retention already, or not written yet
+            return
+
+        self._add(report, number, segment)
+
+    def _add(self, report, number, segment):
+        # low latency segments may be seen more than once, the latest version counts
+        if report.segments and report.segments[-1][0] == number:
+            report.segments.pop()
+        report.segments.append((number, segment))
+
+        if report.anchor == None:
+            report.anchor = (number, segment.start)
+        report.drift = segment.start - (report.anchor[1] + (number - report.anchor[0]) * self.chunk_interval)
+
+        key = (report.stream.stream_type, report.stream.name)
+        if key not in self._video:
+            return
+
+        if not segment.key_frame:
+            report.missing_key_frames += 1
+
+        starts = self._starts.setdefault(number, {})
+        starts[key] = segment.start
+
+        if len(starts) == len(self._video):
+            del self._starts[number]
+
+            if max(starts.values()) - min(starts.values()) > internal_settings.INSPECTOR_ALIGNMENT_TOLERANCE:
+                self.misaligned_segments += 1
+            else:
+                self.aligned_segments += 1
+
+        while len(self._starts) > internal_settings.INSPECTOR_PENDING_SEGMENTS:
+            self._starts.popitem(last=False)
+
+    @property
+    def stats(self):
+        """Returns 'segments:<stream type>:<stream name>' -> stats of every stream and 'segments' -> rendition alignment."""
+        stats = dict(('segments:%s:%s' % key, report.stats) for key, report in self._reports.iteritems())
+        stats['segments'] = {'aligned_segments': self.aligned_segments, 'misaligned_segments': self.misaligned_segments}
+
+        return stats
@@ -32,6 +32,12 @@ STREAM_CONTAINER = 'mpegts'
 
 STREAM_ADDRESS_INPUT = 'udp://%(address)s:%(port)s'
 STREAM_ADDRESS_OUTPUT = 'udp://%(address)s:%(port)s'
+STREAM_ADDRESS_LOCAL = '%(path)s'
+
+# transport between ffmpeg and packager
+TRANSPORT_UDP = 'udp' # lossy under load
+TRANSPORT_FIFO = 'fifo' # named pipes, backpressure instead of drops
+FIFO_BUFFER_SIZE = 1024 * 1024 # bytes, capped by /proc/sys/fs/pipe-max-size
 
 AUDIO_CODEC = 'libfdk_aac'
 AUDIO_CHANNELS = '2'
@@ -40,12 +46,32 @@ AUDIO_SAMPLERATE = '44100'
 VIDEO_CODEC = 'libx264'
 VIDEO_PRESET = 'fast'
 PIXEL_FORMAT = 'yuv420p'
+CASCADE_SCALER = 'bicubic' # same as the scaler behind per output -s
+
+# video rate control (VideoStream(rate_control=...)), bitrate is the average (abr) or the cap (capped_crf)
+RATE_CONTROL_ABR = 'abr'
+RATE_CONTROL_CAPPED_CRF = 'capped_crf' # quality target, easy content takes less than bitrate
+CAPPED_CRF = 23
+CAPPED_CRF_BUFFER = 2 # seconds of bitrate in the VBV buffer, at most MPD minBufferTime so bandwidth= stays a valid cap
+
+PROBE_TIMEOUT = 10 # seconds, ffprobe -rw_timeout
+PROBE_KILL_TIMEOUT = 15 # seconds, ffprobe is killed after it (-rw_timeout does not apply to udp)
+PROBE_CACHE_SIZE = 256 # probed inputs remembered
 
 DASH_PROFILE = 'live'
 MPD_FILENAME = 'manifest.mpd'
 THUMB_FILENAME = 'thumbnail.png'
 SINGLE_SEGMENT = 'false'
 
+# low latency DASH (Settings(low_latency=True)): CMAF chunks of segments are published as they are written
+LOW_LATENCY_CHUNK_DURATION = 0.5 # seconds
+LATENCY_SAMPLES = 30 # latest segments latency.SegmentLatency reports the median of
+
+# segment verification (Settings(inspect_segments=True)), inspector.SegmentInspector
+INSPECTOR_SAMPLES = 30 # latest segments of a stream durations and bitrate are reported for
+INSPECTOR_ALIGNMENT_TOLERANCE = 0.001 # seconds renditions may differ in segment start
+INSPECTOR_PENDING_SEGMENTS = 10 # segment numbers waiting for the other renditions
+
 # audio and video file names must be different!
 INIT_SEGMENT_NAME_AUDIO = '%s_init_a.mp4'
 INIT_SEGMENT_NAME_VIDEO = '%s_init_v.mp4'
@@ -53,6 +79,89 @@ SEGMENT_TEMPLATE_AUDIO = '%s_$Number$_a.mp4'
 SEGMENT_TEMPLATE_VIDEO = '%s_$Number$_v.mp4'
 THUMBNAIL_FILENAME = 'thumbnail.png'
 THUMBNAIL_TEMPORARY_FILENAME = '.thumbnail.png'
+THUMBNAIL_TIMEOUT = 30 # seconds
+THUMBNAIL_MAX_SIZE = 16 * 1024 * 1024 # bytes, persistent thumbnailer only
+
+# VOD (vod.VodBatch)
+VOD_DASH_PROFILE = 'on-demand'
+VOD_SINGLE_SEGMENT = 'true'
+VOD_SEGMENT_DURATION = 4 # seconds, subsegments referenced from sidx
+VOD_OUTPUT_NAME_AUDIO = '%s_a.mp4'
+VOD_OUTPUT_NAME_VIDEO = '%s_v.mp4'
+VOD_INTERMEDIATE_NAME = '%s_%s.ts' # stream type, stream name
+VOD_THREADS_PER_JOB = 4 # cpus one transcoding job is expected to keep busy
+VOD_CHUNK_DURATION = 60 # seconds, vod.ChunkedTranscoder
+
+# trickplay storyboards (trickplay.Storyboard)
+TRICKPLAY_INTERVAL = 5 # seconds between tiles
+TRICKPLAY_TILE_WIDTH = 160 # pixels, height follows the thumbnail stream aspect ratio
+TRICKPLAY_COLUMNS = 5
+TRICKPLAY_ROWS = 5
+TRICKPLAY_WINDOW = 3600 # seconds of sheets kept when there is no timeshift_window
+TRICKPLAY_COMPRESSION = 1 # zlib level of sheets, they are rewritten with every tile
+TRICKPLAY_SHEET_NAME = 'storyboard_%d.png'
+TRICKPLAY_VTT_FILENAME = 'storyboard.vtt'
+
+# restarts of died ffmpeg/packager (restarts.ProcessRestarts)
+RESTART_BACKOFF_INITIAL = 0.5 # seconds
+RESTART_BACKOFF_MAX = 30 # seconds
+RESTART_STABLE_TIME = 60 # seconds of uptime after which backoff starts over
+RESTART_CRASH_LOOP_LIMIT = 5 # failures within the window that stop the channel
+RESTART_CRASH_LOOP_WINDOW = 120 # seconds
+RESTART_RECOVERY_POLL = 0.2 # seconds between checks whether a restarted process works
+RESTART_RECOVERY_TIMEOUT = 60 # seconds after a restart when the checks stop
+
+# shared ingest, ingest.IngestHub
+INGEST_BUFFER_SIZE = 8 * 1024 * 1024 # bytes, a consumer further behind than this is dropped to the live edge
+INGEST_READ_SIZE = 64 * 1024 # bytes
+INGEST_PACKET_SIZE = 188 # MPEG-TS, consumers are resumed at packet boundaries
+INGEST_RETRY_INTERVAL = 0.05 # seconds between writes to consumers with a backlog
+INGEST_RETRY_MAX_INTERVAL = 0.5 # seconds, the interval doubles up to it while a consumer takes nothing (no reader)
+INGEST_RATE_INTERVAL = 1 # seconds between input bitrate samples
+INGEST_RATE_SAMPLES = 10
+
+# warm standby channels, pool.WarmPool
+POOL_INPUT_NAME = 'slot-%d.ts' # input fifo of a slot
+POOL_OUTPUT_NAME = 'slot-%d' # output directory of a slot, attached channels get a symlink to it
 
 STARTING_PORT_NUMBER = 10000
 PORT_INCREMENT = 100
+
+# ports.PortAllocator
+PORT_RANGE_END = 32767 # last port handed out, the ephemeral range (ffmpeg's sending sockets) starts above
+# reservations of all processes of this user on the host, None: ports in RUNTIME_DIRECTORY
+PORT_REGISTRY = None
+# private (0700) directory of this user, None: $XDG_RUNTIME_DIR/dashsegmenter or /tmp/dashsegmenter-<uid>
+RUNTIME_DIRECTORY = None
+
+# RAM staging (Settings(staging_path=...)), publish.SegmentPublisher
+PUBLISH_THREADS = 4
+PUBLISH_TIMEOUT = 10 # seconds, S3 requests
+PUBLISH_RETRY_DELAY = 0.5 # seconds, doubles with every failed attempt of a file
+PUBLISH_RETRY_MAX_DELAY = 30 # seconds
+PUBLISH_DRAIN_TIMEOUT = 10 # seconds stop() waits for files already queued
+PUBLISH_LATENCY_SAMPLES = 100 # latest files flush_latency is the median of
+PUBLISH_MPD_COPIES = '.mpd' # directory in staging holding MPD versions waiting for their segments
+
+ORIGIN_PORT = 8080
+ORIGIN_BACKLOG = 1024
+ORIGIN_MAX_REQUEST_SIZE = 16 * 1024 # bytes
+ORIGIN_SENDFILE_CHUNK = 1024 * 1024 # bytes
+ORIGIN_FILE_CACHE_SIZE = 256 # open segments kept per channel
+ORIGIN_CACHE_CONTROL_LIVE = 'public, max-age=1'
+# media segments: a restarted packager (or channel) numbers segments from 1 again, so names come back
+# with new content; max-age stays below RESTART_BACKOFF_INITIAL + segment duration, ETags make revalidation cheap
+ORIGIN_CACHE_CONTROL_SEGMENT = 'public, max-age=1'
+
+# supervisor.Supervisor
+METRICS_SNAPSHOT_INTERVAL = 1 # seconds between metrics_snapshot() updates, taken in the supervisor loop
+
+# resources.ResourceSampler
+RESOURCE_SAMPLE_INTERVAL = 1 # seconds
+RESOURCE_STAT_EVERY = 3 # intervals between reads of /proc/<pid>/stat (cpu, rss) of a process
+RESOURCE_DETAILS_EVERY = 15 # intervals between reads of /proc/<pid>/status and io of a process, a multiple of RESOURCE_STAT_EVERY
+
+# encoder thread budgets used by scheduler.CpuScheduler
+ENCODER_PIXEL_RATE_PER_THREAD = 20000000 # pixels per second, 720p30 gets 2 threads, 1080p30 gets 4
+ENCODER_BITRATE_PER_EXTRA_THREAD = 8000000 # bits per second
+ENCODER_MAX_THREADS = 8
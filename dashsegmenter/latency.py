@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# segment availability latency of a live channel
+
+from time import time
+import collections
+import re
+
+import internal_settings
+import inotify
+
+class SegmentLatency(object):
+    """Measures how long after its media was ingested a segment becomes available.
+
+    Input timestamps come from the encoder clock (wall time minus ffmpeg out_time, see clock),
+    segment N of a template covers media time [(N - 1) * duration, N * duration). When the
+    packager creates a segment its first chunk is available (low latency mode writes it
+    chunk by chunk), when the file is closed it is complete:
+
+    first_chunk_latency = creation time - ingest time of the first frame of the segment
+    segment_latency = completion time - ingest time of the last frame of the segment
+
+    Encoder lookahead is not included, the encoder clock starts with its first output.
+    A restarted encoder starts its clock over, a restarted packager its segment numbers; after
+    either one the next segment is taken as holding the media encoded right now, and later
+    segments are counted from it.
+    """
+    def __init__(self, output_path, streams, segment_duration, clock):
+        super(SegmentLatency, self).__init__()
+        self.output_path = output_path
+        self.segment_duration = segment_duration
+        self.clock = clock # callable returning wall time at which media time 0 was ingested, None if unknown
+
+        self._patterns = []
+        for stream in streams:
+            prefix, _, suffix = stream.segment_template.partition('$Number$')
+            self._patterns.append(re.compile('^%s(\d+)%s$' % (re.escape(prefix), re.escape(suffix))))
+
+        self._first_chunk = collections.deque(maxlen=internal_settings.LATENCY_SAMPLES)
+        self._complete = collections.deque(maxlen=internal_settings.LATENCY_SAMPLES)
+        self._inotify = None
+
+        self._origin = 0 # media time at which segment 1 starts, None until the next segment after a restart
+        self._last_clock = None
+        self._last_numbers = {} # pattern -> latest segment number
+
+    def start(self):
+        try:
+            self._inotify = inotify.Inotify()
+            self._inotify.add_watch(self.output_path, inotify.IN_CREATE | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+        except (inotify.InotifyUnavailable, OSError) as e:
+            print 'Segment latency is not measured:', e
+            self.stop()
+
+    def stop(self):
+        if self._inotify != None:
+            self._inotify.close()
+            self._inotify = None
+
+    @property
+    def fds(self):
+        if self._inotify == None:
+            return []
+
+        return [self._inotify.fileno()]
+
+    def handle_readable(self, fd):
+        now = time()
+
+        for _wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                continue
+
+            self.segment_event(name, now, complete=not (mask & inotify.IN_CREATE))
+
+    def next_deadline(self):
+        return None
+
+    def tick(self, now):
+        pass
+
+    def _match(self, name):
+        """Returns (pattern, segment number) of a segment name, None for other files."""
+        for pattern in self._patterns:
+            match = pattern.match(name)
+            if match != None:
+                return pattern, int(match.group(1))
+
+        return None
+
+    def _detect_restart(self, pattern, number, ingest_start):
+        if self._last_clock != None and abs(ingest_start - self._last_clock) > self.segment_duration:
+            self._origin = None
+
+        if number < self._last_numbers.get(pattern, 0):
+            self._origin = None
+            self._last_numbers.clear()
+
+        self._last_clock = ingest_start
+        self._last_numbers[pattern] = number
+
+    def segment_event(self, name, now, complete):
+        match = self._match(name)
+        ingest_start = self.clock()
+
+        if match == None or ingest_start == None:
+            return
+
+        pattern, number = match
+        self._detect_restart(pattern, number, ingest_start)
+
+        # segment N covers media time [origin + (N - 1) * duration, origin + N * duration)
+        boundary = number if complete else number - 1
+
+        if self._origin == None:
+            # the segment written now holds the media encoded now, aligned to its segment boundary
+            media_time = (now - ingest_start) // self.segment_duration * self.segment_duration
+            self._origin = media_time - boundary * self.segment_duration
+            return
+
+        latency = now - (ingest_start + self._origin + boundary * self.segment_duration)
+        if complete:
+            self._complete.append(latency)
+        else:
+            self._first_chunk.append(latency)
+
+    @staticmethod
+    def _median(samples):
+        if not samples:
+            return None
+
+        return sorted(samples)[len(samples) // 2]
+
+    @property
+    def stats(self):
+        stats = {}
+
+        for name, samples in (('first_chunk_latency', self._first_chunk), ('segment_latency', self._complete)):
+            median = self._median(samples)
+            if median != None:
+                stats[name] = median
+
+        return stats
+
+class StartupLatency(object):
+    """Measures how long a channel takes from start to its first segment and its first MPD in output_path.
+
+    A warm channel (pool.WarmPool) is measured from the moment it is attached to a source, see reset().
+    """
+    def __init__(self, output_path, streams):
+        super(StartupLatency, self).__init__()
+        self.output_path = output_path
+
+        self.started_at = None
+        self.first_segment = None # seconds from start
+        self.first_mpd = None # seconds from start
+
+        self._patterns = []
+        for stream in streams:
+            prefix, _, suffix = stream.segment_template.partition('$Number$')
+            self._patterns.append(re.compile('^%s(\d+)%s$' % (re.escape(prefix), re.escape(suffix))))
+
+        self._inotify = None
+
+    def start(self):
+        if self.started_at == None:
+            self.started_at = time()
+
+        try:
+            self._inotify = inotify.Inotify()
+            self._inotify.add_watch(self.output_path, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+        except (inotify.InotifyUnavailable, OSError) as e:
+            print 'Channel startup latency is not measured:', e
+            self.stop()
+
+    def stop(self):
+        if self._inotify != None:
+            self._inotify.close()
+            self._inotify = None
+
+    def reset(self, now):
+        """Measures again from now on."""
+        self.stop()
+        self.started_at = now
+        self.first_segment = None
+        self.first_mpd = None
+        self.start()
+
+    @property
+    def fds(self):
+        if self._inotify == None:
+            return []
+
+        return [self._inotify.fileno()]
+
+    def handle_readable(self, fd):
+        now = time()
+
+        for _wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                continue
+
+            if name == internal_settings.MPD_FILENAME:
+                if self.first_mpd == None:
+                    self.first_mpd = now - self.started_at
+            elif self.first_segment == None and any(pattern.match(name) for pattern in self._patterns):
+                self.first_segment = now - self.started_at
+
+        # nothing left to measure
+        if self.first_mpd != None and self.first_segment != None:
+            self.stop()
+
+    def next_deadline(self):
+        return None
+
+    def tick(self, now):
+        pass
+
+    @property
+    def stats(self):
+        stats = {}
+
+        for name, value in (('start_to_first_segment', self.first_segment), ('start_to_first_mpd', self.first_mpd)):
+            if value != None:
+                stats[name] = value
+
+        return stats
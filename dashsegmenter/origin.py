@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# small, single threaded HTTP origin for output_path of one or more channels
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import select
+import socket
+import stat
+
+import internal_settings
+import inotify
+
+_libc = None
+def _get_libc():
+    global _libc
+
+    if _libc == None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+        libc.sendfile.restype = ctypes.c_ssize_t
+        _libc = libc
+
+    return _libc
+
+def sendfile(out_fd, in_fd, offset, count):
+    """os.sendfile() replacement for python 2, returns number of bytes sent."""
+    position = ctypes.c_longlong(offset)
+    sent = _get_libc().sendfile(out_fd, in_fd, ctypes.byref(position), count)
+    if sent < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    return sent
+
+def _cloexec(fd):
+    # python 2 opens everything inheritable, channels spawned from the same process must not hold
+    # the listener, connections or segments
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    return fd
+
+RESPONSE_TEMPLATE = 'HTTP/1.1 %s\r\nServer: dashsegmenter\r\n%s%s\r\n'
+CONTENT_LENGTH_HEADER = 'Content-Length: %d\r\n'
+CHUNKED_HEADER = 'Transfer-Encoding: chunked\r\n'
+STATUS_TEXT = {
+    200: '200 OK',
+    304: '304 Not Modified',
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    405: '405 Method Not Allowed',
+}
+CONTENT_TYPES = {
+    '.mpd': 'application/dash+xml',
+    '.mp4': 'video/mp4',
+    '.m4s': 'video/iso.segment',
+    '.png': 'image/png',
+    '.vtt': 'text/vtt',
+    '.jpg': 'image/jpeg',
+}
+# init segments keep their name but are rewritten when the packager restarts
+INIT_SEGMENT_SUFFIXES = tuple(template.partition('%s')[2] for template in
+    (internal_settings.INIT_SEGMENT_NAME_AUDIO, internal_settings.INIT_SEGMENT_NAME_VIDEO))
+
+class Channel(object):
+    """output_path of a channel with its MPD cache and metadata of files already served."""
+    def __init__(self, prefix, output_path, low_latency=False):
+        super(Channel, self).__init__()
+        self.prefix = prefix
+        self.output_path = output_path
+        self.low_latency = low_latency
+
+        self.mpd = None # (body, etag)
+        self.files = {} # name -> (fd, size, etag)
+        self.in_progress = set() # files created but not closed yet
+        self.readers = {} # name -> connections streaming it while it is written (low_latency)
+
+    def invalidate(self, name):
+        if name == internal_settings.MPD_FILENAME:
+            self.mpd = None
+
+        cached = self.files.pop(name, None)
+        if cached != None:
+            os.close(cached[0])
+
+    def close(self):
+        for name in self.files.keys():
+            self.invalidate(name)
+
+class Connection(object):
+    def __init__(self, sock):
+        super(Connection, self).__init__()
+        self.sock = sock
+        self.received = ''
+        self.output = '' # headers or in-memory body
+        self.file = None # (fd, offset, remaining) sent after output
+        self.growing = None # (fd, channel, name) of a file still being written, sent chunked after output
+        self.growing_closed = False # its writer has closed it, what is left ends the response
+        self.keep_alive = True
+
+class OriginServer(object):
+    """Serves manifest.mpd from memory and segments with sendfile(), driven by epoll.
+
+    The MPD and file metadata are cached until inotify reports the packager
+    closed or renamed the file. Everything gets a short cache lifetime, media segments too: their
+    names are reused once the packager restarts (see ORIGIN_CACHE_CONTROL_SEGMENT); conditional
+    requests are answered from ETags.
+    Dotfiles and .tmp files (written before being renamed into place) are never served.
+
+    Low latency channels (add_channel(low_latency=True)) have segments still being written by the
+    packager streamed to HTTP/1.1 clients with chunked transfer encoding, growing as inotify reports
+    writes, and ended once the packager closes them. Other files are served once they are complete.
+    """
+    def __init__(self, address=('0.0.0.0', internal_settings.ORIGIN_PORT)):
+        super(OriginServer, self).__init__()
+        self._channels = {} # prefix -> Channel
+        self._watches = {} # inotify wd -> Channel
+        self._connections = {} # fd -> Connection
+        self._metrics = None
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(internal_settings.ORIGIN_BACKLOG)
+        self._listener.setblocking(False)
+        _cloexec(self._listener.fileno())
+        self.address = self._listener.getsockname()
+
+        self._inotify = inotify.Inotify()
+
+        self._epoll = select.epoll()
+        _cloexec(self._epoll.fileno())
+        self._epoll.register(self._listener.fileno(), select.EPOLLIN)
+        self._epoll.register(self._inotify.fileno(), select.EPOLLIN)
+
+    def add_channel(self, prefix, output_path, low_latency=False):
+        """Serves files of output_path under /prefix/, with low_latency also while they are written."""
+        prefix = prefix.strip('/')
+        channel = self._channels[prefix] = Channel(prefix, output_path, low_latency)
+
+        mask = inotify.IN_CREATE | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_DELETE
+        if low_latency:
+            mask |= inotify.IN_MODIFY
+        wd = self._inotify.add_watch(output_path, mask)
+        self._watches[wd] = channel
+
+        return channel
+
+    def set_metrics(self, metrics):
+        """Serves text returned by metrics() on /metrics, called in the thread serving requests.
+
+        For a supervisor running in another thread pass Supervisor.metrics_snapshot.
+        """
+        self._metrics = metrics
+
+    def serve_forever(self):
+        while True:
+            self.serve_once()
+
+    def serve_once(self, timeout=-1):
+        try:
+            events = self._epoll.poll(timeout)
+        except IOError as e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+
+        for fd, event in events:
+            if fd == self._listener.fileno():
+                self._accept()
+            elif fd == self._inotify.fileno():
+                self._handle_inotify()
+            elif fd in self._connections:
+                self._handle_connection(self._connections[fd], event)
+
+    def close(self):
+        for connection in self._connections.values():
+            self._close_connection(connection)
+
+        for channel in self._channels.itervalues():
+            channel.close()
+
+        self._epoll.close()
+        self._inotify.close()
+        self._listener.close()
+
+    def _handle_inotify(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                for channel in self._channels.itervalues():
+                    # it is not known anymore when streamed files end, their clients have to retry
+                    for readers in channel.readers.values():
+                        for connection in list(readers):
+                            self._close_connection(connection)
+
+                    channel.close()
+                    channel.mpd = None
+                    channel.in_progress.clear()
+                continue
+
+            channel = self._watches.get(wd)
+            if channel == None:
+                continue
+
+            if mask & inotify.IN_MODIFY:
+                for connection in list(channel.readers.get(name, ())):
+                    self._process(connection)
+                continue
+
+            if mask & inotify.IN_CREATE:
+                # MPD keeps being served from memory while the packager rewrites it
+                channel.in_progress.add(name)
+                if name == internal_settings.MPD_FILENAME:
+                    continue
+            else:
+                channel.in_progress.discard(name)
+
+                for connection in list(channel.readers.pop(name, ())):
+                    connection.growing_closed = True
+                    self._process(connection)
+
+            channel.invalidate(name)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _address = self._listener.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.ECONNABORTED):
+                    return
+                raise
+
+            sock.setblocking(False)
+            _cloexec(sock.fileno())
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections[sock.fileno()] = Connection(sock)
+            self._epoll.register(sock.fileno(), select.EPOLLIN)
+
+    def _close_connection(self, connection):
+        fd = connection.sock.fileno()
+        self._connections.pop(fd, None)
+
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, ValueError):
+            pass
+
+        if connection.file != None:
+            os.close(connection.file[0])
+            connection.file = None
+
+        if connection.growing != None:
+            self._end_growing(connection)
+
+        connection.sock.close()
+
+    def _handle_connection(self, connection, event):
+        if event & (select.EPOLLERR | select.EPOLLHUP):
+            self._close_connection(connection)
+            return
+
+        if event & select.EPOLLIN:
+            try:
+                data = connection.sock.recv(65536)
+            except socket.error as e:
+                if e.errno != errno.EAGAIN:
+                    self._close_connection(connection)
+                return
+
+            if not data:
+                self._close_connection(connection)
+                return
+
+            connection.received += data
+            if len(connection.received) > internal_settings.ORIGIN_MAX_REQUEST_SIZE:
+                self._close_connection(connection)
+                return
+
+        self._process(connection)
+
+    def _process(self, connection):
+        # responses are sent one at a time, pipelined requests wait in connection.received
+        while True:
+            if connection.output or connection.file != None:
+                if not self._send(connection):
+                    return
+                continue
+
+            if connection.growing != None:
+                if not self._read_growing(connection):
+                    # until the packager writes more
+                    self._epoll.modify(connection.sock.fileno(), select.EPOLLIN)
+                    return
+                continue
+
+            if not connection.keep_alive:
+                self._close_connection(connection)
+                return
+
+            end = connection.received.find('\r\n\r\n')
+            if end < 0:
+                self._epoll.modify(connection.sock.fileno(), select.EPOLLIN)
+                return
+
+            request, connection.received = connection.received[:end], connection.received[end + 4:]
+            self._respond(connection, request)
+
+    def _send(self, connection):
+        """Sends as much as possible, returns True once the whole response is out."""
+        try:
+            if connection.output:
+                sent = connection.sock.send(connection.output)
+                connection.output = connection.output[sent:]
+                if connection.output:
+                    return self._wait_writable(connection)
+
+            while connection.file != None:
+                fd, offset, remaining = connection.file
+                sent = sendfile(connection.sock.fileno(), fd, offset, min(remaining, internal_settings.ORIGIN_SENDFILE_CHUNK))
+
+                if sent == 0:
+                    # file got truncated under us, the response cannot be completed
+                    self._close_connection(connection)
+                    return False
+
+                if sent == remaining:
+                    os.close(fd)
+                    connection.file = None
+                else:
+                    connection.file = (fd, offset + sent, remaining - sent)
+        except (socket.error, OSError) as e:
+            if e.errno == errno.EAGAIN:
+                return self._wait_writable(connection)
+
+            self._close_connection(connection)
+            return False
+
+        return True
+
+    def _read_growing(self, connection):
+        """Queues the next chunk of a file being written, returns False if there is none yet."""
+        fd, _channel, _name = connection.growing
+        data = os.read(fd, internal_settings.ORIGIN_SENDFILE_CHUNK)
+        if data:
+            connection.output += '%x\r\n%s\r\n' % (len(data), data)
+            return True
+
+        if not connection.growing_closed:
+            return False
+
+        connection.output += '0\r\n\r\n'
+        self._end_growing(connection)
+        return True
+
+    def _end_growing(self, connection):
+        fd, channel, name = connection.growing
+        os.close(fd)
+        connection.growing = None
+
+        readers = channel.readers.get(name)
+        if readers != None:
+            readers.discard(connection)
+            if not readers:
+                del channel.readers[name]
+
+    def _stream_growing(self, connection, channel, name, content_type, head):
+        try:
+            fd = _cloexec(os.open(os.path.join(channel.output_path, name), os.O_RDONLY))
+        except OSError:
+            self._reply(connection, 404)
+            return
+
+        self._reply(connection, 200, content_type=content_type, cache_control=internal_settings.ORIGIN_CACHE_CONTROL_SEGMENT,
+            chunked=True)
+
+        if head:
+            os.close(fd)
+            return
+
+        connection.growing = (fd, channel, name)
+        connection.growing_closed = False
+        channel.readers.setdefault(name, set()).add(connection)
+
+    def _wait_writable(self, connection):
+        self._epoll.modify(connection.sock.fileno(), select.EPOLLOUT)
+        return False
+
+    def _respond(self, connection, request):
+        lines = request.split('\r\n')
+        parts = lines[0].split()
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if len(parts) != 3:
+            connection.keep_alive = False
+            self._reply(connection, 400)
+            return
+
+        method, path, version = parts
+        connection.keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close') \
+            or headers.get('connection', '').lower() == 'keep-alive'
+
+        if method not in ('GET', 'HEAD'):
+            self._reply(connection, 405)
+            return
+
+        head = method == 'HEAD'
+
+        path = path.split('?', 1)[0]
+        if path == '/metrics' and self._metrics != None:
+            body = self._metrics()
+            self._reply(connection, 200, '' if head else body, len(body), 'text/plain; version=0.0.4', cache_control='no-cache')
+            return
+
+        prefix, _, name = path.lstrip('/').rpartition('/')
+        channel = self._channels.get(prefix)
+
+        if channel == None or not name or name.startswith('.') or name.endswith('.tmp'):
+            self._reply(connection, 404)
+            return
+
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+
+        if name == internal_settings.MPD_FILENAME:
+            mpd = channel.mpd
+            if mpd == None and name not in channel.in_progress:
+                mpd = self._get_mpd(channel)
+
+            if mpd == None:
+                self._reply(connection, 404)
+                return
+
+            body, etag = mpd
+            if headers.get('if-none-match') == etag:
+                self._reply(connection, 304, etag=etag, cache_control=internal_settings.ORIGIN_CACHE_CONTROL_LIVE)
+                return
+
+            self._reply(connection, 200, '' if head else body, len(body), content_type, etag, internal_settings.ORIGIN_CACHE_CONTROL_LIVE)
+            return
+
+        cached = None
+        if name not in channel.in_progress:
+            cached = self._get_file(channel, name)
+        elif channel.low_latency and version == 'HTTP/1.1':
+            self._stream_growing(connection, channel, name, content_type, head)
+            return
+
+        if cached == None:
+            self._reply(connection, 404)
+            return
+
+        fd, size, etag = cached
+        # init segments, thumbnail and storyboards are rewritten in place, media segments with the next packager start
+        live = name in (internal_settings.THUMBNAIL_FILENAME, internal_settings.TRICKPLAY_VTT_FILENAME) \
+            or name.startswith(internal_settings.TRICKPLAY_SHEET_NAME.partition('%')[0]) \
+            or name.endswith(INIT_SEGMENT_SUFFIXES)
+        cache_control = internal_settings.ORIGIN_CACHE_CONTROL_LIVE if live else internal_settings.ORIGIN_CACHE_CONTROL_SEGMENT
+
+        if headers.get('if-none-match') == etag:
+            self._reply(connection, 304, etag=etag, cache_control=cache_control)
+            return
+
+        self._reply(connection, 200, '', size, content_type, etag, cache_control)
+
+        if not head and size > 0:
+            connection.file = (_cloexec(os.dup(fd)), 0, size)
+
+    def _reply(self, connection, status, body='', length=None, content_type=None, etag=None, cache_control=None, chunked=False):
+        headers = []
+        if content_type != None:
+            headers.append('Content-Type: %s\r\n' % content_type)
+        if etag != None:
+            headers.append('ETag: %s\r\n' % etag)
+        if cache_control != None:
+            headers.append('Cache-Control: %s\r\n' % cache_control)
+        if not connection.keep_alive:
+            headers.append('Connection: close\r\n')
+
+        if chunked:
+            framing = CHUNKED_HEADER
+        else:
+            framing = CONTENT_LENGTH_HEADER % (length if length != None else len(body))
+
+        connection.output += RESPONSE_TEMPLATE % (STATUS_TEXT[status], framing, ''.join(headers)) + body
+
+    def _get_mpd(self, channel):
+        if channel.mpd == None:
+            try:
+                with open(os.path.join(channel.output_path, internal_settings.MPD_FILENAME), 'rb') as f:
+                    body = f.read()
+                    info = os.fstat(f.fileno())
+            except IOError:
+                return None
+
+            channel.mpd = (body, make_etag(info))
+
+        return channel.mpd
+
+    def _get_file(self, channel, name):
+        cached = channel.files.get(name)
+        if cached != None:
+            return cached
+
+        try:
+            fd = _cloexec(os.open(os.path.join(channel.output_path, name), os.O_RDONLY))
+        except OSError:
+            return None
+
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode):
+            os.close(fd)
+            return None
+
+        if len(channel.files) >= internal_settings.ORIGIN_FILE_CACHE_SIZE:
+            channel.invalidate(next(iter(channel.files)))
+
+        cached = channel.files[name] = (fd, info.st_size, make_etag(info))
+
+        return cached
+
+def make_etag(info):
+    return '"%x-%x-%x"' % (info.st_ino, info.st_size, int(info.st_mtime * 1000000))
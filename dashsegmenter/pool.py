@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# warm standby channels: encoders and packager spawned before there is a source to attach
+
+import copy
+import os
+import shutil
+import tempfile
+
+import internal_settings
+import streams
+
+class PoolExhausted(Exception):
+    pass
+
+class OutputPathExists(Exception):
+    pass
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+class Slot(object):
+    def __init__(self, index, input_path, output_path, controller):
+        super(Slot, self).__init__()
+        self.index = index # port block, base_port + index * PORT_INCREMENT (unless settings have a port_allocator)
+        self.input_path = input_path # fifo the encoders read
+        self.output_path = output_path
+        self.controller = controller
+        self.link_path = None # output_path of the channel once attached, a symlink to output_path
+
+class WarmPool(object):
+    """Keeps size channels of one ladder running with an idle input fifo.
+
+    Encoders and the packager of a slot are already up (processes exec'd, packager listening),
+    the encoders wait on their input fifo. attach() links the slot output directory to the
+    channel's output_path, starts a feeder remuxing the source into the fifo and spawns a new
+    slot in its place. With measure_latency compare stats()['channel'] of warm and cold channels
+    (start_to_first_segment, start_to_first_mpd, see latency.StartupLatency).
+
+    Slots are run by supervisor, attached channels stay there as ordinary channels.
+    """
+    def __init__(self, supervisor, settings, streams, size, directory=None):
+        super(WarmPool, self).__init__()
+        self.supervisor = supervisor
+        self.settings = settings # template, input_stream, output_path and base_port are set per slot
+        self.streams = streams
+        self.size = size
+
+        self._directory = directory if directory != None else tempfile.mkdtemp(prefix='dashsegmenter-pool-')
+        self._serial = 0
+        self._slots = []
+        self._stopped = [] # idle slots which have died, their port blocks are taken until their children are reaped
+        self._attached = [] # slots handed out, their port blocks are taken while the channel runs
+        self._exited = [] # attached slots whose channel has exited, their output is removed by stop()
+        self._own_directory = directory == None
+
+    @property
+    def idle(self):
+        return [slot for slot in self._slots if slot.controller.running]
+
+    def _collect_attached(self):
+        """Forgets attached channels which have exited, their output stays until stop()."""
+        attached = []
+        for slot in self._attached:
+            if slot.controller.running or slot.controller.pids:
+                attached.append(slot)
+            else:
+                _remove(slot.input_path)
+                self._exited.append(slot)
+
+        self._attached = attached
+
+    def _collect_stopped(self):
+        """Removes files of died idle slots whose children have been reaped."""
+        stopped = []
+        for slot in self._stopped:
+            if slot.controller.pids:
+                stopped.append(slot)
+            else:
+                _remove(slot.input_path)
+                _remove(slot.output_path)
+
+        self._stopped = stopped
+
+    def _free_index(self):
+        self._collect_attached()
+        self._collect_stopped()
+
+        taken = set(slot.index for slot in self._slots + self._stopped + self._attached)
+
+        index = 0
+        while index in taken:
+            index += 1
+
+        return index
+
+    def _spawn_slot(self):
+        index = self._free_index()
+
+        # port blocks are reused, directories are not: output of an exited channel stays where its symlink points
+        self._serial += 1
+        input_path = os.path.join(self._directory, internal_settings.POOL_INPUT_NAME % self._serial)
+        output_path = os.path.join(self._directory, internal_settings.POOL_OUTPUT_NAME % self._serial)
+
+        os.mkfifo(input_path, 0600)
+        os.mkdir(output_path)
+
+        settings = copy.copy(self.settings)
+        settings.base_port = self.settings.base_port + index * internal_settings.PORT_INCREMENT
+        settings.input_stream = input_path
+        settings.output_path = output_path
+        if settings.thumbnail_stream != None:
+            settings.thumbnail_stream = copy.copy(settings.thumbnail_stream)
+
+        controller = streams.StreamsController(settings)
+        for stream in self.streams:
+            controller.add_stream(copy.copy(stream))
+
+        slot = Slot(index, input_path, output_path, controller)
+        self._slots.append(slot)
+
+        # supervised first, children of a failed start still have to be reaped
+        self.supervisor.add_controller(controller)
+        controller.start()
+
+        return slot
+
+    def fill(self):
+        """Spawns slots until size of them are idle, died slots are replaced.
+
+        Port blocks of died slots are not reused before the supervisor has reaped their children.
+        """
+        self._stopped.extend(slot for slot in self._slots if not slot.controller.running)
+        self._slots = self.idle
+
+        while len(self._slots) < self.size:
+            self._spawn_slot()
+
+    def attach(self, source, output_path):
+        """Hands a warm slot over to source, returns its StreamsController.
+
+        output_path becomes a symlink to the slot output directory and the channel's output_path (so
+        its name in supervisor stats and logs), it must not exist or be an empty directory
+        (OutputPathExists otherwise). Raises PoolExhausted if no slot is idle (start a cold
+        channel then). If the feeder cannot be started output_path is restored and the slot, stopped
+        by then, is replaced by the next fill().
+        """
+        replaced_directory = os.path.isdir(output_path) and not os.path.islink(output_path)
+        if replaced_directory:
+            if os.listdir(output_path):
+                raise OutputPathExists('%s is not empty' % output_path)
+        elif os.path.lexists(output_path):
+            raise OutputPathExists('%s exists' % output_path)
+
+        idle = self.idle
+        if not idle:
+            raise PoolExhausted()
+
+        slot = idle[0]
+
+        if replaced_directory:
+            os.rmdir(output_path)
+        os.symlink(slot.output_path, output_path)
+
+        # children started from now on (restarts) run in output_path, it resolves to the same directory
+        slot.controller.settings.output_path = output_path
+
+        try:
+            slot.controller.attach_input(source)
+        except Exception:
+            slot.controller.settings.output_path = slot.output_path
+            os.unlink(output_path)
+            if replaced_directory:
+                os.mkdir(output_path)
+            raise
+
+        slot.link_path = output_path
+        self._slots.remove(slot)
+        self._attached.append(slot)
+
+        try:
+            self.fill()
+        except streams.ProcessStartFailed as e:
+            print 'Cannot replenish warm pool: %s' % e
+
+        return slot.controller
+
+    def stop(self):
+        """Stops idle slots, attached channels keep running.
+
+        Files of idle slots and of attached channels which have exited (fifo, output directory and
+        the symlink to it) are removed, the pool directory too once it is empty. Call stop() again
+        after the remaining attached channels have exited to remove theirs.
+        """
+        for slot in self._slots:
+            slot.controller.stop()
+
+            for path in (slot.input_path, slot.output_path):
+                _remove(path)
+
+        self._slots = []
+
+        for slot in self._stopped:
+            for path in (slot.input_path, slot.output_path):
+                _remove(path)
+
+        self._stopped = []
+
+        self._collect_attached()
+        for slot in self._exited:
+            if os.path.islink(slot.link_path) and os.readlink(slot.link_path) == slot.output_path:
+                os.unlink(slot.link_path)
+            _remove(slot.output_path)
+
+        self._exited = []
+
+        if self._own_directory and not self._attached:
+            try:
+                os.rmdir(self._directory)
+            except OSError: # files not created by the pool
+                pass
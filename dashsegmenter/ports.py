@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# host-wide UDP port ranges of channels, shared by all dashsegmenter processes through a registry file
+
+import errno
+import fcntl
+import os
+import socket
+import stat
+
+import internal_settings
+
+class PortsExhausted(Exception):
+    pass
+
+class RegistryNotPrivate(Exception):
+    pass
+
+class Reservation(object):
+    def __init__(self, base_port, count, pid, channel):
+        super(Reservation, self).__init__()
+        self.base_port = base_port
+        self.count = count
+        self.pid = pid
+        self.channel = channel
+
+    def __str__(self):
+        return '%d %d %d %s\n' % (self.base_port, self.count, self.pid, self.channel)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+def _runtime_directory():
+    """Returns the private directory of this user, created if needed."""
+    path = internal_settings.RUNTIME_DIRECTORY
+    if path == None:
+        if os.environ.get('XDG_RUNTIME_DIR'):
+            path = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'dashsegmenter')
+        else:
+            path = '/tmp/dashsegmenter-%d' % os.getuid()
+
+    try:
+        os.mkdir(path, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # in /tmp anyone may have created it first
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 077:
+        raise RegistryNotPrivate('%s is not a directory only this user can access' % path)
+
+    return path
+
+def _open(path, flags):
+    # no symlinks planted in place of the registry, no one else may read or write it
+    fd = os.open(path, flags | os.O_NOFOLLOW, 0600)
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+    return os.fdopen(fd, 'r+' if flags & os.O_RDWR else 'r')
+
+def _bindable(first, count):
+    """True if nobody listens on any of the ports (what the packager and thumbnailers will bind)."""
+    sockets = []
+    try:
+        for port in xrange(first, first + count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sockets.append(sock)
+            sock.bind(('127.0.0.1', port))
+    except socket.error:
+        return False
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    return True
+
+class PortAllocator(object):
+    """Hands out port ranges to channels so no two channels on the host overlap.
+
+    The range first..last is split into blocks of PORT_INCREMENT ports, a channel gets as many
+    consecutive blocks as it needs. Reservations live in a registry file, read and rewritten under
+    an exclusive flock, so channels in different processes never get the same block. A block is
+    only handed out if all its ports can be bound; blocks of processes which are gone are reclaimed.
+    The registry is private to the user (0600, in a 0700 directory by default), channels of other
+    users are only kept off by the bind check.
+
+    owner(port) maps a port to its channel in O(1) (block index -> reservation).
+    """
+    def __init__(self, registry=None, first=None, last=None, block=None):
+        super(PortAllocator, self).__init__()
+        self._registry = registry if registry != None else internal_settings.PORT_REGISTRY
+        self.first = first if first != None else internal_settings.STARTING_PORT_NUMBER
+        self.last = last if last != None else internal_settings.PORT_RANGE_END
+        self.block = block if block != None else internal_settings.PORT_INCREMENT
+
+        self._owners = {} # block index -> Reservation
+        self._loaded = None # (mtime, size) of the registry _owners was read from
+
+    @property
+    def registry(self):
+        if self._registry == None:
+            self._registry = os.path.join(_runtime_directory(), 'ports')
+
+        return self._registry
+
+    def _read(self, f):
+        f.seek(0)
+
+        reservations = []
+        for line in f:
+            fields = line.rstrip('\n').split(' ', 3)
+            if len(fields) != 4:
+                continue
+
+            try:
+                base_port, count, pid = [int(field) for field in fields[:3]]
+            except ValueError:
+                continue
+
+            reservations.append(Reservation(base_port, count, pid, fields[3]))
+
+        return reservations
+
+    def _index(self, reservations):
+        owners = {}
+        for reservation in reservations:
+            first = (reservation.base_port - self.first) // self.block
+            last = (reservation.base_port + reservation.count - 1 - self.first) // self.block
+            for index in xrange(first, last + 1):
+                owners[index] = reservation
+
+        return owners
+
+    def _update(self, transaction):
+        # read-modify-write of the registry, other processes wait on the lock meanwhile
+        with _open(self.registry, os.O_RDWR | os.O_CREAT) as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                reservations = [reservation for reservation in self._read(f) if _alive(reservation.pid)]
+                result = transaction(reservations)
+
+                f.seek(0)
+                f.truncate()
+                f.write(''.join(str(reservation) for reservation in reservations))
+                f.flush()
+
+                self._owners = self._index(reservations)
+                info = os.fstat(f.fileno())
+                self._loaded = (info.st_mtime, info.st_size)
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+        return result
+
+    def reserve(self, channel, count):
+        """Returns base_port of count free ports reserved for channel (by this process)."""
+        blocks = (count + self.block - 1) // self.block
+
+        def transaction(reservations):
+            owners = self._index(reservations)
+
+            index = 0
+            while self.first + (index + blocks) * self.block - 1 <= self.last:
+                if any(owners.get(candidate) for candidate in xrange(index, index + blocks)):
+                    index += 1
+                    continue
+
+                base_port = self.first + index * self.block
+                if not _bindable(base_port, count):
+                    index += 1
+                    continue
+
+                reservations.append(Reservation(base_port, count, os.getpid(), channel))
+                return base_port
+
+            raise PortsExhausted('no %d free ports between %d and %d' % (count, self.first, self.last))
+
+        return self._update(transaction)
+
+    def release(self, base_port):
+        def transaction(reservations):
+            reservations[:] = [reservation for reservation in reservations
+                if not (reservation.base_port == base_port and reservation.pid == os.getpid())]
+
+        self._update(transaction)
+
+    def owner(self, port):
+        """Returns the channel holding port, None if it is not reserved."""
+        try:
+            info = os.stat(self.registry)
+        except OSError:
+            return None
+
+        if self._loaded != (info.st_mtime, info.st_size):
+            with _open(self.registry, os.O_RDONLY) as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                try:
+                    self._owners = self._index(self._read(f))
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            self._loaded = (info.st_mtime, info.st_size)
+
+        if port < self.first:
+            return None
+
+        reservation = self._owners.get((port - self.first) // self.block)
+        if reservation == None or not reservation.base_port <= port < reservation.base_port + reservation.count:
+            return None
+
+        if not _alive(reservation.pid):
+            return None
+
+        return reservation.channel
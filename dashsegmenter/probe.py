@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# source probing (ffprobe) and ladder pruning against what the source really has
+
+from subprocess import Popen, PIPE
+import copy
+import os
+
+import internal_settings
+import command_templates
+
+class ProbeFailed(Exception):
+    pass
+
+class SourceInfo(object):
+    def __init__(self, width=None, height=None, frame_rate=None, bitrate=None):
+        super(SourceInfo, self).__init__()
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.bitrate = bitrate # bits per second of the video stream (or whole input if unknown)
+
+    def __repr__(self):
+        return '<SourceInfo %sx%s@%s %s bps>' % (self.width, self.height, self.frame_rate, self.bitrate)
+
+def _rate(value):
+    # ffprobe rates look like '25/1' or '30000/1001'
+    try:
+        numerator, _, denominator = value.partition('/')
+        numerator, denominator = float(numerator), float(denominator or 1)
+    except (AttributeError, ValueError):
+        return None
+
+    if numerator <= 0 or denominator <= 0:
+        return None
+
+    rate = numerator / denominator
+    return int(rate) if rate == int(rate) else rate
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_probe(output):
+    import json # probing is optional, keep it out of import time
+    data = json.loads(output)
+    streams = data.get('streams') or []
+    if not streams:
+        raise ProbeFailed('no video stream')
+
+    stream = streams[0]
+    bitrate = _int(stream.get('bit_rate')) or _int((data.get('format') or {}).get('bit_rate'))
+
+    return SourceInfo(_int(stream.get('width')), _int(stream.get('height')),
+        _rate(stream.get('avg_frame_rate')) or _rate(stream.get('r_frame_rate')), bitrate)
+
+_cache = {}
+
+def _cache_key(input_stream):
+    # results are cached per URL (and mtime for local files)
+    try:
+        return (input_stream, os.stat(input_stream).st_mtime)
+    except OSError:
+        return (input_stream, None)
+
+def cached(input_stream):
+    """Returns SourceInfo of input_stream if it has been probed already, None otherwise."""
+    return _cache.get(_cache_key(input_stream))
+
+def probe_commandline(input_stream):
+    return command_templates.FFPROBE_TEMPLATE_SOURCE.compiled.eval({
+        'INPUT_STREAM': input_stream,
+        'TIMEOUT': internal_settings.PROBE_TIMEOUT * 1000000,
+    })
+
+def probe_result(input_stream, returncode, output, error=''):
+    """Returns SourceInfo from output of ffprobe started with probe_commandline() and caches it."""
+    if returncode != 0:
+        message = 'ffprobe exited with %s' % returncode
+        if error.strip():
+            message += ': %s' % error.strip()
+
+        raise ProbeFailed(message)
+
+    try:
+        info = parse_probe(output)
+    except ValueError as e:
+        raise ProbeFailed('Cannot parse ffprobe output: %s' % e)
+
+    if len(_cache) >= internal_settings.PROBE_CACHE_SIZE:
+        _cache.clear()
+    _cache[_cache_key(input_stream)] = info
+
+    return info
+
+def probe_source(input_stream):
+    """Returns SourceInfo of input_stream, blocks until ffprobe is done (see StreamsController for the async way)."""
+    info = cached(input_stream)
+    if info != None:
+        return info
+
+    try:
+        process = Popen(probe_commandline(input_stream), stdout=PIPE, stderr=PIPE, close_fds=True)
+    except OSError as e:
+        raise ProbeFailed('Cannot start ffprobe: %s' % e)
+
+    output, error = process.communicate()
+
+    return probe_result(input_stream, process.returncode, output, error)
+
+def prune_ladder(streams, source, keep=None):
+    """Drops or clamps video streams exceeding the source.
+
+    Rungs bigger than the source are dropped (keep - e.g. the thumbnail stream - and the
+    smallest rung are clamped to source dimensions instead, so some video is always left),
+    frame rate and bitrate above the source are clamped. Streams are copied, never modified.
+    Returns (set of streams, [(stream name, action, detail)]).
+    """
+    video = sorted((stream for stream in streams if getattr(stream, 'width', None) != None), key=lambda stream: stream.width * stream.height)
+    smallest = video[0] if video else None
+
+    kept = set()
+    report = []
+
+    for stream in streams:
+        if getattr(stream, 'width', None) == None:
+            kept.add(stream)
+            continue
+
+        pruned = copy.copy(stream)
+
+        if source.width != None and source.height != None and (stream.width > source.width or stream.height > source.height):
+            if not (keep != None and stream == keep) and stream is not smallest:
+                report.append((stream.name, 'dropped', '%sx%s exceeds source %sx%s' % (stream.width, stream.height, source.width, source.height)))
+                continue
+
+            scale = min(float(source.width) / stream.width, float(source.height) / stream.height)
+            pruned.width, pruned.height = int(stream.width * scale) // 2 * 2, int(stream.height * scale) // 2 * 2
+            report.append((stream.name, 'clamped', 'dimensions %sx%s -> %sx%s' % (stream.width, stream.height, pruned.width, pruned.height)))
+
+        if source.frame_rate != None and stream.frame_rate > source.frame_rate:
+            pruned.frame_rate = source.frame_rate
+            report.append((stream.name, 'clamped', 'frame rate %s -> %s' % (stream.frame_rate, source.frame_rate)))
+
+        if source.bitrate != None and stream.bitrate > source.bitrate:
+            pruned.bitrate = source.bitrate
+            report.append((stream.name, 'clamped', 'bitrate %s -> %s' % (stream.bitrate, source.bitrate)))
+
+        kept.add(pruned)
+
+    return kept, report
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# publishing of segments staged in RAM (tmpfs) to durable storage
+
+from time import time
+import Queue
+import base64
+import collections
+import email.utils
+import errno
+import fcntl
+import hashlib
+import hmac
+import httplib
+import os
+import shutil
+import threading
+import urllib
+import urlparse
+
+import internal_settings
+import inotify
+from origin import CONTENT_TYPES
+
+class PublishFailed(Exception):
+    pass
+
+class DirectoryTarget(object):
+    """Copies files into a local (or mounted network) directory, renamed into place when complete."""
+    def __init__(self, path):
+        super(DirectoryTarget, self).__init__()
+        self.path = path
+
+    def put(self, name, source):
+        destination = os.path.join(self.path, name)
+        try:
+            shutil.copyfile(source, destination + '.tmp')
+            os.rename(destination + '.tmp', destination)
+        except (IOError, OSError) as e:
+            raise PublishFailed(str(e))
+
+class S3Target(object):
+    """PUTs files to an S3 compatible endpoint (bucket in the path, AWS signature version 2)."""
+    def __init__(self, endpoint, bucket, prefix='', access_key=None, secret_key=None):
+        super(S3Target, self).__init__()
+        url = urlparse.urlparse(endpoint)
+        self.https = url.scheme == 'https'
+        self.host = url.netloc
+        self.bucket = bucket
+        self.prefix = prefix
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    def _connection(self):
+        connection_class = httplib.HTTPSConnection if self.https else httplib.HTTPConnection
+        return connection_class(self.host, timeout=internal_settings.PUBLISH_TIMEOUT)
+
+    def put(self, name, source):
+        path = '/%s/%s' % (self.bucket, urllib.quote(self.prefix + name))
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+        date = email.utils.formatdate(usegmt=True)
+
+        headers = {'Content-Type': content_type, 'Date': date}
+        if self.access_key != None:
+            signed = 'PUT\n\n%s\n%s\n%s' % (content_type, date, path)
+            signature = base64.b64encode(hmac.new(self.secret_key, signed, hashlib.sha1).digest())
+            headers['Authorization'] = 'AWS %s:%s' % (self.access_key, signature)
+
+        connection = self._connection()
+        try:
+            with open(source, 'rb') as f:
+                headers['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+                connection.request('PUT', path, f, headers)
+            response = connection.getresponse()
+            response.read()
+        except (IOError, OSError, httplib.HTTPException) as e:
+            raise PublishFailed(str(e))
+        finally:
+            connection.close()
+
+        if response.status // 100 != 2:
+            raise PublishFailed('%s %s' % (response.status, response.reason))
+
+class SegmentPublisher(object):
+    """Copies files the packager finished in staging_path to a target with a pool of threads.
+
+    Segments are published in parallel in the order they were finished and removed from
+    staging once they landed, so tmpfs use stays at the publishing backlog. A file which
+    cannot be published stays staged and is retried with backoff (PUBLISH_RETRY_DELAY up to
+    PUBLISH_RETRY_MAX_DELAY) until it lands or the packager removes it. The MPD is published
+    only once every segment finished before it has landed, so players never see a segment
+    which is not there yet; only its latest version is kept waiting.
+
+    It is a controller service; worker threads report back through a pipe, all bookkeeping
+    happens in the supervisor thread.
+    """
+    def __init__(self, staging_path, target, threads=None):
+        super(SegmentPublisher, self).__init__()
+        self.staging_path = staging_path
+        self.target = target
+        self.threads = threads if threads != None else internal_settings.PUBLISH_THREADS
+
+        self.published = 0
+        self.failed = 0
+        self._latencies = collections.deque(maxlen=internal_settings.PUBLISH_LATENCY_SAMPLES)
+
+        self._sequence = 0
+        self._in_flight = {} # sequence -> (name, finished at)
+        self._mpd = None # (sequence, staged copy) waiting for its segments
+        self._retries = {} # sequence -> (retry at, delay, name, source) of files which failed to publish
+
+        self._jobs = Queue.Queue()
+        self._workers = []
+        self._done_read = self._done_write = None
+        self._done = collections.deque() # (sequence, name, source, error), appended by workers
+        self._done_lock = threading.Lock() # workers must not write to the pipe once stop() closed it
+        self._stopped = False
+        self._inotify = None
+        self._mpd_copies = os.path.join(staging_path, internal_settings.PUBLISH_MPD_COPIES) # not watched, inotify is not recursive
+
+    def start(self):
+        if not os.path.isdir(self._mpd_copies):
+            os.mkdir(self._mpd_copies)
+
+        self._stopped = False
+        self._done_read, self._done_write = os.pipe()
+        for fd in (self._done_read, self._done_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+        for _ in xrange(self.threads):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._inotify = inotify.Inotify()
+        self._inotify.add_watch(self.staging_path, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+
+        # whatever the packager has finished before the watch existed
+        staged = []
+        for name in os.listdir(self.staging_path):
+            path = os.path.join(self.staging_path, name)
+            if os.path.isfile(path) and not name.endswith('.tmp') and not name.startswith('.'):
+                staged.append((os.stat(path).st_mtime, name))
+
+        for _mtime, name in sorted(staged):
+            self._staged(name, time())
+
+    def stop(self):
+        """Publishes files already queued (for at most PUBLISH_DRAIN_TIMEOUT), staging can be removed afterwards."""
+        for _ in self._workers:
+            self._jobs.put(None)
+
+        deadline = time() + internal_settings.PUBLISH_DRAIN_TIMEOUT
+        for worker in self._workers:
+            worker.join(max(0, deadline - time()))
+        self._workers = []
+        self._retries = {}
+
+        if self._inotify != None:
+            self._inotify.close()
+            self._inotify = None
+
+        # workers still busy finish their file and exit
+        with self._done_lock:
+            self._stopped = True
+            for fd in (self._done_read, self._done_write):
+                if fd != None:
+                    os.close(fd)
+            self._done_read = self._done_write = None
+
+    @property
+    def fds(self):
+        fds = []
+        if self._inotify != None:
+            fds.append(self._inotify.fileno())
+        if self._done_read != None:
+            fds.append(self._done_read)
+
+        return fds
+
+    def next_deadline(self):
+        deadlines = [retry_at for retry_at, _delay, _name, _source in self._retries.itervalues() if retry_at != None]
+
+        return min(deadlines) if deadlines else None
+
+    def tick(self, now):
+        for sequence, (retry_at, delay, name, source) in self._retries.items():
+            if retry_at != None and now >= retry_at:
+                # queued again, the delay is kept for the next failure
+                self._retries[sequence] = (None, delay, name, source)
+                self._jobs.put((sequence, name, source))
+
+    def handle_readable(self, fd):
+        if fd == self._done_read:
+            self._collect()
+            return
+
+        for _wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                print 'Publisher of %s missed files (inotify queue overflow)' % self.staging_path
+                continue
+
+            # temporary files of the packager
+            if not name.endswith('.tmp') and not name.startswith('.'):
+                self._staged(name, time())
+
+    def _staged(self, name, now):
+        self._sequence += 1
+
+        if name != internal_settings.MPD_FILENAME:
+            self._in_flight[self._sequence] = (name, now)
+            self._jobs.put((self._sequence, name, os.path.join(self.staging_path, name)))
+            return
+
+        # the packager rewrites the MPD all the time, the waiting version is a copy of it
+        copy = os.path.join(self._mpd_copies, '%s.%d' % (name, self._sequence))
+        try:
+            shutil.copyfile(os.path.join(self.staging_path, name), copy)
+        except (IOError, OSError) as e:
+            print 'Cannot stage %s: %s' % (name, e)
+            return
+
+        if self._mpd != None:
+            os.unlink(self._mpd[1])
+        self._mpd = (self._sequence, copy, now)
+
+        self._publish_mpd()
+
+    def _publish_mpd(self):
+        if self._mpd == None:
+            return
+
+        sequence, copy, now = self._mpd
+        if any(pending < sequence for pending in self._in_flight):
+            return
+
+        self._mpd = None
+        self._in_flight[sequence] = (internal_settings.MPD_FILENAME, now)
+        self._jobs.put((sequence, internal_settings.MPD_FILENAME, copy))
+
+    def _collect(self):
+        try:
+            while os.read(self._done_read, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        now = time()
+        while self._done:
+            sequence, name, source, error = self._done.popleft()
+
+            if error != None:
+                self.failed += 1
+                if self._retry(sequence, name, source, error, now):
+                    continue
+            else:
+                self.published += 1
+                self._latencies.append(now - self._in_flight[sequence][1])
+
+            self._in_flight.pop(sequence)
+            self._retries.pop(sequence, None)
+
+            # the packager does not need what it has written anymore, RAM holds only the backlog
+            try:
+                os.unlink(source)
+            except OSError:
+                pass
+
+        self._publish_mpd()
+
+    def _retry(self, sequence, name, source, error, now):
+        """Schedules another attempt of a file which failed, returns False if there is nothing to publish anymore."""
+        # the packager removes segments which fell out of its window, nothing references them
+        if not os.path.exists(source):
+            print 'Cannot publish %s, removed before it landed: %s' % (name, error)
+            return False
+
+        previous = self._retries.get(sequence)
+        delay = internal_settings.PUBLISH_RETRY_DELAY if previous == None else \
+            min(previous[1] * 2, internal_settings.PUBLISH_RETRY_MAX_DELAY)
+        self._retries[sequence] = (now + delay, delay, name, source)
+
+        print 'Cannot publish %s, retrying in %.1fs: %s' % (name, delay, error)
+        return True
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job == None:
+                return
+
+            sequence, name, source = job
+            error = None
+
+            try:
+                self.target.put(name, source)
+            except PublishFailed as e:
+                error = e
+
+            with self._done_lock:
+                if self._stopped:
+                    return
+
+                self._done.append((sequence, name, source, error))
+
+                try:
+                    os.write(self._done_write, 'x')
+                except OSError as e:
+                    if e.errno != errno.EAGAIN: # full pipe wakes the supervisor up anyway
+                        raise
+
+    @property
+    def stats(self):
+        stats = {
+            'publish_queue_depth': len(self._in_flight) + (1 if self._mpd != None else 0),
+            'published': self.published,
+            'publish_failures': self.failed,
+        }
+
+        if self._latencies:
+            stats['flush_latency'] = sorted(self._latencies)[len(self._latencies) // 2]
+
+        return stats
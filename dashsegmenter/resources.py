@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# cpu, memory, context switches and writes of channel children, sampled from /proc
+
+from time import time
+import errno
+import os
+
+import internal_settings
+
+CLOCK_TICKS = None # os.sysconf('SC_CLK_TCK'), read on the first sample
+PAGE_SIZE = None
+
+def _read(path):
+    # one read() is enough for stat, status and io, and cheaper than a file object
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ESRCH):
+            return None
+        raise
+
+    try:
+        return os.read(fd, 8192)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return None
+        raise
+    finally:
+        os.close(fd)
+
+def _parse_stat(stat):
+    # comm can contain spaces and parentheses, fields after it are fixed
+    fields = stat[stat.rindex(')') + 2:].split(' ', 22)
+
+    return {
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, # utime + stime
+        'rss_bytes': int(fields[21]) * PAGE_SIZE,
+    }
+
+def _parse_details(values, status, io):
+    values['ctxt_switches'] = 0
+    for line in status[status.rfind('\nvoluntary_ctxt_switches'):].split('\n'):
+        key, _, value = line.partition(':')
+        if key.endswith('ctxt_switches'):
+            values['ctxt_switches'] += int(value)
+
+    # io is only readable for our own children, and not in every container
+    if io != None:
+        for line in io.split('\n'):
+            key, _, value = line.partition(': ')
+            if key == 'wchar':
+                values['bytes_written'] = int(value)
+            elif key == 'write_bytes':
+                values['disk_write_bytes'] = int(value)
+
+def _init_constants():
+    global CLOCK_TICKS, PAGE_SIZE
+    if CLOCK_TICKS == None:
+        CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+        PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def read_process(pid, details=True):
+    """Returns cumulative cpu_seconds and current rss_bytes of pid, with details also ctxt_switches,
+    bytes_written and disk_write_bytes; None if it is gone."""
+    _init_constants()
+
+    proc = '/proc/%d/' % pid
+    stat = _read(proc + 'stat')
+    if stat == None:
+        return None
+
+    values = _parse_stat(stat)
+
+    if details:
+        status = _read(proc + 'status')
+        if status == None:
+            return None
+
+        _parse_details(values, status, _read(proc + 'io'))
+
+    return values
+
+class ProcessSample(object):
+    def __init__(self, channel, role):
+        super(ProcessSample, self).__init__()
+        self.channel = channel
+        self.role = role
+        self.rss_bytes = 0
+        self.readings = {} # counter name -> (time, value) of the last reading
+        self.previous = {} # counter name -> (time, value) of the reading before
+
+    def update(self, now, values):
+        """Takes a reading of read_process()."""
+        self.rss_bytes = values.pop('rss_bytes')
+
+        for name, value in values.iteritems():
+            self.add(now, name, value)
+
+    def add(self, now, name, value):
+        reading = self.readings.get(name)
+        if reading != None:
+            self.previous[name] = reading
+        self.readings[name] = (now, value)
+
+    @property
+    def rates(self):
+        rates = {}
+        for name, (previous_time, previous_value) in self.previous.iteritems():
+            now, value = self.readings[name]
+            if now > previous_time:
+                rates[name] = (value - previous_value) / (now - previous_time)
+
+        return rates
+
+class ResourceSampler(object):
+    """Samples every child of the supervised channels once per interval (see supervisor.Supervisor).
+
+    Processes are attributed to (channel, role): the role is 'ffmpeg' or 'ffmpeg:<type>:<stream>'
+    with a scheduler (one encoder per stream), 'packager', 'thumbnail', 'trickplay' or 'feeder'.
+
+    snapshot() has rates (cpu_percent, ctxt_switches_per_second, bytes_written_per_second, ...)
+    and rss_bytes; counters() has totals (<counter>_total) which keep growing across restarts of a
+    role's process.
+
+    Sampling only stores readings, rates and totals are computed when asked for. Every process has
+    /proc/<pid>/stat (cpu, rss) read every RESOURCE_STAT_EVERY intervals and status and io (context
+    switches, writes, more expensive and changing slower) every RESOURCE_DETAILS_EVERY intervals,
+    spread over the intervals by pid; rates are per second of the time between two readings. A new
+    process is read right away. The last reading of an exited process comes from its rusage (see
+    process_exited()), so totals lose nothing of cpu and disk writes. ctxt_switches (status counts
+    the main thread only, rusage all of them) and bytes_written (not in rusage) stay at their last
+    reading.
+    """
+    def __init__(self, interval=None):
+        super(ResourceSampler, self).__init__()
+        self.interval = interval if interval != None else internal_settings.RESOURCE_SAMPLE_INTERVAL
+
+        self._next_sample = None
+        self._round = 0
+        self._processes = {} # pid -> ProcessSample
+        self._retired = {} # (channel, role) -> counter name -> last values of exited processes
+        self._names = {} # controller -> its name in the last sample
+
+    def next_deadline(self):
+        return self._next_sample
+
+    def tick(self, now, controllers):
+        if self._next_sample != None and now < self._next_sample:
+            return
+
+        self.sample(now, controllers)
+
+        # keep the cadence, skipping slots we have already missed
+        if self._next_sample == None:
+            self._next_sample = now
+        while self._next_sample <= now:
+            self._next_sample += self.interval
+
+    def process_exited(self, pid, usage, now):
+        """Takes the final reading of a reaped child from its resource.struct_rusage (os.wait4()), None if
+        it is not known, and moves it to the totals of its role."""
+        process = self._processes.pop(pid, None)
+        if process == None:
+            return
+
+        if usage != None:
+            process.add(now, 'cpu_seconds', usage.ru_utime + usage.ru_stime)
+            # io is not readable in every container
+            if 'disk_write_bytes' in process.readings:
+                process.add(now, 'disk_write_bytes', usage.ru_oublock * 512) # write_bytes in 512 byte blocks
+
+        self._retire(pid, process)
+
+    def _retire(self, pid, process):
+        retired = self._retired.setdefault((process.channel, process.role), {})
+        for name, (_time, value) in process.readings.iteritems():
+            retired[name] = retired.get(name, 0) + value
+
+    def sample(self, now, controllers):
+        _init_constants()
+
+        previous_processes, processes = self._processes, {}
+        stat_every = internal_settings.RESOURCE_STAT_EVERY
+        stat_slot = self._round % stat_every
+        every = internal_settings.RESOURCE_DETAILS_EVERY
+        details_slot = self._round % every
+
+        for controller in controllers:
+            channel = controller.name
+            if self._names.get(controller, channel) != channel:
+                self._rename(self._names[controller], channel, previous_processes)
+            self._names[controller] = channel
+
+            for pid, role in controller.children.iteritems():
+                process = previous_processes.pop(pid, None)
+                if process != None and (process.channel != channel or process.role != role): # pid reused
+                    self._retire(pid, process)
+                    process = None
+
+                if process == None:
+                    process = ProcessSample(channel, role)
+                elif pid % stat_every != stat_slot: # not its turn, the last reading stays
+                    processes[pid] = process
+                    continue
+
+                stat = _read('/proc/%d/stat' % pid)
+                if stat == None:
+                    previous_processes[pid] = process # retired below
+                    continue
+
+                # details of a new process are read right away, so its rates are known after two readings
+                if pid % every == details_slot or not process.readings:
+                    values = _parse_stat(stat)
+                    status = _read('/proc/%d/status' % pid)
+                    if status != None:
+                        _parse_details(values, status, _read('/proc/%d/io' % pid))
+
+                    process.update(now, values)
+                else:
+                    # the common case, kept free of temporary dicts
+                    fields = stat[stat.rindex(')') + 2:].split(' ', 22)
+                    process.rss_bytes = int(fields[21]) * PAGE_SIZE
+                    process.add(now, 'cpu_seconds', (int(fields[11]) + int(fields[12])) / CLOCK_TICKS)
+
+                processes[pid] = process
+
+        # reaped children keep counting in the totals of their role
+        for pid, process in previous_processes.iteritems():
+            self._retire(pid, process)
+
+        self._processes = processes
+        self._round += 1
+
+    def _rename(self, old, new, processes):
+        # a warm pool.WarmPool slot takes the output_path of the channel it is attached to
+        for process in processes.itervalues():
+            if process.channel == old:
+                process.channel = new
+
+        for (channel, role) in [key for key in self._retired if key[0] == old]:
+            retired = self._retired.setdefault((new, role), {})
+            for name, value in self._retired.pop((channel, role)).iteritems():
+                retired[name] = retired.get(name, 0) + value
+
+    def snapshot(self):
+        """Returns channel -> role -> stats of the latest sample."""
+        result = {}
+
+        for process in self._processes.itervalues():
+            stats = result.setdefault(process.channel, {}).setdefault(process.role, {'rss_bytes': 0})
+            stats['rss_bytes'] += process.rss_bytes
+
+            for name, rate in process.rates.iteritems():
+                if name == 'cpu_seconds':
+                    stats['cpu_percent'] = stats.get('cpu_percent', 0) + rate * 100
+                else:
+                    stats[name + '_per_second'] = stats.get(name + '_per_second', 0) + rate
+
+        return result
+
+    def counters(self):
+        """Returns channel -> role -> <counter>_total since the sampler started, exited processes included."""
+        totals = dict((key, dict(retired)) for key, retired in self._retired.iteritems())
+
+        for process in self._processes.itervalues():
+            role_totals = totals.setdefault((process.channel, process.role), {})
+            for name, (_time, value) in process.readings.iteritems():
+                role_totals[name] = role_totals.get(name, 0) + value
+
+        result = {}
+        for (channel, role), role_totals in totals.iteritems():
+            result.setdefault(channel, {})[role] = dict((name + '_total', value) for name, value in role_totals.iteritems())
+
+        return result
+
+    def forget(self, channel):
+        """Drops totals of a channel which has exited."""
+        for controller in [controller for controller, name in self._names.iteritems() if name == channel]:
+            del self._names[controller]
+
+        for key in [key for key in self._retired if key[0] == channel]:
+            del self._retired[key]
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# restart bookkeeping of supervised processes (backoff, crash loops, time to recover)
+
+import internal_settings
+
+class ProcessRestarts(object):
+    """Decides when a failed process is restarted.
+
+    Delays double from RESTART_BACKOFF_INITIAL up to RESTART_BACKOFF_MAX and go back to the
+    initial value once the process has been up for RESTART_STABLE_TIME. More than
+    RESTART_CRASH_LOOP_LIMIT failures within RESTART_CRASH_LOOP_WINDOW is a crash loop,
+    the process is not restarted anymore. A restarted process not confirmed working within
+    RESTART_RECOVERY_TIMEOUT counts as unrecovered, it is not checked anymore.
+    """
+    def __init__(self, role):
+        super(ProcessRestarts, self).__init__()
+        self.role = role
+
+        self.restarts = 0
+        self.unrecovered = 0 # restarts never confirmed working
+        self.recovery_time = None # seconds from the last failure until the process worked again
+        self.restart_at = None # time of the pending restart
+
+        self._failures = []
+        self._delay = None
+        self._failed_at = None
+        self._started_at = None
+
+    @property
+    def started_at(self):
+        return self._started_at
+
+    @property
+    def recovering(self):
+        """Restarted, but not confirmed working yet (see recovered())."""
+        return self._failed_at != None and self.restart_at == None
+
+    def failed(self, now):
+        """Schedules a restart, returns False if the process is crash looping."""
+        if self._started_at != None and now - self._started_at >= internal_settings.RESTART_STABLE_TIME:
+            self._delay = None
+
+        # time to recover counts from the first of consecutive failures
+        if self._failed_at == None:
+            self._failed_at = now
+
+        window = internal_settings.RESTART_CRASH_LOOP_WINDOW
+        self._failures = [failure for failure in self._failures if now - failure < window]
+        self._failures.append(now)
+
+        if len(self._failures) > internal_settings.RESTART_CRASH_LOOP_LIMIT:
+            self.restart_at = None
+            return False
+
+        if self._delay == None:
+            self._delay = internal_settings.RESTART_BACKOFF_INITIAL
+        else:
+            self._delay = min(self._delay * 2, internal_settings.RESTART_BACKOFF_MAX)
+
+        self.restart_at = now + self._delay
+        return True
+
+    def started(self, now):
+        self.restart_at = None
+        self._started_at = now
+        self.restarts += 1
+
+    def recovered(self, now):
+        if self._failed_at != None:
+            self.recovery_time = now - self._failed_at
+            self._failed_at = None
+
+    def recovery_timed_out(self, now):
+        """Stops recovering once RESTART_RECOVERY_TIMEOUT has passed since the restart, returns True if it did."""
+        if not self.recovering or now - self._started_at < internal_settings.RESTART_RECOVERY_TIMEOUT:
+            return False
+
+        self._failed_at = None
+        self.unrecovered += 1
+
+        return True
+
+    @property
+    def stats(self):
+        stats = {'restarts': self.restarts, 'unrecovered_restarts': self.unrecovered}
+        if self.recovery_time != None:
+            stats['recovery_seconds'] = self.recovery_time
+
+        return stats
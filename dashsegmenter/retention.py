@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from time import time
+import math
+import os
+import re
+
+import internal_settings
+import inotify
+
+class SegmentRetention(object):
+    """Deletes live segments that fell out of the timeshift window or do not fit the disk budget.
+
+    Segments still referenced by the current MPD (number >= startNumber of their SegmentTemplate)
+    are never removed; if the MPD cannot be read nothing is removed at all. The packager is started
+    with --time_shift_buffer_depth, so the MPD window itself follows timeshift_window.
+    New and removed segments (the packager deletes old ones too) are noticed with inotify, or by
+    rescanning output_path when inotify is not available.
+    """
+    def __init__(self, output_path, streams, chunk_interval, timeshift_window=None, disk_budget=None):
+        super(SegmentRetention, self).__init__()
+        self.output_path = output_path
+        self.chunk_interval = chunk_interval
+        self.timeshift_window = timeshift_window
+        self.disk_budget = disk_budget
+
+        self.deleted_segments = 0
+        self.deleted_bytes = 0
+
+        # segment template -> compiled file name pattern
+        self._patterns = {}
+        for stream in streams:
+            template = stream.segment_template
+            prefix, _, suffix = template.partition('$Number$')
+            self._patterns[template] = re.compile('^%s(\d+)%s$' % (re.escape(prefix), re.escape(suffix)))
+
+        # segment template -> {number: size}
+        self._segments = dict((template, {}) for template in self._patterns)
+
+        self._inotify = None
+        self._next_sweep = None
+
+    def start(self):
+        try:
+            self._inotify = inotify.Inotify()
+            self._inotify.add_watch(self.output_path, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO |
+                inotify.IN_DELETE | inotify.IN_MOVED_FROM)
+        except (inotify.InotifyUnavailable, OSError) as e:
+            print 'Segment retention falls back to directory scanning:', e
+            self.stop()
+
+        self._scan()
+        self._next_sweep = time() + self.chunk_interval
+
+    def stop(self):
+        if self._inotify != None:
+            self._inotify.close()
+            self._inotify = None
+
+    @property
+    def fds(self):
+        if self._inotify == None:
+            return []
+
+        return [self._inotify.fileno()]
+
+    def handle_readable(self, fd):
+        for _wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                self._scan()
+            elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                self._forget(name)
+            else:
+                self._track(name)
+
+    def next_deadline(self):
+        return self._next_sweep
+
+    def tick(self, now):
+        if self._next_sweep == None or now < self._next_sweep:
+            return
+
+        if self._inotify == None:
+            self._scan()
+
+        self.sweep()
+        self._next_sweep = now + self.chunk_interval
+
+    @property
+    def total_size(self):
+        return sum(sum(segments.itervalues()) for segments in self._segments.itervalues())
+
+    def _track(self, name):
+        for template, pattern in self._patterns.iteritems():
+            match = pattern.match(name)
+            if match == None:
+                continue
+
+            try:
+                size = os.stat(os.path.join(self.output_path, name)).st_size
+            except OSError:
+                return
+
+            self._segments[template][int(match.group(1))] = size
+            return
+
+    def _forget(self, name):
+        for template, pattern in self._patterns.iteritems():
+            match = pattern.match(name)
+            if match != None:
+                self._segments[template].pop(int(match.group(1)), None)
+                return
+
+    def _scan(self):
+        for segments in self._segments.itervalues():
+            segments.clear()
+
+        for name in os.listdir(self.output_path):
+            self._track(name)
+
+    def _referenced_start_numbers(self):
+        """Returns segment template -> first segment number referenced by the MPD, None if unreadable."""
+        try:
+            import xml.etree.cElementTree as ElementTree # only channels with retention pay for loading it
+            tree = ElementTree.parse(os.path.join(self.output_path, internal_settings.MPD_FILENAME))
+        except (IOError, SyntaxError):
+            return None
+
+        start_numbers = {}
+        for element in tree.iter():
+            if not element.tag.endswith('SegmentTemplate') or element.get('media') == None:
+                continue
+
+            start_numbers[element.get('media')] = int(element.get('startNumber', 1))
+
+        return start_numbers
+
+    def _delete(self, template, number):
+        name = template.replace('$Number$', str(number))
+        size = self._segments[template].pop(number)
+
+        try:
+            os.unlink(os.path.join(self.output_path, name))
+        except OSError as e:
+            print 'Cannot remove segment %s: %s' % (name, e)
+            return 0
+
+        self.deleted_segments += 1
+        self.deleted_bytes += size
+
+        return size
+
+    def sweep(self):
+        start_numbers = self._referenced_start_numbers()
+        if start_numbers == None:
+            return
+
+        # (number, template) of segments which are not referenced by the MPD anymore, oldest first
+        deletable = []
+        for template, segments in self._segments.iteritems():
+            if template not in start_numbers or not segments:
+                continue
+
+            first_referenced = start_numbers[template]
+            keep_from = first_referenced
+
+            if self.timeshift_window != None:
+                window_segments = int(math.ceil(float(self.timeshift_window) / self.chunk_interval))
+                keep_from = min(keep_from, max(segments) - window_segments + 1)
+
+            for number in sorted(segments):
+                if number >= first_referenced:
+                    continue
+
+                if number < keep_from:
+                    self._delete(template, number)
+                else:
+                    deletable.append((number, template))
+
+        if self.disk_budget == None:
+            return
+
+        total_size = self.total_size
+        for number, template in sorted(deletable):
+            if total_size <= self.disk_budget:
+                break
+
+            total_size -= self._delete(template, number)
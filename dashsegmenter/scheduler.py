@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# CPU budget for encoders: thread counts per rendition and core pinning
+
+import ctypes
+import ctypes.util
+import math
+import os
+
+import internal_settings
+
+CPU_SET_SIZE = 128 # bytes, room for 1024 cpus (like glibc cpu_set_t)
+
+_libc = None
+def _get_libc():
+    global _libc
+
+    if _libc == None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+    return _libc
+
+def _cpu_set(cpus):
+    mask = (ctypes.c_ubyte * CPU_SET_SIZE)()
+    for cpu in cpus:
+        mask[cpu // 8] |= 1 << (cpu % 8)
+
+    return mask
+
+def sched_setaffinity(pid, cpus):
+    """os.sched_setaffinity() replacement for python 2."""
+    mask = _cpu_set(cpus)
+    if _get_libc().sched_setaffinity(pid, CPU_SET_SIZE, ctypes.byref(mask)) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+def sched_getaffinity(pid):
+    """os.sched_getaffinity() replacement for python 2."""
+    mask = _cpu_set([])
+    if _get_libc().sched_getaffinity(pid, CPU_SET_SIZE, ctypes.byref(mask)) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    return set(cpu for cpu in range(CPU_SET_SIZE * 8) if mask[cpu // 8] & (1 << (cpu % 8)))
+
+class CpuScheduler(object):
+    """Hands out cpus to encoder processes of all channels sharing it.
+
+    Every rendition gets a thread budget from its pixel rate and bitrate and is pinned
+    to that many of the least loaded cpus, so the big rungs of one channel
+    do not starve the small ones or other channels.
+    """
+    def __init__(self, cpus=None):
+        super(CpuScheduler, self).__init__()
+        _get_libc() # loaded here, sched_setaffinity() runs in forked encoders
+        self.cpus = sorted(cpus if cpus != None else sched_getaffinity(0))
+        self._load = dict((cpu, 0) for cpu in self.cpus)
+
+    def threads_for(self, stream):
+        width = getattr(stream, 'width', None)
+        if width == None: # audio
+            return 1
+
+        pixel_rate = float(width) * stream.height * stream.frame_rate
+        threads = int(math.ceil(pixel_rate / internal_settings.ENCODER_PIXEL_RATE_PER_THREAD))
+        threads += int(stream.bitrate / internal_settings.ENCODER_BITRATE_PER_EXTRA_THREAD)
+
+        return max(1, min(threads, internal_settings.ENCODER_MAX_THREADS, len(self.cpus)))
+
+    def allocate(self, threads):
+        cpus = sorted(self.cpus, key=lambda cpu: (self._load[cpu], cpu))[:threads]
+        for cpu in cpus:
+            self._load[cpu] += 1
+
+        return sorted(cpus)
+
+    def release(self, cpus):
+        for cpu in cpus:
+            self._load[cpu] -= 1
+
+    @property
+    def load(self):
+        """cpu -> number of encoder processes pinned to it."""
+        return dict(self._load)
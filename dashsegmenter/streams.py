@@ -25,38 +25,29 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from subprocess import Popen
-from multiprocessing import Value
-from time import sleep
+from subprocess import Popen, PIPE
+from time import time
 import os
 import sys
+import stat
 import signal
-import ctypes
 import itertools
 import errno
+import fcntl
 
 
 import internal_settings
 import command_templates
-
-ignored_pid = Value('l')
-
-# exit app when some of my children has died
-# it will result in killing all remaining children and commiting suicide at the end
-# pretty nice story huh? :)
-def child_exit_handler(signal, frame_object):
-    global ignored_pid
-    pid, _whatever = os.waitpid(-1, 0)
-
-    if pid == ignored_pid.value:
-        return
-
-    sys.exit(1)
-signal.signal(signal.SIGCHLD, child_exit_handler)
+import telemetry
+import restarts
 
 class Settings(object):
     def __init__(self, base_port, chunk_interval, thumbnail_interval, thumbnail_stream, input_stream, output_path,
-        debug_ffmpeg=False, debug_packager=False, debug_thumbnail=False):
+        debug_ffmpeg=False, debug_packager=False, debug_thumbnail=False, persistent_thumbnailer=False,
+        transport=internal_settings.TRANSPORT_UDP, timeshift_window=None, disk_budget=None, scheduler=None,
+        cascade_scaling=False, probe_source=False, restart_processes=True, low_latency=False, chunk_duration=None,
+        utc_timing=None, measure_latency=False, trickplay=False, trickplay_interval=None, staging_path=None,
+        publish_target=None, publish_threads=None, inspect_segments=False, port_allocator=None):
         super(Settings, self).__init__()
         self.base_port = base_port
         self.chunk_interval = chunk_interval
@@ -67,9 +58,41 @@ class Settings(object):
         self.debug_packager = debug_packager
         self.debug_ffmpeg = debug_ffmpeg
         self.debug_thumbnail = debug_thumbnail
+        self.persistent_thumbnailer = persistent_thumbnailer
+        self.transport = transport
+        self.timeshift_window = timeshift_window # seconds of segments kept on disk, None keeps everything
+        self.disk_budget = disk_budget # bytes of segments kept on disk, None is unlimited
+        self.scheduler = scheduler # scheduler.CpuScheduler, splits the ladder into one pinned encoder per stream
+        self.cascade_scaling = cascade_scaling # decode once, scale rungs from each other in one filter graph
+        self.probe_source = probe_source # ffprobe input_stream and prune rungs exceeding it
+        self.restart_processes = restart_processes # restart died ffmpeg/packager alone instead of stopping the channel
+        self.low_latency = low_latency # CMAF chunked segments, key frames forced at segment boundaries
+        self.chunk_duration = chunk_duration if chunk_duration != None else internal_settings.LOW_LATENCY_CHUNK_DURATION
+        # clock low latency players sync to, e.g. 'urn:mpeg:dash:utc:http-xsdate:2014=https://time.akamai.com/?iso'
+        self.utc_timing = utc_timing
+        self.measure_latency = measure_latency or low_latency # latency.SegmentLatency and latency.StartupLatency in stats()
+        self.trickplay = trickplay # storyboard sprite sheets and WebVTT from the thumbnail stream (needs numpy)
+        self.trickplay_interval = trickplay_interval if trickplay_interval != None else internal_settings.TRICKPLAY_INTERVAL
+        self.staging_path = staging_path # tmpfs the packager writes to, files are published to output_path (or publish_target)
+        self.publish_target = publish_target # publish.DirectoryTarget or publish.S3Target, output_path by default
+        self.publish_threads = publish_threads
+        self.inspect_segments = inspect_segments # inspector.SegmentInspector checks every segment, reported in stats()
+        self.port_allocator = port_allocator # ports.PortAllocator, reserves the ports on start() instead of using base_port
+
+        if transport not in (internal_settings.TRANSPORT_UDP, internal_settings.TRANSPORT_FIFO):
+            raise InvalidTransport(transport)
+
+        if low_latency and not 0 < self.chunk_duration <= chunk_interval:
+            raise InvalidChunkDuration('chunk_duration has to be positive and at most chunk_interval')
+
+        # no time server is contacted unless it has been configured
+        if low_latency and utc_timing == None:
+            raise MissingUtcTiming('low_latency needs utc_timing')
 
         if thumbnail_stream != None:
             thumbnail_stream.is_thumbnail_source = True
+        elif trickplay:
+            raise InvalidThumbnailStream('trickplay needs thumbnail_stream')
 
 class Stream(object):
     def __init__(self, name, bitrate, port=None):
@@ -77,12 +100,18 @@ class Stream(object):
         self.name = name
         self.bitrate = bitrate
         self.port = port
+        self.local_path = None # fifo or file used instead of UDP
+        self.threads = None # encoder threads, set by scheduler.CpuScheduler
+        self.force_key_frames = None # ffmpeg -force_key_frames expression
 
     def __eq__(self, other):
         return self.name == other.name and self.__class__ == other.__class__
 
     @property
     def output_address(self):
+        if self.local_path != None:
+            return internal_settings.STREAM_ADDRESS_LOCAL % {'path': self.local_path}
+
         return internal_settings.STREAM_ADDRESS_INPUT % {'address': '127.0.0.1', 'port': self.port}
 
     input_address = output_address
@@ -91,6 +120,11 @@ class Stream(object):
     def output_address_thumbnail(self):
         return internal_settings.STREAM_ADDRESS_INPUT % {'address': '127.0.0.1', 'port': self.port_thumb}
 
+    @property
+    def packaged(self):
+        """False if the packager does not get this stream, no segments are written for it."""
+        return True
+
     @property 
     def bitrate_in_k(self):
         return '%sk' % (int(self.bitrate/1000))
@@ -123,12 +157,29 @@ class Stream(object):
             'BITRATE': self.bitrate,
         }
         
-        return command_templates.PACKAGER_STREAM_DEFINITION.eval(values)
+        return command_templates.PACKAGER_STREAM_DEFINITION.compiled.eval(values)
 
-class AudioStream(Stream):
     @property
-    def ffmpeg_definition(self):
+    def vod_output_name(self):
+        if isinstance(self, AudioStream):
+            return internal_settings.VOD_OUTPUT_NAME_AUDIO % (self.name)
+
+        return internal_settings.VOD_OUTPUT_NAME_VIDEO % (self.name)
+
+    @property
+    def vod_packager_definition(self):
         values = {
+            'INPUT_STREAM_ADDRESS': self.input_address,
+            'STREAM_TYPE': self.stream_type,
+            'OUTPUT_NAME': self.vod_output_name,
+            'BITRATE': self.bitrate,
+        }
+
+        return command_templates.PACKAGER_STREAM_DEFINITION_VOD.compiled.eval(values)
+
+class AudioStream(Stream):
+    def _ffmpeg_values(self):
+        return {
             'AUDIO_CODEC': internal_settings.AUDIO_CODEC,
             'AUDIO_CHANNELS': internal_settings.AUDIO_CHANNELS,
             'AUDIO_BITRATE': self.bitrate_in_k,
@@ -136,15 +187,25 @@ class AudioStream(Stream):
             'STREAM_CONTAINER': internal_settings.STREAM_CONTAINER,
             'OUTPUT_STREAM': self.output_address
         }
-        
-        return command_templates.FFMPEG_OUTPUT_DEFINITION_AUDIO.eval(values)
+
+    @property
+    def ffmpeg_definition(self):
+        return command_templates.FFMPEG_OUTPUT_DEFINITION_AUDIO.compiled.eval(self._ffmpeg_values())
+
+    def ffmpeg_mapped_definition(self, label):
+        """Output definition taking its input from an explicit -map label (filter graph mode)."""
+        values = self._ffmpeg_values()
+        values['MAP'] = label
+
+        return command_templates.FFMPEG_OUTPUT_DEFINITION_AUDIO_MAPPED.compiled.eval(values)
 
 class VideoStream(Stream):
     @property
     def dimensions(self):
         return '%sx%s' % (self.width, self.height)
 
-    def __init__(self, name, bitrate, width, height, frame_rate, i_frame_rate=None, port=None, disable_packager=False):
+    def __init__(self, name, bitrate, width, height, frame_rate, i_frame_rate=None, port=None, disable_packager=False,
+        rate_control=None, crf=None):
         super(VideoStream, self).__init__(name, bitrate, port)
 
         self.width = width
@@ -153,41 +214,100 @@ class VideoStream(Stream):
         self.i_frame_rate = i_frame_rate
         self.is_thumbnail_source = False
         self.disable_packager = disable_packager
+        self.key_frame_interval = None # seconds, GOP when i_frame_rate is not set (the controller uses chunk_interval)
+        self.port_trickplay = None # third copy of the thumbnail source for the trickplay decoder
+
+        # capped_crf spends bits by quality up to bitrate, which stays the bandwidth declared to the packager
+        self.rate_control = rate_control if rate_control != None else internal_settings.RATE_CONTROL_ABR
+        self.crf = crf if crf != None else internal_settings.CAPPED_CRF
+
+        if self.rate_control not in (internal_settings.RATE_CONTROL_ABR, internal_settings.RATE_CONTROL_CAPPED_CRF):
+            raise InvalidRateControl(self.rate_control)
 
     @property
-    def ffmpeg_definition(self):
+    def output_address_trickplay(self):
+        return internal_settings.STREAM_ADDRESS_INPUT % {'address': '127.0.0.1', 'port': self.port_trickplay}
+
+    @property
+    def trickplay_output_definition(self):
+        if self.port_trickplay == None:
+            return []
+
+        return ['|[f=%s]' % internal_settings.STREAM_CONTAINER, self.output_address_trickplay]
+
+    @property
+    def gop_size(self):
+        if self.i_frame_rate != None or self.key_frame_interval == None:
+            return self.i_frame_rate
+
+        return max(1, int(round(self.frame_rate * self.key_frame_interval)))
+
+    @property
+    def threads_definition(self):
+        return ['-threads', self.threads] if self.threads != None else []
+
+    @property
+    def rate_control_definition(self):
+        if self.rate_control == internal_settings.RATE_CONTROL_CAPPED_CRF:
+            return ['-crf', self.crf, '-maxrate', self.bitrate, '-bufsize', int(self.bitrate * internal_settings.CAPPED_CRF_BUFFER)]
+
+        return ['-b:v', self.bitrate]
+
+    @property
+    def force_key_frames_definition(self):
+        if self.force_key_frames == None:
+            return []
+
+        return ['-force_key_frames', self.force_key_frames, '-sc_threshold', '0']
+
+    def _ffmpeg_values(self):
+        values = {
+            'DIMENSIONS': self.dimensions,
+            'VIDEO_CODEC': internal_settings.VIDEO_CODEC,
+            'FRAME_RATE': self.frame_rate,
+            'I_FRAME_RATE': self.gop_size,
+            'PRESET': internal_settings.VIDEO_PRESET,
+            'PIXEL_FORMAT': internal_settings.PIXEL_FORMAT,
+            'RATE_CONTROL': self.rate_control_definition,
+            'ENCODING_THREADS': self.threads_definition,
+            'FORCE_KEY_FRAMES': self.force_key_frames_definition,
+        }
+
         if self.is_thumbnail_source:
-            values = {
-                'DIMENSIONS': self.dimensions,
-                'VIDEO_CODEC': internal_settings.VIDEO_CODEC,
-                'FRAME_RATE': self.frame_rate,
-                'I_FRAME_RATE': self.i_frame_rate,
-                'PRESET': internal_settings.VIDEO_PRESET,
-                'PIXEL_FORMAT': internal_settings.PIXEL_FORMAT,
-                'VIDEO_BITRATE': self.bitrate,              
-                'OUTPUT_STREAMS': 
-                {
-                    'STREAM_CONTAINER': internal_settings.STREAM_CONTAINER,
-                    'OUTPUT_STREAM_0': self.output_address,
-                    'OUTPUT_STREAM_1': self.output_address_thumbnail,
-                }
+            values['OUTPUT_STREAMS'] = {
+                'STREAM_CONTAINER': internal_settings.STREAM_CONTAINER,
+                'OUTPUT_STREAM_0': self.output_address,
+                'OUTPUT_STREAM_1': self.output_address_thumbnail,
+                'TRICKPLAY_OUTPUT': self.trickplay_output_definition,
             }
-            
-            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE.eval(values)
         else:
-            values = {
-                'DIMENSIONS': self.dimensions,
-                'VIDEO_CODEC': internal_settings.VIDEO_CODEC,
-                'FRAME_RATE': self.frame_rate,
-                'I_FRAME_RATE': self.i_frame_rate,
-                'PRESET': internal_settings.VIDEO_PRESET,
-                'PIXEL_FORMAT': internal_settings.PIXEL_FORMAT,
-                'VIDEO_BITRATE': self.bitrate,
+            values.update({
                 'STREAM_CONTAINER': internal_settings.STREAM_CONTAINER,
                 'OUTPUT_STREAM': self.output_address,
-            }
-            
-            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO.eval(values)
+            })
+
+        return values
+
+    @property
+    def ffmpeg_definition(self):
+        if self.is_thumbnail_source:
+            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE.compiled.eval(self._ffmpeg_values())
+        else:
+            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO.compiled.eval(self._ffmpeg_values())
+
+    def ffmpeg_mapped_definition(self, label):
+        """Output definition taking already scaled video from filter graph label (see filter_graph())."""
+        values = self._ffmpeg_values()
+        values['MAP'] = label
+
+        if self.is_thumbnail_source:
+            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO_CLONE_MAPPED.compiled.eval(values)
+        else:
+            return command_templates.FFMPEG_OUTPUT_DEFINITION_VIDEO_MAPPED.compiled.eval(values)
+
+    @property
+    def packaged(self):
+        return not self.disable_packager
 
     @property
     def packager_definition(self):
@@ -196,6 +316,57 @@ class VideoStream(Stream):
         else:
             return super(VideoStream, self).packager_definition
 
+    @property
+    def vod_packager_definition(self):
+        if self.disable_packager:
+            return ''
+        else:
+            return super(VideoStream, self).vod_packager_definition
+
+def filter_graph(video_streams, scaler=None):
+    """Builds a -filter_complex graph decoding input video once and scaling it in a cascade.
+
+    Rungs are scaled from the next bigger rung (1080 -> 720 -> 480 ...) instead of from the
+    source; streams of equal dimensions share one scaled branch.
+    Returns (graph, {stream: output label}).
+    """
+    if scaler == None:
+        scaler = internal_settings.CASCADE_SCALER
+
+    rungs = {}
+    for stream in video_streams:
+        rungs.setdefault((stream.width, stream.height), []).append(stream)
+
+    nodes = []
+    labels = {}
+    input_label = '0:v'
+
+    dimensions_order = sorted(rungs, key=lambda dimensions: dimensions[0] * dimensions[1], reverse=True)
+    for index, dimensions in enumerate(dimensions_order):
+        output_labels = []
+        for number, stream in enumerate(rungs[dimensions]):
+            labels[stream] = '[v%d_%d]' % (index, number)
+            output_labels.append(labels[stream])
+
+        cascade_label = None
+        if index + 1 < len(dimensions_order):
+            cascade_label = 'c%d' % index
+            output_labels.append('[%s]' % cascade_label)
+
+        values = {
+            'INPUT_LABEL': input_label,
+            'WIDTH': dimensions[0],
+            'HEIGHT': dimensions[1],
+            'SCALER': scaler,
+            'SPLIT': ',split=%d' % len(output_labels) if len(output_labels) > 1 else '',
+            'OUTPUT_LABELS': output_labels,
+        }
+        nodes.append(command_templates.FFMPEG_FILTER_SCALE_NODE.compiled.eval(values))
+
+        input_label = cascade_label
+
+    return ';'.join(nodes), labels
+
 class StreamNameDuplicated(Exception):
     pass
 
@@ -205,24 +376,122 @@ class InvalidThumbnailStream(Exception):
 class NoStreams(Exception):
     pass
 
+class InvalidTransport(Exception):
+    pass
+
+class InvalidChunkDuration(Exception):
+    pass
+
+class MissingUtcTiming(Exception):
+    pass
+
+class InvalidRateControl(Exception):
+    pass
+
+class ProcessStartFailed(Exception):
+    pass
+
+class SharedFifoInput(Exception):
+    pass
+
+
+# nothing is opened or loaded at import time (config validation only imports this module),
+# devnull and libc are set up by the first controller which starts processes
+
+_devnull = None
+def devnull():
+    global _devnull
+
+    if _devnull == None:
+        _devnull = open(os.devnull, 'w')
+
+    return _devnull
+
+_libc = None
+def _get_libc():
+    global _libc
 
-DEVNULL = open(os.devnull, 'w')
+    if _libc == None:
+        import ctypes
+        _libc = ctypes.CDLL("libc.so.6")
+
+    return _libc
 
-libc = ctypes.CDLL("libc.so.6")
 def set_pdeathsig(sig=signal.SIGTERM):
+    # libc is resolved here, the callable runs in the forked child
+    libc = _get_libc()
+
     def callable():
         return libc.prctl(1, sig) # PR_SET_PDEATHSIG @ http://man7.org/linux/man-pages/man2/prctl.2.html
     return callable
 
+F_SETPIPE_SZ = 1031 # linux/fcntl.h, not exported by python 2
+
+PNG_END = '\x00\x00\x00\x00IEND\xaeB`\x82'
+
+def exited_cleanly(status):
+    return status != None and os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+def mark_reaped(process, status):
+    """Stores status of a child reaped with os.waitpid() in its Popen object.
+
+    subprocess waits again for every collected Popen without returncode, by then the pid
+    may belong to another child. status None means it was reaped by someone else.
+    """
+    if status == None:
+        process.returncode = -1
+    elif os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
 class StreamsController(object):
     def __init__(self, settings):
         super(StreamsController, self).__init__()
         self.settings = settings
         self._streams = set([])
+        self._configured_streams = None # ladder as added, before pruning
+        self.pruned = [] # (stream name, action, detail) of the last pruning
 
         self._commandline_ffmpeg = None
+        self._commandlines_ffmpeg = [] # (role, commandline) of every encoder process
         self._commandline_packager = None
         self._commandline_thumbgen = None
+        self._commandline_trickplay = None
+
+        # pid -> role ('ffmpeg', 'packager' or 'thumbnail') of every child we have not reaped yet
+        self._children = {}
+        # pid -> Popen of the same children, a collected Popen would be reaped by subprocess itself
+        self._popens = {}
+        self.running = False
+
+        self._thumbnail_pid = None
+        self._thumbnail_deadline = None
+        self._next_thumbnail = None
+        self._thumbnail_pipe = None
+        self._thumbnail_buffer = ''
+
+        # ffprobe of probe_source, the rest of the channel is started once it is done
+        self._probe_pipe = None
+        self._probe_output = []
+        self._probe_deadline = None
+
+        self._fifo_directory = None
+        self._fifo_fds = []
+
+        self._services = []
+        self._progress = {} # encoder role -> telemetry.ProgressReader
+        self._cpu_allocations = {} # encoder role -> pinned cpus
+
+        self._processes = {} # role -> (commandline, Popen kwargs) of ffmpeg and packager, for restarts
+        self._restarts = {} # role -> restarts.ProcessRestarts
+        self._latency = None # latency.SegmentLatency
+        self._startup = None # latency.StartupLatency
+        self._inspector = None # inspector.SegmentInspector
+        self._trickplay = None # trickplay.Storyboard
+        self._publisher = None # publish.SegmentPublisher
+        self._staging_directory = None # packager output when staging in RAM
+        self._reserved_port = None # base port reserved from settings.port_allocator
 
         if settings.thumbnail_stream != None and not isinstance(settings.thumbnail_stream, VideoStream):
             raise InvalidThumbnailStream('thumbnail_stream should be a VideoStream')
@@ -235,13 +504,155 @@ class StreamsController(object):
             raise StreamNameDuplicated()
 
         self._streams.add(stream)
+        if self._configured_streams != None:
+            self._configured_streams.add(stream)
+
+    @property
+    def thumbnail_stream(self):
+        # the ladder may contain a pruned copy of settings.thumbnail_stream
+        for stream in self._streams:
+            if stream == self.settings.thumbnail_stream:
+                return stream
+
+        return self.settings.thumbnail_stream
+
+    def _prune_ladder(self, source):
+        # without source (probing failed) the full ladder is encoded
+        if source == None:
+            self._streams = set(self._configured_streams)
+            self.pruned = []
+            return
+
+        import probe
+        self._streams, self.pruned = probe.prune_ladder(self._configured_streams, source, self.settings.thumbnail_stream)
+
+        for name, action, detail in self.pruned:
+            print 'Stream %s %s: %s' % (name, action, detail)
+
+    def _start_probe(self):
+        """Prunes the ladder from a cached probe, or spawns ffprobe and returns True."""
+        if self._configured_streams == None:
+            self._configured_streams = set(self._streams)
+
+        # only channels with probe_source need it, config validation does not pay for the import
+        import probe
+        source = probe.cached(self.settings.input_stream)
+        if source != None:
+            self._prune_ladder(source)
+            return False
+
+        kwargs = {'stdout': PIPE, 'stderr': devnull(), 'close_fds': True, 'preexec_fn': set_pdeathsig(signal.SIGKILL)}
+        try:
+            process = self._spawn('probe', probe.probe_commandline(self.settings.input_stream), **kwargs)
+        except OSError as e:
+            print 'Cannot probe %s, encoding full ladder: %s' % (self.settings.input_stream, e)
+            self._prune_ladder(None)
+            return False
+
+        self._probe_pipe = process.stdout
+        fd = self._probe_pipe.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._probe_output = []
+        self._probe_deadline = time() + internal_settings.PROBE_KILL_TIMEOUT
+
+        return True
+
+    def _read_probe(self):
+        """Collects ffprobe output, returns False once there is nothing more to read now."""
+        try:
+            data = os.read(self._probe_pipe.fileno(), 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+        if not data:
+            self._close_probe_pipe()
+            return False
+
+        self._probe_output.append(data)
+
+        return True
+
+    def _close_probe_pipe(self):
+        if self._probe_pipe != None:
+            self._probe_pipe.close()
+            self._probe_pipe = None
+
+    def _probe_exited(self, returncode):
+        # whatever ffprobe wrote before exiting may still be in the pipe
+        while self._probe_pipe != None and self._read_probe():
+            pass
+        self._close_probe_pipe()
+
+        output, self._probe_output = ''.join(self._probe_output), []
+        self._probe_deadline = None
+
+        if not self.running:
+            return
+
+        import probe
+        try:
+            source = probe.probe_result(self.settings.input_stream, returncode, output)
+        except probe.ProbeFailed as e:
+            print 'Cannot probe %s, encoding full ladder: %s' % (self.settings.input_stream, e)
+            source = None
+
+        self._prune_ladder(source)
+
+        try:
+            self._start_processes()
+        except Exception as e:
+            print 'Channel %s failed to start: %s' % (self.name, e)
+            self.stop()
+
+    @property
+    def name(self):
+        return self.settings.output_path
+
+    @property
+    def pids(self):
+        return self._children.keys()
+
+    @property
+    def children(self):
+        """Returns pid -> role ('ffmpeg', 'packager', 'thumbnail', ...) of every child not reaped yet."""
+        return dict(self._children)
+
+    def _ordered_streams(self):
+        # sets have no stable order, ports and encoder groups must not change between runs
+        return sorted(self._streams, key=lambda stream: (stream.stream_type, stream.name))
+
+    def _port_count(self):
+        # base port, one per stream, thumbnail (and trickplay) outputs of the thumbnail source
+        count = 1 + len(self._streams)
+
+        for stream in self._streams:
+            if isinstance(stream, VideoStream) and stream.is_thumbnail_source:
+                count += 2 if self.settings.trickplay else 1
+
+        return count
+
+    def _reserve_ports(self):
+        import ports
+
+        try:
+            self._reserved_port = self.settings.port_allocator.reserve(self.name, self._port_count())
+        except (ports.PortsExhausted, ports.RegistryNotPrivate) as e:
+            raise ProcessStartFailed('Cannot reserve ports: %s' % str(e))
+
+    def _release_ports(self):
+        if self._reserved_port != None:
+            self.settings.port_allocator.release(self._reserved_port)
+            self._reserved_port = None
 
     def _assign_ports(self):
-        port = self.settings.base_port
+        port = self._reserved_port if self._reserved_port != None else self.settings.base_port
 
         base_port, port = port, port+1
 
-        for stream in self._streams:
+        for stream in self._ordered_streams():
             stream.port = port
 
             if isinstance(stream, VideoStream) and stream.is_thumbnail_source:
@@ -249,26 +660,137 @@ class StreamsController(object):
 
                 stream.port_thumb = port
 
+                stream.port_trickplay = None
+                if self.settings.trickplay:
+                    port += 1
+                    stream.port_trickplay = port
+
             port += 1
+
+    def _encoder_groups(self):
+        """Returns [(role, streams)], one encoder process per entry."""
+        if self.settings.scheduler == None:
+            return [('ffmpeg', self._ordered_streams())]
+
+        return [('ffmpeg:%s:%s' % (stream.stream_type, stream.name), [stream]) for stream in self._ordered_streams()]
+
+    def _schedule_encoders(self):
+        scheduler = self.settings.scheduler
+
+        for role, streams in self._encoder_groups():
+            threads = 0
+            for stream in streams:
+                stream_threads = scheduler.threads_for(stream)
+                stream.threads = stream_threads if isinstance(stream, VideoStream) else None
+                threads += stream_threads
+
+            self._cpu_allocations[role] = scheduler.allocate(threads)
+
+    def _release_cpus(self):
+        for cpus in self._cpu_allocations.itervalues():
+            self.settings.scheduler.release(cpus)
+
+        self._cpu_allocations = {}
+
+    def _encoder_preexec(self, role):
+        cpus = self._cpu_allocations.get(role)
+        pdeathsig = set_pdeathsig(signal.SIGKILL)
+        progress = self._progress[role]
+
+        if cpus != None:
+            import scheduler
+
+        def preexec():
+            pdeathsig()
+            progress.inherit_write_end()
+
+            if cpus != None:
+                scheduler.sched_setaffinity(0, cpus)
+
+        return preexec
+
+    def _create_fifos(self):
+        # thumbnail copies stay on UDP: thumbnailer does not read all the time and a full fifo
+        # would stall the encoder
+        import tempfile
+        self._fifo_directory = tempfile.mkdtemp(prefix='dashsegmenter-')
+
+        for stream in self._streams:
+            stream.local_path = os.path.join(self._fifo_directory, '%s_%s.ts' % (stream.stream_type, stream.name))
+            os.mkfifo(stream.local_path, 0600)
+
+            # we keep the fifo open, so the enlarged buffer survives and neither side sees EOF
+            # when the other one goes away
+            fd = os.open(stream.local_path, os.O_RDWR | os.O_NONBLOCK)
+            # children open fifos by path, children of later channels must not pin this one
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            try:
+                fcntl.fcntl(fd, F_SETPIPE_SZ, internal_settings.FIFO_BUFFER_SIZE)
+            except IOError as e:
+                print 'Cannot enlarge fifo buffer of %s: %s' % (stream.name, e)
+
+            self._fifo_fds.append(fd)
+
+    def _remove_fifos(self):
+        for fd in self._fifo_fds:
+            os.close(fd)
+        self._fifo_fds = []
+
+        if self._fifo_directory != None:
+            import shutil
+            shutil.rmtree(self._fifo_directory, ignore_errors=True)
+            self._fifo_directory = None
+
+        for stream in self._streams:
+            stream.local_path = None
     
     def _build_commandlines(self):
         if len(self._streams) == 0:
             raise NoStreams()
 
-        ffmpeg_stream_definitions = []
         packager_stream_definitions = []
         self._commandline_thumbgen = None
+        self._commandline_trickplay = None
         self._commandline_packager = None
+        self._commandlines_ffmpeg = []
 
-        for stream in self._streams:
-            ffmpeg_stream_definitions.extend(stream.ffmpeg_definition)
+        for stream in self._ordered_streams():
             packager_stream_definitions.append(stream.packager_definition)
 
-        values = {
-            'INPUT_STREAM': self.settings.input_stream,
-            'OUTPUT_DEFINITIONS': ffmpeg_stream_definitions,
-        }
-        self._commandline_ffmpeg = command_templates.FFMPEG_TEMPLATE.eval(values)
+            # segments can only start at key frames
+            if isinstance(stream, VideoStream):
+                stream.key_frame_interval = self.settings.chunk_interval
+                if self.settings.low_latency:
+                    stream.force_key_frames = 'expr:gte(t,n_forced*%s)' % self.settings.chunk_interval
+
+        for role, streams in self._encoder_groups():
+            progress = self._progress.get(role)
+            values = {
+                'INPUT_STREAM': self.settings.input_stream,
+                'PROGRESS': ['-progress', progress.progress_url] if progress != None else [],
+            }
+
+            video_streams = [stream for stream in streams if isinstance(stream, VideoStream)]
+            ffmpeg_stream_definitions = []
+
+            if self.settings.cascade_scaling and video_streams:
+                values['FILTER_GRAPH'], labels = filter_graph(video_streams)
+
+                for stream in streams:
+                    ffmpeg_stream_definitions.extend(stream.ffmpeg_mapped_definition(labels.get(stream, '0:a')))
+
+                values['OUTPUT_DEFINITIONS'] = ffmpeg_stream_definitions
+                commandline = command_templates.FFMPEG_TEMPLATE_FILTER_GRAPH.compiled.eval(values)
+            else:
+                for stream in streams:
+                    ffmpeg_stream_definitions.extend(stream.ffmpeg_definition)
+
+                values['OUTPUT_DEFINITIONS'] = ffmpeg_stream_definitions
+                commandline = command_templates.FFMPEG_TEMPLATE.compiled.eval(values)
+
+            self._commandlines_ffmpeg.append((role, commandline))
+
+        self._commandline_ffmpeg = self._commandlines_ffmpeg[0][1] if len(self._commandlines_ffmpeg) == 1 else None
 
         values = {
             'STREAM_DEFINITIONS': packager_stream_definitions,
@@ -279,21 +801,115 @@ class StreamsController(object):
             },
             'SINGLE_SEGMENT_CONFIG': {
                 'SINGLE_SEGMENT': internal_settings.SINGLE_SEGMENT,
-            }
+            },
+            'TIME_SHIFT_BUFFER': self._time_shift_buffer_definition(),
+            'LOW_LATENCY': self._low_latency_definition(),
         }
         if len(packager_stream_definitions) > 0:
-            self._commandline_packager = command_templates.PACKAGER_TEMPLATE.eval(values)
+            self._commandline_packager = command_templates.PACKAGER_TEMPLATE.compiled.eval(values)
 
 
         if self.settings.thumbnail_stream != None:
             self._commandline_thumbgen = []
+            thumbnail_stream = self.thumbnail_stream
+
+            if self.settings.persistent_thumbnailer:
+                values = {
+                    'INPUT_STREAM': thumbnail_stream.output_address_thumbnail,
+                    'FPS_FILTER': {
+                        'THUMBNAIL_INTERVAL': self.settings.thumbnail_interval,
+                    },
+                }
+                self._commandline_thumbgen = command_templates.FFMPEG_TEMPLATE_THUMBNAIL_PERSISTENT.compiled.eval(values)
+            else:
+                values = {
+                    'INPUT_STREAM': thumbnail_stream.output_address_thumbnail,
+                    'OUTPUT_FILE': internal_settings.THUMBNAIL_TEMPORARY_FILENAME 
+                }
+                self._commandline_thumbgen = command_templates.FFMPEG_TEMPLATE_THUMBNAIL.compiled.eval(values)
+
+            if self.settings.trickplay:
+                width, height = self._trickplay_tile()
+                values = {
+                    'INPUT_STREAM': thumbnail_stream.output_address_trickplay,
+                    'TRICKPLAY_FILTER': {
+                        'TRICKPLAY_INTERVAL': self.settings.trickplay_interval,
+                        'WIDTH': width,
+                        'HEIGHT': height,
+                    },
+                }
+                self._commandline_trickplay = command_templates.FFMPEG_TEMPLATE_TRICKPLAY.compiled.eval(values)
 
-            values = {
-                'INPUT_STREAM': self.settings.thumbnail_stream.output_address_thumbnail,
-                'OUTPUT_FILE': internal_settings.THUMBNAIL_TEMPORARY_FILENAME 
-            }
-            self._commandline_thumbgen = command_templates.FFMPEG_TEMPLATE_THUMBNAIL.eval(values)
 
+    def _trickplay_tile(self):
+        # even height keeping the aspect ratio of the thumbnail stream
+        stream = self.thumbnail_stream
+        width = internal_settings.TRICKPLAY_TILE_WIDTH
+
+        return width, max(2, int(round(width * stream.height / float(stream.width) / 2)) * 2)
+
+    def _start_trickplay(self):
+        kwargs = {'cwd': self.settings.output_path, 'close_fds': True, 'preexec_fn': set_pdeathsig(signal.SIGKILL), 'stdout': PIPE}
+        if self.settings.debug_thumbnail:
+            print 'Trickplay command:', self._commandline_trickplay
+        else:
+            kwargs['stderr'] = devnull()
+
+        self._processes['trickplay'] = (self._commandline_trickplay, kwargs)
+        if self.settings.restart_processes:
+            self._restarts['trickplay'] = restarts.ProcessRestarts('trickplay')
+
+        try:
+            process = self._spawn('trickplay', self._commandline_trickplay, **kwargs)
+        except OSError as e:
+            print 'Cannot start trickplay generator: %s' % str(e)
+            return
+
+        self._trickplay.attach(process.stdout)
+
+    @property
+    def _packager_path(self):
+        return self._staging_directory if self._staging_directory != None else self.settings.output_path
+
+    def _remove_staging(self):
+        if self._staging_directory != None:
+            import shutil
+            shutil.rmtree(self._staging_directory, ignore_errors=True)
+            self._staging_directory = None
+
+    def _time_shift_buffer_definition(self):
+        # the MPD window follows timeshift_window, so retention can delete what falls out of it
+        if self.settings.timeshift_window == None:
+            return []
+
+        return ['--time_shift_buffer_depth=%s' % self.settings.timeshift_window]
+
+    def _low_latency_definition(self):
+        # packager writes availabilityTimeOffset (segment minus chunk duration) and the UTCTiming element itself
+        if not self.settings.low_latency:
+            return []
+
+        return [
+            '--low_latency_dash_mode=true',
+            '--fragment_duration=%s' % self.settings.chunk_duration,
+            '--utc_timings=%s' % self.settings.utc_timing,
+        ]
+
+    def _ingest_start(self):
+        # wall time at which media time 0 entered the encoders, from the freshest progress report
+        freshest = None
+        for progress in self._progress.itervalues():
+            stats = progress.stats
+            if stats.get('updated') == None or stats.get('out_time') == None:
+                continue
+
+            if freshest == None or stats['updated'] > freshest['updated']:
+                freshest = stats
+
+        if freshest == None:
+            return None
+
+        return freshest['updated'] - freshest['out_time']
 
     def _move_thumbnail(self):
         try:
@@ -306,8 +922,91 @@ class StreamsController(object):
         except OSError as e:
             print 'Cannot replace thumbnail:', e
 
+    def _write_thumbnail(self, data):
+        try:
+            with open(os.path.join(self.settings.output_path, internal_settings.THUMBNAIL_TEMPORARY_FILENAME), 'wb') as f:
+                f.write(data)
+        except IOError as e:
+            print 'Cannot write thumbnail:', e
+            return
+
+        self._move_thumbnail()
 
-    def _generate_thumbnail(self):
+    def _spawn(self, role, commandline, **kwargs):
+        process = Popen(commandline, **kwargs)
+        self._children[process.pid] = role
+        self._popens[process.pid] = process
+
+        return process
+
+    @property
+    def fds(self):
+        """File descriptors the supervisor should wait on and pass to handle_readable()."""
+        fds = []
+
+        if self._thumbnail_pipe != None:
+            fds.append(self._thumbnail_pipe.fileno())
+
+        if self._probe_pipe != None:
+            fds.append(self._probe_pipe.fileno())
+
+        for service in self._services:
+            fds.extend(service.fds)
+
+        return fds
+
+    def handle_readable(self, fd):
+        if self._probe_pipe != None and fd == self._probe_pipe.fileno():
+            self._read_probe()
+            return
+
+        for service in self._services:
+            if fd in service.fds:
+                service.handle_readable(fd)
+                return
+
+        self._read_thumbnail(fd)
+
+    def _read_thumbnail(self, fd):
+        # persistent thumbnailer writes PNGs back to back, every one ends with an IEND chunk
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        if not data:
+            self._close_thumbnail_pipe()
+            return
+
+        self._thumbnail_buffer += data
+
+        frame = None
+        while True:
+            end = self._thumbnail_buffer.find(PNG_END)
+            if end < 0:
+                break
+
+            end += len(PNG_END)
+            frame, self._thumbnail_buffer = self._thumbnail_buffer[:end], self._thumbnail_buffer[end:]
+
+        # only the freshest frame is worth writing
+        if frame != None:
+            self._write_thumbnail(frame)
+
+        if len(self._thumbnail_buffer) > internal_settings.THUMBNAIL_MAX_SIZE:
+            print 'Thumbnail bigger than %s bytes, dropping it' % internal_settings.THUMBNAIL_MAX_SIZE
+            self._thumbnail_buffer = ''
+
+    def _close_thumbnail_pipe(self):
+        if self._thumbnail_pipe != None:
+            self._thumbnail_pipe.close()
+
+        self._thumbnail_pipe = None
+        self._thumbnail_buffer = ''
+
+    def _generate_thumbnail(self, now):
         # check if needed
         if self._commandline_thumbgen == None:
             return
@@ -318,96 +1017,123 @@ class StreamsController(object):
         except OSError:
             pass
 
-        def preexec_fun():
-            ignored_pid.value = os.getpid()
-            set_pdeathsig(signal.SIGKILL)()
-
-
-        def pid_exists(pid):
-            """Check whether pid exists in the current process table.
-            UNIX only.
-            """
-            if pid < 0:
-                return False
-            if pid == 0:
-                # According to "man 2 kill" PID 0 refers to every process
-                # in the process group of the calling process.
-                # On certain systems 0 is a valid PID but we have no way
-                # to know that in a portable fashion.
-                raise ValueError('invalid PID 0')
-            try:
-                os.kill(pid, 0)
-            except OSError as err:
-                if err.errno == errno.ESRCH:
-                    # ESRCH == No such process
-                    return False
-                elif err.errno == errno.EPERM:
-                    # EPERM clearly means there's a process to deny access to
-                    return True
-                else:
-                    # According to "man 2 kill" possible error values are
-                    # (EINVAL, EPERM, ESRCH)
-                    raise
-            else:
-                return True
-
-        kwargs = {'cwd': self.settings.output_path, 'close_fds': True, 'preexec_fn': preexec_fun}
+        kwargs = {'cwd': self.settings.output_path, 'close_fds': True, 'preexec_fn': set_pdeathsig(signal.SIGKILL)}
         if self.settings.debug_thumbnail:
             print 'Thumbnail command:', self._commandline_thumbgen
         else:
-            kwargs.update({'stdout':DEVNULL, 'stderr': DEVNULL})
+            kwargs.update({'stdout': devnull(), 'stderr': devnull()})
 
-        # we will generate thumbnail with max waiting time 30s
-        thumbnail_generator = Popen(self._commandline_thumbgen, **kwargs)
+        if self.settings.persistent_thumbnailer:
+            kwargs['stdout'] = PIPE
 
-        count = 30
-        while count > 0:
-            sleep(1)
+        try:
+            thumbnail_generator = self._spawn('thumbnail', self._commandline_thumbgen, **kwargs)
+        except OSError as e:
+            print 'Cannot start thumbnail generator: %s' % str(e)
+            return
 
-            # there is bug in poll() :(
-            # so we have to do basic pid checking
+        self._thumbnail_pid = thumbnail_generator.pid
 
-            pool_result = pid_exists(thumbnail_generator.pid)
+        if self.settings.persistent_thumbnailer:
+            # it runs as long as the channel, frames arrive through the pipe
+            self._thumbnail_pipe = thumbnail_generator.stdout
+            fd = self._thumbnail_pipe.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            return
 
-            # pool_result = thumbnail_generator.poll()
+        # we will generate thumbnail with max waiting time 30s
+        self._thumbnail_deadline = now + internal_settings.THUMBNAIL_TIMEOUT
 
-            if self.settings.debug_thumbnail:
-                print 'Thumbnail code:', pool_result
+    def start(self):
+        """Starts ffmpeg and packager and returns immediately.
 
-            if not pool_result:
-                self._move_thumbnail()
-                return
-            
-            count -= 1
+        With probe_source ffprobe is started first, as a child like the others, and the rest
+        once it has exited (or has been killed after PROBE_KILL_TIMEOUT). Children have to be
+        reaped by whoever drives this controller (see child_exited() and supervisor.Supervisor).
+
+        A fifo input_stream (ingest.IngestHub consumer, pool.WarmPool slot) has to have a single
+        reader, SharedFifoInput is raised if ffprobe or several encoders would read it.
+        """
+        self._check_fifo_input()
+
+        if self.settings.probe_source and self._start_probe():
+            self.running = True
+            return
 
+        self._start_processes()
+
+    def _check_fifo_input(self):
         try:
-            thumbnail_generator.terminate()
-        except OSError:
-            pass
+            is_fifo = stat.S_ISFIFO(os.stat(self.settings.input_stream).st_mode)
+        except (OSError, TypeError): # urls, devices which are not there yet
+            return
 
+        if not is_fifo:
+            return
 
-    def run(self):
+        if self.settings.probe_source:
+            raise SharedFifoInput('%s is a fifo, it cannot be read by ffprobe and the encoder' % self.settings.input_stream)
+        if len(self._encoder_groups()) > 1:
+            raise SharedFifoInput('%s is a fifo, it cannot be read by an encoder per stream' % self.settings.input_stream)
+
+    def _start_processes(self):
+        if self.settings.port_allocator != None:
+            self._reserve_ports()
+
+        # ports, cpus, fifos and staging taken so far are given back by stop()
+        try:
+            self._start_reserved()
+        except Exception:
+            self.stop()
+            raise
+
+    def _start_reserved(self):
         self._assign_ports()
+        if self.settings.transport == internal_settings.TRANSPORT_FIFO:
+            self._create_fifos()
+
+        if self.settings.scheduler != None:
+            self._schedule_encoders()
+
+        self._progress = dict((role, telemetry.ProgressReader(role)) for role, _streams in self._encoder_groups())
+        self._services = self._progress.values()
+
         self._build_commandlines()
 
+        if self.settings.staging_path != None:
+            import tempfile
+            self._staging_directory = tempfile.mkdtemp(prefix='dashsegmenter-', dir=self.settings.staging_path)
+
         KWARGS_ARGS_BASE = {'cwd': self.settings.output_path, 'preexec_fn': set_pdeathsig(signal.SIGKILL)}
-        KWARGS_ARGS_NORMAL = {'stdout': DEVNULL, 'stderr': DEVNULL}
+        KWARGS_ARGS_NORMAL = {'stdout': devnull(), 'stderr': devnull()}
 
         KWARGS_FFMPEG, KWARGS_PACKAGER = KWARGS_ARGS_BASE.copy(), KWARGS_ARGS_BASE.copy()
+        KWARGS_PACKAGER['cwd'] = self._packager_path
 
-        if self.settings.debug_ffmpeg:
-            print 'FFmpeg commandline:', self._commandline_ffmpeg
-        else:
+        if not self.settings.debug_ffmpeg:
             KWARGS_FFMPEG.update(KWARGS_ARGS_NORMAL)
 
+        self.running = True
+        self._processes = {}
+        self._restarts = {}
 
-        # start ffmpeg (media converter)
-        try:
-            ffmpeg = Popen(self._commandline_ffmpeg, **KWARGS_FFMPEG)
-        except OSError as e:
-            print 'Cannot start ffmpeg: %s' % str(e)
+        # start ffmpeg (media converter), one process per encoder group
+        for role, commandline in self._commandlines_ffmpeg:
+            if self.settings.debug_ffmpeg:
+                print 'FFmpeg commandline:', commandline
+
+            KWARGS_FFMPEG['preexec_fn'] = self._encoder_preexec(role)
+            self._processes[role] = (commandline, KWARGS_FFMPEG.copy())
 
-            sys.exit(1)
+            try:
+                self._spawn(role, commandline, **KWARGS_FFMPEG)
+            except OSError as e:
+                self.stop()
+                raise ProcessStartFailed('Cannot start ffmpeg: %s' % str(e))
+            finally:
+                # a restarted encoder writes to the same pipe:N, so the write end has to stay open
+                if not self.settings.restart_processes:
+                    self._progress[role].close_write_end()
 
         # start packager (segmenter)
         if self._commandline_packager:
@@ -416,17 +1142,336 @@ class StreamsController(object):
             else:
                 KWARGS_PACKAGER.update(KWARGS_ARGS_NORMAL)
 
+            self._processes['packager'] = (self._commandline_packager, KWARGS_PACKAGER)
+
             try:
-                packager = Popen(self._commandline_packager, **KWARGS_PACKAGER)
+                self._spawn('packager', self._commandline_packager, **KWARGS_PACKAGER)
             except OSError as e:
-                print 'Cannot start packager (did you run autoinstall.sh script?): %s' % str(e)
+                self.stop()
+                raise ProcessStartFailed('Cannot start packager (did you run autoinstall.sh script?): %s' % str(e))
 
-                sys.exit(1)
+        if self.settings.restart_processes:
+            self._restarts = dict((role, restarts.ProcessRestarts(role)) for role in self._processes)
 
+        services = self._create_services()
+        self._services.extend(services)
+        for service in services:
+            service.start()
 
-        # it never returns, will be killed with child_exit_handler or my process will be killed :<
-        # so, we can do thumbnail creation here in rather ugly way (timings wont be accurate)
-        while True:
-            sleep(self.settings.thumbnail_interval)
-            self._generate_thumbnail()
-            
\ No newline at end of file
+        if self._trickplay != None:
+            self._start_trickplay()
+
+        self._next_thumbnail = time()
+
+        # one-shot thumbnails need the stream to run for a while, persistent thumbnailer is started right away
+        if not self.settings.persistent_thumbnailer:
+            self._next_thumbnail += self.settings.thumbnail_interval
+
+    def attach_input(self, source):
+        """Feeds source to a running channel whose input_stream is a fifo (a warm pool.WarmPool slot).
+
+        The feeder remuxes source into the fifo, it is restarted like the encoders; startup latency
+        is measured from now on.
+        """
+        commandline = command_templates.FFMPEG_TEMPLATE_INGEST.compiled.eval({'INPUT_STREAM': source,
+            'OUTPUT_FILE': self.settings.input_stream})
+        kwargs = {'close_fds': True, 'preexec_fn': set_pdeathsig(signal.SIGKILL)}
+        if self.settings.debug_ffmpeg:
+            print 'Feeder commandline:', commandline
+        else:
+            kwargs.update({'stdout': devnull(), 'stderr': devnull()})
+
+        self._processes['feeder'] = (commandline, kwargs)
+        if self.settings.restart_processes:
+            self._restarts['feeder'] = restarts.ProcessRestarts('feeder')
+
+        try:
+            self._spawn('feeder', commandline, **kwargs)
+        except OSError as e:
+            self.stop()
+            raise ProcessStartFailed('Cannot start feeder: %s' % str(e))
+
+        if self._startup != None:
+            self._startup.reset(time())
+
+    def stop(self):
+        """Kills all children of this channel; they still have to be reaped."""
+        self.running = False
+        self._close_thumbnail_pipe()
+        self._close_probe_pipe()
+        self._probe_deadline = None
+        self._remove_fifos()
+
+        # the publisher drains what is queued from staging, so staging goes only after it
+        for service in self._services:
+            service.stop()
+        self._services = []
+        self._remove_staging()
+
+        if self.settings.scheduler != None:
+            self._release_cpus()
+
+        if self.settings.port_allocator != None:
+            self._release_ports()
+
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def child_exited(self, pid, status):
+        """Called after one of our children has been reaped.
+
+        Thumbnail generator exits are expected (a persistent one is restarted on the next
+        thumbnail slot). A died ffmpeg or packager is restarted alone with backoff (see
+        restarts.ProcessRestarts); without restart_processes, or once it crash loops, the
+        whole channel goes down.
+
+        Fifos and the progress pipes outlive the processes, so the rest of the channel keeps
+        running while one of them is restarted.
+        """
+        role = self._children.pop(pid, None)
+
+        process = self._popens.pop(pid, None)
+        if process != None:
+            mark_reaped(process, status)
+
+        if role == 'probe':
+            self._probe_exited(process.returncode if process != None else -1)
+        elif role == 'thumbnail':
+            self._thumbnail_pid = None
+            self._thumbnail_deadline = None
+
+            if self.settings.debug_thumbnail:
+                print 'Thumbnail code:', status
+
+            if self.settings.persistent_thumbnailer:
+                self._close_thumbnail_pipe()
+            elif self.running and exited_cleanly(status):
+                self._move_thumbnail()
+        elif role != None and self.running:
+            process_restarts = self._restarts.get(role)
+
+            if process_restarts == None:
+                print '%s of channel %s has died (status %s)' % (role, self.settings.output_path, status)
+                self._give_up(role)
+            elif not process_restarts.failed(time()):
+                print '%s of channel %s is crash looping (status %s), giving up' % (role, self.settings.output_path, status)
+                self._give_up(role)
+            else:
+                print '%s of channel %s has died (status %s), restarting it in %.1fs' % (role, self.settings.output_path,
+                    status, process_restarts.restart_at - time())
+
+                if role in self._progress:
+                    self._progress[role].reset()
+
+    def _give_up(self, role):
+        # storyboards are optional, the channel goes on without them
+        if role == 'trickplay':
+            self._restarts.pop(role, None)
+            return
+
+        self.stop()
+
+    def _restart(self, role, now):
+        commandline, kwargs = self._processes[role]
+
+        try:
+            process = self._spawn(role, commandline, **kwargs)
+        except OSError as e:
+            print 'Cannot restart %s of channel %s: %s' % (role, self.settings.output_path, e)
+
+            if not self._restarts[role].failed(now):
+                self._give_up(role)
+            return
+
+        if role == 'trickplay':
+            self._trickplay.attach(process.stdout)
+
+        self._restarts[role].started(now)
+
+    def _check_recovered(self, role, now):
+        # restarted encoder has to report progress, restarted packager has to write the MPD
+        process_restarts = self._restarts[role]
+
+        if role == 'feeder':
+            working = any(progress.stats.get('updated', 0) >= process_restarts.started_at for progress in self._progress.itervalues())
+        elif role == 'trickplay':
+            working = self._trickplay.last_frame != None and self._trickplay.last_frame >= process_restarts.started_at
+        elif role == 'packager':
+            try:
+                working = os.stat(os.path.join(self._packager_path, internal_settings.MPD_FILENAME)).st_mtime >= process_restarts.started_at
+            except OSError:
+                working = False
+        else:
+            working = self._progress[role].stats.get('updated', 0) >= process_restarts.started_at
+
+        if working:
+            process_restarts.recovered(now)
+            print '%s of channel %s recovered in %.2fs' % (role, self.settings.output_path, process_restarts.recovery_time)
+
+    def stats(self):
+        """Returns latest encoder progress: process name -> stats dict (fps, speed, out_time, bitrate_kbps, ...).
+
+        Restarted processes also have restarts, unrecovered_restarts and recovery_seconds (time from failure
+        to working again),
+        with measure_latency packager has first_chunk_latency and segment_latency (see latency.SegmentLatency),
+        with staging_path publisher has publish_queue_depth and flush_latency (see publish.SegmentPublisher),
+        with inspect_segments segments:<stream type>:<stream name> has segment durations, drift and bitrate (see inspector.SegmentInspector),
+        with measure_latency channel has start_to_first_segment and start_to_first_mpd once they are known
+        (see latency.StartupLatency).
+        """
+        stats = dict((role, dict(progress.stats)) for role, progress in self._progress.iteritems())
+
+        for role, process_restarts in self._restarts.iteritems():
+            stats.setdefault(role, {}).update(process_restarts.stats)
+
+        if self._latency != None:
+            stats.setdefault('packager', {}).update(self._latency.stats)
+
+        if self._publisher != None:
+            stats['publisher'] = self._publisher.stats
+
+        if self._inspector != None:
+            stats.update(self._inspector.stats)
+
+        if self._startup != None and self._startup.stats:
+            stats['channel'] = self._startup.stats
+
+        return stats
+
+    def _create_services(self):
+        """Helpers living as long as the channel, driven through fds/handle_readable/next_deadline/tick."""
+        services = []
+
+        if self.settings.timeshift_window != None or self.settings.disk_budget != None:
+            import retention
+            services.append(retention.SegmentRetention(self.settings.output_path, self._streams, self.settings.chunk_interval,
+                self.settings.timeshift_window, self.settings.disk_budget))
+
+        self._publisher = None
+        if self._staging_directory != None:
+            import publish
+            target = self.settings.publish_target if self.settings.publish_target != None else publish.DirectoryTarget(self.settings.output_path)
+            self._publisher = publish.SegmentPublisher(self._staging_directory, target, self.settings.publish_threads)
+            services.append(self._publisher)
+
+        self._trickplay = None
+        if self.settings.trickplay:
+            import trickplay
+            window = self.settings.timeshift_window if self.settings.timeshift_window != None else internal_settings.TRICKPLAY_WINDOW
+            width, height = self._trickplay_tile()
+
+            try:
+                self._trickplay = trickplay.Storyboard(self.settings.output_path, width, height, self.settings.trickplay_interval,
+                    window, self._ingest_start)
+                services.append(self._trickplay)
+            except trickplay.TrickplayUnavailable as e:
+                print 'Trickplay of channel %s is disabled: %s' % (self.settings.output_path, e)
+
+        self._startup = None
+        self._latency = None
+        if self.settings.measure_latency:
+            import latency
+            self._startup = latency.StartupLatency(self.settings.output_path, self._streams)
+            self._latency = latency.SegmentLatency(self.settings.output_path, self._streams, self.settings.chunk_interval,
+                self._ingest_start)
+            services.extend([self._startup, self._latency])
+
+        self._inspector = None
+        if self.settings.inspect_segments:
+            import inspector
+            self._inspector = inspector.SegmentInspector(self.settings.output_path, self._streams, self.settings.chunk_interval)
+            services.append(self._inspector)
+
+        return services
+
+    def _next_thumbnail_deadline(self):
+        if self._commandline_thumbgen == None:
+            return None
+
+        if self._thumbnail_pid != None:
+            return self._thumbnail_deadline
+
+        return self._next_thumbnail
+
+    def next_deadline(self):
+        """Returns the time at which tick() has something to do, None if nothing is scheduled."""
+        if not self.running:
+            return None
+
+        if self._probe_deadline != None:
+            return self._probe_deadline
+
+        deadlines = [self._next_thumbnail_deadline()] + [service.next_deadline() for service in self._services]
+
+        for process_restarts in self._restarts.itervalues():
+            if process_restarts.restart_at != None:
+                deadlines.append(process_restarts.restart_at)
+            elif process_restarts.recovering:
+                deadlines.append(time() + internal_settings.RESTART_RECOVERY_POLL)
+        deadlines = [deadline for deadline in deadlines if deadline != None]
+
+        return min(deadlines) if deadlines else None
+
+    def tick(self, now):
+        """Does time based work: restarts, thumbnail generation, thumbnail generator timeouts and services."""
+        if not self.running:
+            return
+
+        # nothing else runs before probing is done
+        if self._probe_deadline != None:
+            if now >= self._probe_deadline:
+                print 'Probing %s timed out, killing ffprobe' % self.settings.input_stream
+                # still probing until it is reaped (see child_exited())
+                self._probe_deadline = now + internal_settings.PROBE_KILL_TIMEOUT
+
+                for pid, role in self._children.iteritems():
+                    if role == 'probe':
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except OSError:
+                            pass
+            return
+
+        for service in self._services:
+            service.tick(now)
+
+        for role, process_restarts in self._restarts.items():
+            if process_restarts.restart_at != None and now >= process_restarts.restart_at:
+                self._restart(role, now)
+            elif process_restarts.recovery_timed_out(now):
+                print '%s of channel %s has not recovered %ss after its restart' % (role, self.settings.output_path,
+                    internal_settings.RESTART_RECOVERY_TIMEOUT)
+            elif process_restarts.recovering:
+                self._check_recovered(role, now)
+
+            if not self.running:
+                return
+
+        if self._thumbnail_pid != None:
+            if self._thumbnail_deadline != None and now >= self._thumbnail_deadline:
+                try:
+                    os.kill(self._thumbnail_pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                self._thumbnail_deadline = None
+        elif now >= self._next_thumbnail:
+            self._generate_thumbnail(now)
+
+            # keep exact cadence, skipping slots we have already missed
+            interval = self.settings.thumbnail_interval
+            while self._next_thumbnail <= now:
+                self._next_thumbnail += interval
+
+    def run(self):
+        import supervisor
+
+        # it never returns, whole app exits when a child has died and cannot be restarted
+        # children will be killed with SIGKILL anyway (see set_pdeathsig)
+        channels = supervisor.Supervisor()
+        channels.add_controller(self)
+        channels.run()
+
+        sys.exit(1)
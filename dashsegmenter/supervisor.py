@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from time import time
+import os
+import errno
+import fcntl
+import math
+import select
+import signal
+import traceback
+
+import internal_settings
+import telemetry
+
+class ControllerAlreadyAdded(Exception):
+    pass
+
+class Supervisor(object):
+    """Runs many StreamsController instances (channels) in one process.
+
+    Every child pid is owned by exactly one channel; when a child dies only its
+    channel is torn down, the rest keeps running. ingest.IngestHub instances are
+    supervised the same way. An exception raised by a channel (start, tick, reading
+    its fds, handling a child exit) is printed and stops that channel only.
+
+    With a resources.ResourceSampler children of all channels are sampled from /proc,
+    its rates and totals show up in stats().
+
+    stats() and prometheus_metrics() read channel state, only call them from the thread running
+    run(). Other threads (origin.OriginServer serving /metrics) get metrics_snapshot().
+    """
+    def __init__(self, on_channel_exit=None, resource_sampler=None):
+        super(Supervisor, self).__init__()
+        self._controllers = []
+        self._failed = {} # controller stopped after raising -> its pids reaped since
+        self._on_channel_exit = on_channel_exit
+        self._resource_sampler = resource_sampler
+        self._metrics_snapshot = ''
+        self._next_snapshot = None
+
+    def add_controller(self, controller):
+        if controller in self._controllers:
+            raise ControllerAlreadyAdded()
+
+        self._controllers.append(controller)
+
+        return controller
+
+    @property
+    def controllers(self):
+        return list(self._controllers)
+
+    def owner(self, pid):
+        for controller in self._controllers:
+            if pid in controller.pids:
+                return controller
+
+        return None
+
+    def stop(self):
+        """Tears all channels down, run() returns once their children are reaped."""
+        for controller in self._controllers:
+            controller.stop()
+
+    def stats(self):
+        """Returns controller.name -> controller.stats() of every supervised channel."""
+        stats = dict((controller.name, controller.stats()) for controller in self._controllers)
+
+        if self._resource_sampler != None:
+            for sample in (self._resource_sampler.snapshot(), self._resource_sampler.counters()):
+                for channel, roles in sample.iteritems():
+                    if channel not in stats:
+                        continue
+
+                    for role, values in roles.iteritems():
+                        stats[channel].setdefault(role, {}).update(values)
+
+        return stats
+
+    def prometheus_metrics(self):
+        samples = []
+        for channel, processes in sorted(self.stats().iteritems()):
+            for process, stats in sorted(processes.iteritems()):
+                samples.append((telemetry.subsystem(process), {'channel': channel, 'process': process}, stats))
+
+        return telemetry.prometheus_metrics(samples)
+
+    def metrics_snapshot(self):
+        """Returns prometheus_metrics() as taken by run() at most METRICS_SNAPSHOT_INTERVAL ago, from any thread."""
+        return self._metrics_snapshot
+
+    def _snapshot_metrics(self, now):
+        if self._next_snapshot != None and now < self._next_snapshot:
+            return
+
+        self._next_snapshot = now + internal_settings.METRICS_SNAPSHOT_INTERVAL
+
+        # built here and swapped in whole, readers never see a half updated text
+        try:
+            self._metrics_snapshot = self.prometheus_metrics()
+        except Exception as e:
+            print 'Cannot take metrics snapshot: %s' % e
+
+    def _start(self, controller):
+        # a misconfigured channel (no streams, missing binary, unreachable source, ...) must not
+        # take the other ones down
+        try:
+            controller.start()
+        except Exception as e:
+            print 'Channel %s failed to start: %s' % (controller.name, e)
+            controller.stop()
+
+    def _call(self, controller, action, method, *args):
+        """Calls a method of controller, a failing channel is stopped instead of taking run() down."""
+        try:
+            method(*args)
+        except Exception as e:
+            if controller in self._failed:
+                return
+
+            print 'Channel %s failed in %s: %s' % (controller.name, action, e)
+            traceback.print_exc()
+
+            # its state is unknown from now on, it is only waited for until its children are reaped
+            self._failed[controller] = set()
+            try:
+                controller.stop()
+            except Exception as e:
+                print 'Channel %s failed to stop: %s' % (controller.name, e)
+
+    def _reap(self):
+        # only our own children are waited for, so subprocess calls made by the host application
+        # are left alone; controllers keep their Popen objects, so subprocess does not reap them either
+        for controller in self._controllers:
+            for pid in controller.pids:
+                try:
+                    # wait4: /proc/<pid> is gone once reaped, its rusage is the final resource sample
+                    reaped, status, usage = os.wait4(pid, os.WNOHANG)
+                except OSError as e:
+                    if e.errno != errno.ECHILD:
+                        raise
+
+                    if controller in self._failed:
+                        self._failed[controller].add(pid)
+                        continue
+
+                    # someone else (os.wait() of the host application) got it, exit status is lost
+                    print 'Child %d of channel %s was reaped elsewhere' % (pid, controller.name)
+                    reaped, status, usage = pid, None, None
+
+                if reaped == pid:
+                    if self._resource_sampler != None:
+                        self._resource_sampler.process_exited(pid, usage, time())
+
+                    if controller in self._failed:
+                        self._failed[controller].add(pid)
+
+                    self._call(controller, 'child_exited', controller.child_exited, pid, status)
+
+    def _remove_finished(self):
+        for controller in list(self._controllers):
+            if controller in self._failed:
+                # its stop() may have raised as well, so only its children are waited for
+                if not set(controller.pids) <= self._failed[controller]:
+                    continue
+            elif controller.running or controller.pids:
+                continue
+
+            self._controllers.remove(controller)
+            self._failed.pop(controller, None)
+
+            if self._resource_sampler != None:
+                self._resource_sampler.forget(controller.name)
+
+            if self._on_channel_exit != None:
+                self._on_channel_exit(controller)
+
+    def _next_timeout(self):
+        deadlines = [controller.next_deadline() for controller in self._controllers
+                     if controller not in self._failed]
+        deadlines.append(self._next_snapshot)
+        if self._resource_sampler != None:
+            deadlines.append(self._resource_sampler.next_deadline())
+        deadlines = [deadline for deadline in deadlines if deadline != None]
+
+        if not deadlines:
+            return None
+
+        return max(0, min(deadlines) - time())
+
+    def _wait(self, wakeup_fd):
+        # sleeps until a child exits (SIGCHLD writes to wakeup_fd), one of the channels has data
+        # to read or the nearest channel deadline
+        # poll, not select: with hundreds of channels descriptors go past FD_SETSIZE
+        poller = select.poll()
+        poller.register(wakeup_fd, select.POLLIN)
+
+        owners = {}
+        for controller in self._controllers:
+            if controller in self._failed:
+                continue
+
+            for fd in controller.fds:
+                owners[fd] = controller
+                poller.register(fd, select.POLLIN)
+
+        timeout = self._next_timeout()
+        if timeout != None:
+            timeout = int(math.ceil(timeout * 1000))
+
+        try:
+            events = poller.poll(timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+            return
+
+        for fd, _event in events:
+            if fd != wakeup_fd:
+                # an earlier handler may have failed and stopped the channel
+                if owners[fd] not in self._failed:
+                    self._call(owners[fd], 'handle_readable', owners[fd].handle_readable, fd)
+                continue
+
+            try:
+                while os.read(wakeup_fd, 4096):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def run(self):
+        """Starts all channels and supervises them until every channel has exited.
+
+        Has to be called from the main thread (it installs a SIGCHLD handler for its duration).
+        """
+        wakeup_read, wakeup_write = os.pipe()
+        for fd in (wakeup_read, wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        previous_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        previous_wakeup_fd = signal.set_wakeup_fd(wakeup_write)
+
+        try:
+            for controller in self._controllers:
+                if not controller.running:
+                    self._start(controller)
+
+            while True:
+                self._reap()
+                self._remove_finished()
+
+                if not self._controllers:
+                    return
+
+                now = time()
+                for controller in self._controllers:
+                    if controller not in self._failed:
+                        self._call(controller, 'tick', controller.tick, now)
+
+                if self._resource_sampler != None:
+                    self._resource_sampler.tick(now, self._controllers)
+
+                self._snapshot_metrics(now)
+                self._wait(wakeup_read)
+        finally:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            signal.signal(signal.SIGCHLD, previous_handler)
+            os.close(wakeup_read)
+            os.close(wakeup_write)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# encoder telemetry read from ffmpeg -progress output
+
+from time import time
+import errno
+import fcntl
+import os
+
+# ffmpeg key -> (our name, parser)
+def _number(value):
+    return float(value)
+
+def _kbits(value):
+    return float(value[:-len('kbits/s')]) if value.endswith('kbits/s') else float(value)
+
+def _speed(value):
+    return float(value.rstrip('x'))
+
+def _seconds(value):
+    return int(value) / 1000000.0
+
+PROGRESS_KEYS = {
+    'frame': ('frame', _number),
+    'fps': ('fps', _number),
+    'bitrate': ('bitrate_kbps', _kbits),
+    'total_size': ('total_size', _number),
+    'out_time_us': ('out_time', _seconds),
+    'dup_frames': ('dup_frames', _number),
+    'drop_frames': ('drop_frames', _number),
+    'speed': ('speed', _speed),
+}
+
+class ProgressReader(object):
+    """Parses key=value blocks ffmpeg writes with -progress into the stats dict.
+
+    It is a controller service: the supervisor passes its fd to handle_readable()
+    whenever there is something to read, so parsing never blocks.
+    """
+    def __init__(self, name):
+        super(ProgressReader, self).__init__()
+        self.name = name
+        self.stats = {}
+
+        self._read_fd, self.write_fd = os.pipe()
+        fcntl.fcntl(self._read_fd, fcntl.F_SETFL, fcntl.fcntl(self._read_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        # no child gets either end, only the encoder clears close-on-exec of the write end (see inherit_write_end())
+        fcntl.fcntl(self._read_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+        self._buffer = ''
+        self._block = {}
+
+    @property
+    def progress_url(self):
+        return 'pipe:%d' % self.write_fd
+
+    def inherit_write_end(self):
+        """Has to be called in the encoder between fork and exec (preexec_fn), so it keeps progress_url open."""
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFD, 0)
+
+    def close_write_end(self):
+        """Has to be called once the encoder has been spawned with progress_url."""
+        if self.write_fd != None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.close_write_end()
+
+        if self._read_fd != None:
+            os.close(self._read_fd)
+            self._read_fd = None
+
+    @property
+    def fds(self):
+        return [] if self._read_fd == None else [self._read_fd]
+
+    def next_deadline(self):
+        return None
+
+    def tick(self, now):
+        pass
+
+    def handle_readable(self, fd):
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        if not data:
+            os.close(self._read_fd)
+            self._read_fd = None
+            return
+
+        self.feed(data)
+
+    def reset(self):
+        """Drops partial output of an encoder which has died, stats are kept."""
+        self._buffer = ''
+        self._block = {}
+
+    def feed(self, data):
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()
+
+        for line in lines:
+            key, _, value = line.strip().partition('=')
+
+            if key == 'progress':
+                self._block['updated'] = time()
+                self.stats = self._block
+                self._block = {}
+                continue
+
+            if key in PROGRESS_KEYS:
+                name, parse = PROGRESS_KEYS[key]
+            elif key.startswith('stream_') and key.endswith('_q'):
+                name, parse = key, _number
+            else:
+                continue
+
+            try:
+                self._block[name] = parse(value)
+            except ValueError:
+                self._block[name] = None # N/A
+
+# process name prefix (ffmpeg:video:720 -> ffmpeg) -> metric subsystem, others are named after the prefix
+SUBSYSTEMS = {
+    'ffmpeg': 'encoder',
+    'segments': 'inspector',
+    'source': 'ingest',
+    'consumer': 'ingest',
+}
+
+# stats which only grow (until the process restarts), exposed as counters
+COUNTERS = frozenset([
+    'frame', 'total_size', 'dup_frames', 'drop_frames', # ffmpeg -progress
+    'restarts', 'unrecovered_restarts', # restarts.ProcessRestarts
+    'published', 'publish_failures', # publish.SegmentPublisher
+    'invalid_segments', 'missing_key_frames', 'aligned_segments', 'misaligned_segments', # inspector.SegmentInspector
+    'bytes', 'drops', # ingest.IngestHub
+])
+
+def subsystem(process):
+    prefix = process.partition(':')[0]
+    return SUBSYSTEMS.get(prefix, prefix)
+
+def metric_name(subsystem, name):
+    """Returns (metric name, type); counters get the conventional _total suffix."""
+    if name.endswith('_total'):
+        return 'dashsegmenter_%s_%s' % (subsystem, name), 'counter'
+
+    if name in COUNTERS:
+        return 'dashsegmenter_%s_%s_total' % (subsystem, name), 'counter'
+
+    return 'dashsegmenter_%s_%s' % (subsystem, name), 'gauge'
+
+def prometheus_metrics(samples):
+    """Formats [(subsystem, labels dict, stats dict), ...] as Prometheus text exposition."""
+    lines = []
+    metrics = sorted(set((subsystem, name) for subsystem, _labels, stats in samples for name in stats))
+
+    for subsystem, name in metrics:
+        metric, metric_type = metric_name(subsystem, name)
+        lines.append('# TYPE %s %s' % (metric, metric_type))
+
+        for sample_subsystem, labels, stats in samples:
+            value = stats.get(name)
+            if sample_subsystem != subsystem or value == None:
+                continue
+
+            label_text = ','.join('%s="%s"' % (key, str(labels[key]).replace('\\', '\\\\').replace('"', '\\"')) for key in sorted(labels))
+            lines.append('%s{%s} %s' % (metric, label_text, repr(float(value))))
+
+    return '\n'.join(lines) + '\n'
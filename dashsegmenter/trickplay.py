@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# trickplay storyboards: sprite sheets of low resolution frames plus a WebVTT index
+
+from time import time
+import collections
+import errno
+import fcntl
+import os
+import struct
+import zlib
+
+import internal_settings
+
+class TrickplayUnavailable(Exception):
+    pass
+
+def _get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise TrickplayUnavailable('trickplay needs numpy')
+
+    return numpy
+
+def encode_png(image):
+    """Encodes an (height, width, 3) uint8 array as RGB PNG."""
+    numpy = _get_numpy()
+    height, width, _ = image.shape
+
+    # every scanline starts with filter type 0 (none)
+    raw = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return ''.join([
+        '\x89PNG\r\n\x1a\n',
+        chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk('IDAT', zlib.compress(raw.tobytes(), internal_settings.TRICKPLAY_COMPRESSION)),
+        chunk('IEND', ''),
+    ])
+
+def _timestamp(seconds):
+    milliseconds = int(round(seconds * 1000))
+    return '%02d:%02d:%02d.%03d' % (milliseconds // 3600000, milliseconds // 60000 % 60, milliseconds // 1000 % 60, milliseconds % 1000)
+
+class Storyboard(object):
+    """Tiles raw rgb24 frames of the trickplay decoder into sprite sheets as they arrive.
+
+    Only the sheet being filled is kept in memory (one numpy array, reused), the WebVTT index
+    lists the sheets of the last window seconds and older sheets are deleted, so memory and
+    disk use do not grow with the length of the stream. The sheet being filled is rewritten
+    with every tile, so previews are there right away.
+
+    It is a controller service; the controller spawns the decoder and attach()es its stdout.
+    """
+    def __init__(self, output_path, tile_width, tile_height, interval, window, clock=None):
+        super(Storyboard, self).__init__()
+        self.output_path = output_path
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.interval = interval
+        self.clock = clock # callable returning wall time of media time 0, None if unknown
+
+        self.columns = internal_settings.TRICKPLAY_COLUMNS
+        self.rows = internal_settings.TRICKPLAY_ROWS
+        self.frame_size = tile_width * tile_height * 3
+
+        sheet_duration = interval * self.columns * self.rows
+        # (sheet number, [(start, end, tile)]) of sheets in the window
+        self._sheets = collections.deque(maxlen=int(-(-window // sheet_duration)) + 1)
+
+        self._numpy = _get_numpy()
+        self._sheet = None
+        self._sheet_number = 0
+        self._tiles = 0
+        self._frames = 0
+
+        self._pipe = None
+        self._buffer = bytearray()
+        self.last_frame = None # time the latest frame arrived
+
+        self._offset = 0 # added to the encoder clock once it went back (restarted encoder)
+        self._last_start = None
+
+    def attach(self, pipe):
+        self.detach()
+        self._pipe = pipe
+        self._buffer = bytearray()
+
+        fd = pipe.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def detach(self):
+        if self._pipe != None:
+            self._pipe.close()
+            self._pipe = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.detach()
+
+    @property
+    def fds(self):
+        return [] if self._pipe == None else [self._pipe.fileno()]
+
+    def next_deadline(self):
+        return None
+
+    def tick(self, now):
+        pass
+
+    def handle_readable(self, fd):
+        try:
+            data = os.read(fd, max(65536, self.frame_size - len(self._buffer)))
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        if not data:
+            self.detach()
+            return
+
+        self._buffer.extend(data)
+
+        while len(self._buffer) >= self.frame_size:
+            frame = self._buffer[:self.frame_size]
+            del self._buffer[:self.frame_size]
+            self.add_frame(frame, time())
+
+    def _media_time(self, now):
+        ingest_start = self.clock() if self.clock != None else None
+        if ingest_start == None:
+            # no encoder clock: frames come every interval since the first one
+            return self._frames * self.interval
+
+        # a restarted encoder starts out_time over, cues continue after the latest one
+        start = max(0, now - ingest_start) + self._offset
+        if self._last_start != None and start < self._last_start:
+            self._offset += self._last_start + self.interval - start
+            start = self._last_start + self.interval
+
+        self._last_start = start
+
+        return start
+
+    def add_frame(self, frame, now):
+        numpy = self._numpy
+        start = self._media_time(now)
+        self._frames += 1
+        self.last_frame = now
+
+        if self._sheet is None: # numpy arrays compare elementwise
+            self._sheet = numpy.zeros((self.rows * self.tile_height, self.columns * self.tile_width, 3), dtype=numpy.uint8)
+
+        if self._tiles == 0:
+            self._sheet_number += 1
+            self._sheet.fill(0)
+            if len(self._sheets) == self._sheets.maxlen:
+                self._remove_sheet(self._sheets[0][0])
+            self._sheets.append((self._sheet_number, []))
+
+        row, column = divmod(self._tiles, self.columns)
+        x, y = column * self.tile_width, row * self.tile_height
+        self._sheet[y:y + self.tile_height, x:x + self.tile_width] = \
+            numpy.frombuffer(frame, dtype=numpy.uint8).reshape(self.tile_height, self.tile_width, 3)
+
+        self._sheets[-1][1].append((start, start + self.interval, (x, y)))
+        self._tiles = (self._tiles + 1) % (self.columns * self.rows)
+
+        self._write(internal_settings.TRICKPLAY_SHEET_NAME % self._sheet_number, encode_png(self._sheet))
+        self._write(internal_settings.TRICKPLAY_VTT_FILENAME, self.webvtt())
+
+    def webvtt(self):
+        lines = ['WEBVTT', '']
+
+        for number, cues in self._sheets:
+            name = internal_settings.TRICKPLAY_SHEET_NAME % number
+            for start, end, (x, y) in cues:
+                lines.append('%s --> %s' % (_timestamp(start), _timestamp(end)))
+                lines.append('%s#xywh=%d,%d,%d,%d' % (name, x, y, self.tile_width, self.tile_height))
+                lines.append('')
+
+        return '\n'.join(lines)
+
+    def _write(self, name, data):
+        # rename, so neither players nor the origin see a half written file
+        path = os.path.join(self.output_path, name)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            print 'Cannot write %s: %s' % (name, e)
+
+    def _remove_sheet(self, number):
+        try:
+            os.unlink(os.path.join(self.output_path, internal_settings.TRICKPLAY_SHEET_NAME % number))
+        except OSError:
+            pass
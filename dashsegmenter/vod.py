@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of dashsegmenter project
+# http://github.com/Teeed/dashsegmenter
+#
+# The MIT License (MIT)
+# 
+# Copyright (c) 2014 Tadeusz Magura-Witkowski
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# VOD: transcode and package whole files as fast as the machine allows
+
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
+from time import time
+import bisect
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import internal_settings
+import command_templates
+import streams
+from streams import VideoStream
+
+class ThumbnailStreamInLadder(Exception):
+    pass
+
+class VodJob(object):
+    def __init__(self, input_file, output_path, streams):
+        super(VodJob, self).__init__()
+        self.input_file = input_file
+        self.output_path = output_path
+        self.streams = list(streams)
+
+        self.commandline_ffmpeg = None
+        self.commandline_packager = None
+
+class VodResult(object):
+    def __init__(self, job):
+        super(VodResult, self).__init__()
+        self.input_file = job.input_file
+        self.output_path = job.output_path
+        self.success = False
+        self.error = None
+        self.encode_time = None
+        self.package_time = None
+        self.total_time = None
+        self.chunks = None
+
+    def __repr__(self):
+        return '<VodResult %s success=%s error=%r total_time=%s>' % (self.input_file, self.success, self.error, self.total_time)
+
+def default_processes():
+    return max(1, multiprocessing.cpu_count() // internal_settings.VOD_THREADS_PER_JOB)
+
+class VodBatch(object):
+    """Transcodes many input files with the same ladder on a bounded pool.
+
+    Every job runs ffmpeg without realtime pacing into intermediate files and then
+    the packager with the on-demand profile. run() returns a VodResult per job
+    instead of exiting.
+    """
+    def __init__(self, streams, processes=None, segment_duration=None, debug=False):
+        super(VodBatch, self).__init__()
+        self.streams = list(streams)
+        self.segment_duration = segment_duration if segment_duration != None else internal_settings.VOD_SEGMENT_DURATION
+        self.processes = processes if processes != None else default_processes()
+        self.debug = debug
+        self._jobs = []
+
+        for stream in self.streams:
+            if getattr(stream, 'is_thumbnail_source', False):
+                raise ThumbnailStreamInLadder(stream.name)
+
+    def add_job(self, input_file, output_path):
+        job = VodJob(input_file, output_path, self.streams)
+        self._jobs.append(job)
+
+        return job
+
+    def _build_commandlines(self, job, intermediate_path):
+        # streams are shared by all jobs, so commandlines are built up front, one job at a time
+        for stream in job.streams:
+            stream.local_path = os.path.join(intermediate_path, internal_settings.VOD_INTERMEDIATE_NAME % (stream.stream_type, stream.name))
+
+            # subsegments can only start at key frames, scene cuts must not shift them
+            if isinstance(stream, VideoStream):
+                stream.key_frame_interval = self.segment_duration
+                stream.force_key_frames = 'expr:gte(t,n_forced*%s)' % self.segment_duration
+
+        try:
+            ffmpeg_stream_definitions = []
+
+            for stream in job.streams:
+                ffmpeg_stream_definitions.extend(stream.ffmpeg_definition)
+
+            values = {
+                'INPUT_STREAM': os.path.abspath(job.input_file),
+                'OUTPUT_DEFINITIONS': ffmpeg_stream_definitions,
+            }
+            job.commandline_ffmpeg = command_templates.FFMPEG_TEMPLATE_VOD.compiled.eval(values)
+            job.commandline_packager = self._packager_commandline(job.streams)
+        finally:
+            for stream in job.streams:
+                stream.local_path = None
+                stream.force_key_frames = None
+
+                if isinstance(stream, VideoStream):
+                    stream.key_frame_interval = None
+
+    def _packager_commandline(self, streams):
+        values = {
+            'STREAM_DEFINITIONS': [stream.vod_packager_definition for stream in streams],
+            'PROFILE': internal_settings.VOD_DASH_PROFILE,
+            'MPD_FILENAME': internal_settings.MPD_FILENAME,
+            'SEGMENT_DURATION_CONFIG': {
+                'SEGMENT_DURATION': self.segment_duration,
+            },
+            'SINGLE_SEGMENT_CONFIG': {
+                'SINGLE_SEGMENT': internal_settings.VOD_SINGLE_SEGMENT,
+            },
+            'TIME_SHIFT_BUFFER': [],
+            'LOW_LATENCY': [],
+        }
+
+        return command_templates.PACKAGER_TEMPLATE.compiled.eval(values)
+
+    def _execute(self, commandline, cwd):
+        kwargs = {'cwd': cwd, 'close_fds': True}
+        if self.debug:
+            print 'VOD commandline:', commandline
+        else:
+            kwargs.update({'stdout': streams.devnull(), 'stderr': streams.devnull()})
+
+        return Popen(commandline, **kwargs).wait()
+
+    def _run_job(self, work_item):
+        job, intermediate_path = work_item
+        result = VodResult(job)
+        started = time()
+
+        try:
+            returncode = self._execute(job.commandline_ffmpeg, job.output_path)
+            result.encode_time = time() - started
+            if returncode != 0:
+                result.error = 'ffmpeg exited with %s' % returncode
+                return result
+
+            package_started = time()
+            returncode = self._execute(job.commandline_packager, job.output_path)
+            result.package_time = time() - package_started
+            if returncode != 0:
+                result.error = 'packager exited with %s' % returncode
+                return result
+
+            result.success = True
+        except OSError as e:
+            result.error = str(e)
+        finally:
+            shutil.rmtree(intermediate_path, ignore_errors=True)
+            result.total_time = time() - started
+
+        return result
+
+    def run(self):
+        """Runs all added jobs and returns their VodResults in the order they were added."""
+        work = []
+        for job in self._jobs:
+            intermediate_path = tempfile.mkdtemp(prefix='.vod-', dir=os.path.abspath(job.output_path))
+            self._build_commandlines(job, intermediate_path)
+            work.append((job, intermediate_path))
+
+        pool = ThreadPool(self.processes)
+        try:
+            return pool.map(self._run_job, work)
+        finally:
+            pool.close()
+            pool.join()
+
+def chunk_boundaries(keyframes, duration, chunk_duration, segment_duration):
+    """Returns start times of chunks a file of duration seconds is cut into.
+
+    Every boundary is a multiple of segment_duration (so forced keyframes and segment
+    boundaries are the same as in a single pass encode); among the multiples near
+    chunk_duration the one closest to a source keyframe (sorted keyframes) is taken,
+    so seeking to it decodes as little as possible.
+    """
+    search = max(1, int(chunk_duration / segment_duration / 4))
+    starts = [0.0]
+
+    while True:
+        target = starts[-1] + chunk_duration
+        if target >= duration - segment_duration:
+            return starts
+
+        middle = int(round(target / segment_duration))
+        candidates = [number * segment_duration for number in range(middle - search, middle + search + 1)
+            if number * segment_duration > starts[-1] and number * segment_duration < duration]
+
+        def score(candidate):
+            index = bisect.bisect_left(keyframes, candidate)
+            nearest = [abs(keyframes[i] - candidate) for i in (index - 1, index) if 0 <= i < len(keyframes)]
+            return (min(nearest) if nearest else 0, abs(candidate - target))
+
+        starts.append(min(candidates, key=score))
+
+class ChunkedTranscoder(VodBatch):
+    """Transcodes one long file in parallel: split at GOP aligned points, encode, concatenate, package.
+
+    Video is encoded in chunks of about chunk_duration seconds on the pool with keyframes forced
+    every segment_duration; audio is encoded in one pass next to them (separately encoded AAC
+    chunks would have priming gaps at every join). Per stream chunks are joined with the concat
+    demuxer and packaged like a VodBatch job.
+    """
+    def __init__(self, streams, processes=None, chunk_duration=None, segment_duration=None, debug=False):
+        super(ChunkedTranscoder, self).__init__(streams, processes, segment_duration, debug)
+        self.chunk_duration = chunk_duration if chunk_duration != None else internal_settings.VOD_CHUNK_DURATION
+
+        self.video_streams = [stream for stream in self.streams if isinstance(stream, VideoStream)]
+        self.audio_streams = [stream for stream in self.streams if not isinstance(stream, VideoStream)]
+
+    def probe(self, input_file):
+        """Returns (sorted video keyframe times, duration) of input_file."""
+        commandline = command_templates.FFPROBE_TEMPLATE_KEYFRAMES.compiled.eval({'INPUT_STREAM': input_file})
+        output, _ = Popen(commandline, stdout=PIPE, stderr=streams.devnull(), close_fds=True).communicate()
+
+        keyframes = []
+        duration = None
+        for line in output.splitlines():
+            fields = line.strip().split(',')
+            try:
+                if len(fields) == 1 and fields[0]:
+                    duration = float(fields[0])
+                elif len(fields) >= 2 and 'K' in fields[1]:
+                    keyframes.append(float(fields[0]))
+            except ValueError:
+                continue
+
+        if duration == None:
+            raise ValueError('Cannot probe duration of %s' % input_file)
+
+        return sorted(keyframes), duration
+
+    def _with_streams(self, stream_list, local_path, force_key_frames, build):
+        for stream in stream_list:
+            stream.local_path = local_path(stream)
+            stream.force_key_frames = force_key_frames(stream) if force_key_frames != None else None
+
+            if isinstance(stream, VideoStream):
+                stream.key_frame_interval = self.segment_duration
+
+        try:
+            return build()
+        finally:
+            for stream in stream_list:
+                stream.local_path = None
+                stream.force_key_frames = None
+
+                if isinstance(stream, VideoStream):
+                    stream.key_frame_interval = None
+
+    def _chunk_commandline(self, input_file, intermediate_path, index, start, duration):
+        def build():
+            values = {
+                'INPUT_STREAM': input_file,
+                'START': '%.6f' % start,
+                'DURATION': ['-t', '%.6f' % duration] if duration != None else [],
+                'OUTPUT_DEFINITIONS': sum((stream.ffmpeg_definition for stream in self.video_streams), []),
+            }
+            return command_templates.FFMPEG_TEMPLATE_VOD_CHUNK.compiled.eval(values)
+
+        return self._with_streams(self.video_streams,
+            lambda stream: os.path.join(intermediate_path, 'chunk%05d_%s' % (index, internal_settings.VOD_INTERMEDIATE_NAME % (stream.stream_type, stream.name))),
+            lambda stream: self._force_key_frames(start),
+            build)
+
+    def _force_key_frames(self, start):
+        # t counts from the start of the chunk (-ss before -i, -output_ts_offset only shifts muxed
+        # timestamps); shifted by start, keyframes land on the same multiples of segment_duration
+        # as in a single pass encode, whatever the frame rate (counting frames drifts at 29.97 fps)
+        first = int(math.ceil(start / self.segment_duration - 1e-6))
+        return 'expr:gte(t+%.6f,(n_forced+%d)*%s)' % (start, first, self.segment_duration)
+
+    def _intermediate_name(self, intermediate_path, stream):
+        return os.path.join(intermediate_path, internal_settings.VOD_INTERMEDIATE_NAME % (stream.stream_type, stream.name))
+
+    def _concat_commandline(self, intermediate_path, stream, chunks):
+        list_file = os.path.join(intermediate_path, '%s_%s.txt' % (stream.stream_type, stream.name))
+        with open(list_file, 'w') as f:
+            for index in range(chunks):
+                f.write("file '%s'\n" % os.path.join(intermediate_path, 'chunk%05d_%s' % (index, internal_settings.VOD_INTERMEDIATE_NAME % (stream.stream_type, stream.name))))
+
+        values = {
+            'INPUT_LIST': list_file,
+            'STREAM_CONTAINER': internal_settings.STREAM_CONTAINER,
+            'OUTPUT_STREAM': self._intermediate_name(intermediate_path, stream),
+        }
+        return command_templates.FFMPEG_TEMPLATE_CONCAT.compiled.eval(values)
+
+    def _run_parallel(self, pool, commandlines, cwd):
+        returncodes = pool.map(lambda commandline: self._execute(commandline, cwd), commandlines)
+        failed = [code for code in returncodes if code != 0]
+
+        return 'ffmpeg exited with %s' % failed[0] if failed else None
+
+    def transcode(self, input_file, output_path):
+        """Transcodes and packages input_file into output_path, returns VodResult."""
+        input_file = os.path.abspath(input_file)
+        output_path = os.path.abspath(output_path)
+
+        result = VodResult(VodJob(input_file, output_path, self.streams))
+        started = time()
+        intermediate_path = tempfile.mkdtemp(prefix='.vod-', dir=output_path)
+        pool = ThreadPool(self.processes)
+
+        try:
+            keyframes, duration = self.probe(input_file)
+            starts = chunk_boundaries(keyframes, duration, self.chunk_duration, self.segment_duration)
+            result.chunks = len(starts)
+
+            commandlines = []
+            if self.video_streams:
+                for index, start in enumerate(starts):
+                    chunk_duration = starts[index + 1] - start if index + 1 < len(starts) else None
+                    commandlines.append(self._chunk_commandline(input_file, intermediate_path, index, start, chunk_duration))
+
+            if self.audio_streams:
+                def build():
+                    values = {
+                        'INPUT_STREAM': input_file,
+                        'OUTPUT_DEFINITIONS': sum((stream.ffmpeg_definition for stream in self.audio_streams), []),
+                    }
+                    return command_templates.FFMPEG_TEMPLATE_VOD.compiled.eval(values)
+
+                commandlines.append(self._with_streams(self.audio_streams, lambda stream: self._intermediate_name(intermediate_path, stream), None, build))
+
+            result.error = self._run_parallel(pool, commandlines, output_path)
+            result.encode_time = time() - started
+            if result.error != None:
+                return result
+
+            commandlines = [self._concat_commandline(intermediate_path, stream, len(starts)) for stream in self.video_streams]
+            result.error = self._run_parallel(pool, commandlines, output_path)
+            if result.error != None:
+                return result
+
+            package_started = time()
+            commandline = self._with_streams(self.streams, lambda stream: self._intermediate_name(intermediate_path, stream), None,
+                lambda: self._packager_commandline(self.streams))
+            returncode = self._execute(commandline, output_path)
+            result.package_time = time() - package_started
+
+            if returncode != 0:
+                result.error = 'packager exited with %s' % returncode
+                return result
+
+            result.success = True
+        except (OSError, ValueError) as e:
+            result.error = str(e)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(intermediate_path, ignore_errors=True)
+            result.total_time = time() - started
+
+        return result